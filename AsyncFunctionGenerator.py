@@ -0,0 +1,95 @@
+"""
+AsyncFunctionGenerator.py
+"""
+import asyncio
+import functools
+
+
+class AsyncFunctionGenerator:
+
+    """
+    asyncio facade for FunctionGenerator. Every call runs on one I/O thread
+    per function generator (its usbtmc.session.Session, shared with the
+    usbtmc.aio.AsyncInstrument in self.instr and FunctionGenerator.submit),
+    so calls are serialized per device while the event loop
+    keeps running. Methods without an explicit wrapper below are wrapped on
+    access, e.g. ``await afgen.setOutput(1, 'ON')``.
+    """
+
+    def __init__(self, fgen):
+        """
+        :param fgen: an open FunctionGenerator
+        """
+        from usbtmc.aio import AsyncInstrument
+
+        self.fgen = fgen
+        self.instr = AsyncInstrument(fgen.instr, fgen.getSession())
+
+    @classmethod
+    async def open(cls, instrumentSelector, **kwargs):
+        """ open a function generator without blocking the event loop
+
+        Takes the same arguments as FunctionGenerator.
+        """
+        from FunctionGenerator import FunctionGenerator
+
+        loop = asyncio.get_running_loop()
+        fgen = await loop.run_in_executor(None, functools.partial(
+            FunctionGenerator, instrumentSelector, **kwargs))
+        return cls(fgen)
+
+    def run(self, method, *args, **kwargs):
+        """ run a blocking call on the I/O thread, returns an awaitable
+        """
+        return self.instr.run(method, *args, **kwargs)
+
+    async def write(self, command):
+        """ write SCPI cmd
+
+        :param str command: SCPI command
+        """
+        return await self.run(self.fgen.write, command)
+
+    async def ask(self, query):
+        """ write SCPI query and read the response
+
+        :param str query: SCPI query
+        :returns: response -- unicode response string
+        """
+        return await self.run(self.fgen.instr.ask, query)
+
+    async def readRaw(self, num=-1):
+        """ read binary data from the function generator
+
+        :param int num: (optional) number of bytes to read, default all
+        :returns: data -- bytes
+        """
+        return await self.run(self.fgen.instr.read_raw, num)
+
+    async def pushArbitraryWaveform(self, intWaveform, binary=False,
+                                    policy='reject'):
+        """ see FunctionGenerator.pushArbitraryWaveform()
+        """
+        return await self.run(self.fgen.pushArbitraryWaveform, intWaveform,
+                              binary, policy)
+
+    def __getattr__(self, name):
+        method = getattr(self.fgen, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        call.__doc__ = method.__doc__
+        return call
+
+    def close(self):
+        """ stop the I/O thread once queued calls have finished
+
+        The session is the function generator's own, so it is detached from
+        fgen first; a later fgen.submit() starts a new one.
+        """
+        with self.fgen.instr.io_lock:
+            if self.fgen.session is self.instr.session:
+                self.fgen.session = None
+        self.instr.close()
@@ -1,3 +1,28 @@
+from SettingsError import SettingsError
+from usbtmc.usbtmc import transaction
+
+
+class WaveformError(ValueError):
+
+    """
+    Raised when an arbitrary waveform can not be loaded as given.
+
+    :ivar reason: one of 'shape', 'length', 'dtype', 'range' or 'memory'
+    :ivar indices: indices of the offending points (empty for 'shape',
+    'length' and 'memory' errors)
+    """
+
+    def __init__(self, message, reason, indices=()):
+        self.reason = reason
+        self.indices = list(indices)
+        if self.indices:
+            shown = ", ".join(str(i) for i in self.indices[:10])
+            if len(self.indices) > 10:
+                shown += ", ... (%d total)" % len(self.indices)
+            message = message + " at index " + shown
+        ValueError.__init__(self, message)
+
+
 class FunctionGenerator:
 
     """
@@ -13,7 +38,23 @@ class FunctionGenerator:
     # Holds USBTMC addresses of fgen
     selectorMap = {1: "USB0::2391::8967::INSTR"}
 
-    def __init__(self, instrumentSelector):
+    # Limits on arbitrary waveforms accepted by loadArbitraryWaveform()
+    arbRange = (-2047, 2047)
+    arbLength = (8, 16000)
+
+    # Max waveforms pushCachedWaveform() keeps in volatile memory, None to be
+    # bounded by the instrument's free memory only
+    arbCacheLimit = None
+
+    # Fraction of the cache (volatile memory points, and arbCacheLimit) that
+    # is kept when pushCachedWaveform() has to evict
+    arbCacheKeep = 0.5
+
+    # SOURce subsystem roots that imply channel 1 when written bare
+    sourceRoots = ('APPL', 'FUNC', 'FREQ', 'VOLT', 'PHAS', 'BURS', 'AM', 'FM',
+                   'PM', 'FSK', 'BPSK', 'PWM', 'SUM', 'SWE', 'MARK', 'TRAC')
+
+    def __init__(self, instrumentSelector, shadow=False, fastConnect=False):
         """
         The constructor for the function generator object needs to know the
         USBTMC address of the device being used. The address can be directly
@@ -21,9 +62,16 @@ class FunctionGenerator:
 
         :param instrumentSelector: Either a string representing the USBTMC
         address of the function generator or a int identifier representing one
-        of the function generators.
+        of the function generators. An object with the usbtmc.Instrument
+        interface, such as InstrumentServer.RemoteInstrument, is used as is.
+        :param bool shadow: (optional, default False) keep a StateShadow of
+        the settings written through setOutput(), pushSin() and
+        loadSettings() and skip writes that would not change anything.
+        :param bool fastConnect: (optional, default False) skip the USB reset
+        when the interface is healthy and use cached USBTMC capabilities,
+        for short scripts that open the instrument many times.
         """
-        import usbtmc
+        from collections import OrderedDict
 
         # Check if instrumentSelector is a string or an int, assign/lookup
         # address as needed
@@ -33,8 +81,93 @@ class FunctionGenerator:
         elif(isinstance(instrumentSelector, str)):
             self.addr = instrumentSelector
             #print("str")
+        else:
+            # an already open instrument, e.g. an InstrumentServer client
+            self.addr = None
+            self.instr = instrumentSelector
+
+        if self.addr is not None:
+            import usbtmc
+            self.instr = usbtmc.Instrument(self.addr,
+                                           fast_connect=fastConnect)
+        self.byteOrder = None  # FORM:BORD last sent for binary transfers
+        self.arbCache = OrderedDict()  # sha1 -> int16 bytes, LRU first
+        self.arbFree = None  # free volatile points not used by arbCache
+        self.shadow = self.makeShadow() if shadow else None
+        self.compiler = None  # SettingsCompiler, created on first use
+        self.model = None  # model field of *IDN?, read on first use
+        self.session = None  # usbtmc Session, created by getSession()
+        self.tracer = None  # SpanTracer, set by setTracer()
+        self.metrics = None  # usbtmc.metrics.Metrics, set by setMetrics()
+
+    @property
+    def io_lock(self):
+        """ the instrument's io_lock, held by @transaction methods so that
+        sequences of instrument calls and the generator state they update
+        are atomic across threads """
+        return self.instr.io_lock
+
+    def makeShadow(self):
+        """ build a StateShadow that knows the 33522A's implied channels
+
+        APPLy sets the function, frequency, amplitude and offset of its
+        channel and turns the output on, so it is coupled to those nodes.
+        The frequency and the square and pulse periods set each other, and
+        changing the function can clip the frequency.
+        """
+        from StateShadow import StateShadow
+
+        aliases = {'SOUR': 'SOUR1', 'OUTP': 'OUTP1', 'TRIG': 'TRIG1'}
+        couplings = []
+        for root in self.sourceRoots:
+            aliases[root] = 'SOUR1:' + root
+        for channel in (1, 2):
+            source = 'SOUR%d' % channel
+            couplings.append((source + ':APPL', source))
+            couplings.append((source + ':APPL', 'OUTP%d' % channel))
+            couplings.append((source, source + ':APPL'))
+            couplings.append(('OUTP%d' % channel, source + ':APPL'))
+            couplings.append((source + ':FUNC', source + ':FREQ'))
+            couplings.append((source + ':FREQ', source + ':FUNC:SQU:PER'))
+            couplings.append((source + ':FREQ', source + ':FUNC:PULS:PER'))
+        return StateShadow(aliases, couplings)
+
+    def setMetrics(self, metrics):
+        """ record latencies, byte counts and errors
+
+        Installs recording proxies on the instrument (see
+        usbtmc.metrics), including the depth of the batch and session
+        queues. Pass None to remove them again.
+
+        :param metrics: usbtmc.metrics.Metrics, or None to stop recording
+        """
+
+        if self.metrics is not None:
+            self.metrics.remove_gauge('session')
+        self.instr.set_metrics(metrics)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_gauge('session', lambda: (
+                self.session.pending() if self.session is not None else 0))
 
-        self.instr = usbtmc.Instrument(self.addr)  # Instantiate instrument
+    def setTracer(self, tracer):
+        """ trace calls of this object and of its instrument in spans
+
+        Every public method of the function generator and of its
+        usbtmc.Instrument records a span in the tracer (see SpanTracer),
+        so nested calls show where the time of an operation goes. Pass
+        None to remove the wrappers again.
+
+        :param tracer: SpanTracer, or None to stop tracing
+        """
+
+        if self.tracer is not None:
+            self.tracer.detach(self)
+            self.tracer.detach(self.instr)
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.attach(self)
+            tracer.attach(self.instr)
 
     def getIdn(self):
         """ get fgen identity
@@ -47,15 +180,147 @@ class FunctionGenerator:
 
         return self.instr.ask("*IDN?")
 
+    def askBatch(self, queries, types=None):
+        """ ask several queries in one round trip
+
+        The queries are sent as one ';' joined message and the single
+        response is split back into one result per query.
+
+        :param list queries: SCPI queries, e.g. ["*IDN?", "APPLy?"]
+        :param list types: (optional) converter per query such as int or
+        float, None to keep the string
+        :returns: results -- list of responses, binary blocks as bytes
+        """
+
+        return self.instr.ask_batch(queries, types)
+
     def write(self, command):
         """ write SCPI cmd
 
         Writes the given custom SCPI command to the instrument over usbtmc
 
+        :param command: SCPI command, or a list of them
+        """
+
+        with self.instr.io_lock:
+            self.instr.write(command)
+            if self.shadow is not None:
+                if isinstance(command, (list, tuple)):
+                    for c in command:
+                        self.shadow.observe(str(c))
+                else:
+                    self.shadow.observe(command)
+
+    def setState(self, command):
+        """ write a SCPI setting unless the shadow says it is already set
+
         :param str command: SCPI command
+        :returns: bool -- True if the command was sent
         """
 
-        self.instr.write(command)
+        with self.instr.io_lock:
+            if self.shadow is not None and not self.shadow.update(command):
+                return False
+            try:
+                self.instr.write(command)
+            except Exception:
+                if self.shadow is not None:
+                    self.shadow.invalidate(command)
+                raise
+            return True
+
+    def getSession(self):
+        """ get the request queue shared by all threads using this fgen
+
+        Instrument calls are thread-safe on their own; the session adds one
+        I/O thread that runs queued requests in order and hands each caller
+        a future, so e.g. a monitoring thread never waits for a long upload
+        by an acquisition thread to finish before it can queue its query.
+
+        :returns: session -- usbtmc.session.Session
+        """
+
+        from usbtmc.session import Session
+
+        with self.instr.io_lock:
+            if self.session is None:
+                self.session = Session(self.instr)
+            return self.session
+
+    def submit(self, method, *args, **kwargs):
+        """ queue a call on the session's I/O thread
+
+        For example ``fgen.submit(fgen.getStatus).result(timeout=1)``.
+
+        :param method: a FunctionGenerator method or any callable doing I/O
+        on this function generator
+        :returns: future -- concurrent.futures.Future of the result
+        """
+
+        return self.getSession().submit(method, *args, **kwargs)
+
+    @transaction
+    def resync(self):
+        """ reload the state shadow from the instrument
+
+        Queries APPLy? and the output state of both channels. Settings that
+        are not covered by those queries are forgotten. APPLy also turns the
+        output on, so it is only recorded for channels whose output is on.
+        """
+
+        if self.shadow is None:
+            return
+        self.shadow.clear()
+        status = self.askBatch(["OUTP1?", "SOUR1:APPL?", "OUTP2?",
+                                "SOUR2:APPL?"])
+        for channel in (1, 2):
+            output = status[2*channel - 2]
+            self.shadow.set("OUTP%d %s" % (channel, output))
+            applied = status[2*channel - 1].strip('"')
+            parts = applied.split(None, 1)
+            if len(parts) == 2 and float(output) == 1:
+                self.shadow.set("SOUR%d:APPL:%s %s" % ((channel,) +
+                                                       tuple(parts)))
+
+    def batch(self):
+        """ batch writes into coalesced messages
+
+        Returns a context manager; commands written by any method inside the
+        with block are queued and sent as few ';' joined USBTMC messages when
+        the block exits (or before the next read). For example::
+
+            with fgen.batch():
+                fgen.setOutput(1, 'OFF')
+                fgen.pushSin(1000)
+        """
+
+        return self.instr.batch()
+
+    def flush(self):
+        """ send writes queued inside batch() now
+        """
+
+        self.instr.flush()
+
+    def sweep(self, axes, measure=None, opc=(), order='snake'):
+        """ step through a grid of settings, sending only what changes
+
+        See ParameterSweep. For example::
+
+            fgen.sweep([('SOUR1:FREQ', [1e3, 2e3]),
+                        ('SOUR1:BURS:NCYC', [1, 10, 100])], acquire)
+
+        :param axes: list of (SCPI node, values), the outermost axis first
+        :param measure: (optional) called with each point once it is set up
+        :param opc: (optional) nodes whose change is followed by a wait for
+        *OPC, or True to wait after every point
+        :param str order: (optional, default 'snake') 'snake' or 'raster'
+        :returns: list of (point, setup seconds, measure result)
+        """
+
+        from ParameterSweep import ParameterSweep
+
+        return ParameterSweep(self, axes, opc, order).run(measure)
 
     def getStatus(self):
         """ get status and settings
@@ -70,9 +335,13 @@ class FunctionGenerator:
 
     def sendTrigger(self):
         """ sends a manual trigger to the bus
+
+        Uses the USB488 TRIGGER message when the instrument supports it,
+        which skips the DEV_DEP_MSG_OUT header and SCPI parsing of '*TRG'.
+        Commands still queued in a batch are sent first.
         """
 
-        self.instr.write('*TRG')
+        self.instr.trigger()
 
     def pushSin(self, frequency, amplitude=1, offset=0):
         """ setup sin wave output
@@ -86,8 +355,8 @@ class FunctionGenerator:
         :param float offset: (optional, default set to 0V), dc offset of sin
         wave in volts.
         """
-        self.write("APPL:SIN "+str(frequency)+", \
-                   "+str(amplitude)+", "+str(offset))
+        self.setState("APPL:SIN "+str(frequency)+", "+str(amplitude)+", " +
+                      str(offset))
 
     def setSin(self, frequencey, amplitude=1, offset=0):
         print("Set sin")
@@ -109,54 +378,321 @@ class FunctionGenerator:
         extension). For example "HIFU_SIM"
         """
 
-        self.instr.write("MMEMory:LOAD:STATe \""+str(stateName)+"\"")
+        self.write("MMEMory:LOAD:STATe \""+str(stateName)+"\"")
 
-    def loadArbitraryWaveform(self, intWaveform):
+    @transaction
+    def loadArbitraryWaveform(self, intWaveform, binary=False,
+                              policy='reject'):
         """
         Loads arbitrary waveform into function generator's VOLATILE memory
         (supports between 8 and 16,000 points). MUST be integers between -2047
         and +2047
 
-        :param list intWaveform: A list of integers between -2047 and +2047
-        with length between 8 and 16,000 inclusive.
+        :param list intWaveform: A list or NumPy array of integers between
+        -2047 and +2047 with length between 8 and 16,000 inclusive.
+        :param bool binary: (optional, default False) send the points as a
+        binary IEEE-488.2 block instead of comma separated ASCII. See
+        loadArbitraryWaveformBinary().
+        :param policy: (optional, default 'reject') validation policy passed
+        to validateWaveform(), or None to skip validation for waveforms that
+        are already known to be good.
+        :raises WaveformError: if the waveform fails validation
         """
-        from sys import exit
 
-        if (not all((isinstance(n, int) and n >= -2047 and n <= 2047)
-                    for n in intWaveform)):
-            print("Oops, you input integer wavefrom is not well formed. The "
-                  "problem is one of the following:")
-            # Raise custom Exception here
-            # TODO: FINISH
-            exit(1)
+        if policy is not None:
+            intWaveform = self.validateWaveform(intWaveform, policy)
+
+        if binary:
+            self.loadArbitraryWaveformBinary(intWaveform)
+            return
+
+        if hasattr(intWaveform, 'tolist'):
+            intWaveform = intWaveform.tolist()
         # self.instr.write("DATA:DEL VOLATILE")
         sendString = "DATA:DAC VOLATILE, " + \
-            str(intWaveform)[1:len(str(intWaveform))-1]
-        print(sendString)
+            str(list(intWaveform))[1:-1]
         self.instr.write(sendString)
 
-    def loadSettings(self,filename):
+    def validateWaveform(self, waveform, policy='reject'):
+        """ check an arbitrary waveform in one vectorized pass
+
+        Checks that the waveform is one dimensional, has between 8 and 16,000
+        points, holds integer values and that every point lies in arbRange.
+
+        :param waveform: list or NumPy array of points
+        :param str policy: 'reject' raises on out of range points, 'clip'
+        clamps them to arbRange instead. Shape, length and non-integer points
+        are always rejected.
+        :returns: waveform -- NumPy int16 array of the validated points
+        :raises WaveformError: describing the problem and offending indices
+        """
+        import numpy as np
+
+        if policy not in ('reject', 'clip'):
+            raise ValueError("Invalid policy " + repr(policy))
+
+        arr = np.asarray(waveform)
+        if arr.ndim != 1:
+            raise WaveformError("Waveform must be one dimensional, got "
+                                "shape " + str(arr.shape), 'shape')
+        if not (self.arbLength[0] <= arr.size <= self.arbLength[1]):
+            raise WaveformError("Waveform must have between %d and %d "
+                                "points, got %d" % (self.arbLength +
+                                                    (arr.size,)), 'length')
+        if arr.dtype.kind == 'f':
+            bad = np.flatnonzero(arr != np.rint(arr))
+            if bad.size:
+                raise WaveformError("Non-integer point", 'dtype', bad.tolist())
+        elif arr.dtype.kind not in 'iu':
+            raise WaveformError("Waveform must hold integers, got dtype " +
+                                str(arr.dtype), 'dtype')
+
+        low, high = self.arbRange
+        if policy == 'clip':
+            arr = np.clip(arr, low, high)
+        else:
+            bad = np.flatnonzero((arr < low) | (arr > high))
+            if bad.size:
+                raise WaveformError("Point outside %d..%d" % (low, high),
+                                    'range', bad.tolist())
+        return arr.astype(np.int16)
+
+    @transaction
+    def loadArbitraryWaveformBinary(self, waveform, name=None):
+        """
+        Loads arbitrary waveform into function generator's VOLATILE memory as
+        a binary definite-length block (#<n><len><data>). Each point is sent as
+        a 16 bit integer in the host's native byte order, which is selected on
+        the instrument with FORM:BORD the first time it is needed. This is
+        roughly 5x less bus traffic than the ASCII upload and does no per
+        point string formatting.
+
+        The points are not validated here; use validateWaveform() or
+        loadArbitraryWaveform(binary=True) for checked uploads.
+
+        :param waveform: A NumPy array, array.array('h'), list of ints or a
+        bytes-like buffer of native int16 points between -2047 and +2047 with
+        length between 8 and 16,000 inclusive.
+        :param str name: (optional) store the waveform in volatile memory
+        under this name (DATA:ARB:DAC) instead of the VOLATILE slot.
+        """
+        from usbtmc import pack_block_header
+
+        payload = self.waveformBytes(waveform)
+        self.setByteOrder()
+        if name is None:
+            cmd = b"DATA:DAC VOLATILE, "
+        else:
+            cmd = b"DATA:ARB:DAC " + name.encode('ascii') + b", "
+        self.instr.write_raw(cmd + pack_block_header(len(payload)) + payload)
+
+    def waveformBytes(self, waveform):
+        """ pack waveform points as native int16
+
+        :param waveform: NumPy array, array.array, list of ints or bytes-like
+        buffer already holding native int16 points
+        :returns: bytes -- the packed points
+        """
+        import array
+
+        if hasattr(waveform, 'astype'):  # NumPy array, avoid importing numpy
+            return waveform.astype('=i2', copy=False).tobytes()
+        if isinstance(waveform, array.array) and waveform.itemsize == 2:
+            return waveform.tobytes()
+        if isinstance(waveform, (bytes, bytearray, memoryview)):
+            return bytes(waveform)
+        return array.array('h', waveform).tobytes()
+
+    @transaction
+    def setByteOrder(self):
+        """ select host byte order for binary block transfers
+
+        Sends FORM:BORD once; later calls are free until reset() is called.
+        """
+        import sys
+
+        order = 'SWAP' if sys.byteorder == 'little' else 'NORM'
+        if self.byteOrder != order:
+            self.instr.write("FORM:BORD " + order)
+            self.byteOrder = order
+
+    @transaction
+    def loadSettings(self, filename, batch=False, outputsOff=False,
+                     compiled=False):
         """
         Loads a series of settings from a text file.
         Empty lines and lines beginning with # are ignored
 
-        TODO: Query error stack after each line, to make sure we abort in
-        case of error. Should probably turn all outputs OFF in such a case,
-        too.
+        By default every line is echoed and followed by a SYSTem:ERRor?
+        query. In batch mode the commands are streamed without queries and
+        the error state (*ESR?) is checked once at the end. Only if an error
+        was reported are the lines bisected to find the one that failed.
+        Batch mode starts with *CLS, so errors queued before the call are
+        discarded. Compiled mode is batch mode on the cached program built by
+        compileSettings(), which usually applies a file in one or two
+        transfers.
 
         :param str filename: string name of text file to read from
+        :param bool batch: (optional, default False) defer error checking to
+        the end of the file
+        :param bool outputsOff: (optional, default False) turn both outputs
+        OFF and abort if a command fails
+        :param bool compiled: (optional, default False) apply the compiled
+        program, implies batch
+        :raises SettingsError: in batch mode, or with outputsOff, when a
+        command fails. It reports the file and line of the failing command.
         """
 
+        if compiled:
+            program = self.compileSettings(filename)
+            self.clearErrors()
+            for message in program.messages:
+                self.write(message)
+            errors = self.checkErrors()
+            if errors:
+                self.settingsFailed(filename, program.lines, errors,
+                                    outputsOff)
+            return
+
+        lines = self.readSettings(filename)
+        if batch:
+            self.clearErrors()
+            with self.batch():
+                for lineno, command in lines:
+                    self.setState(command)
+            errors = self.checkErrors()
+            if errors:
+                self.settingsFailed(filename, lines, errors, outputsOff)
+            return
+
         print("Loading from " + filename + ":")
-        f = open(filename, 'r')
-        for line in f:
-            sline = line.strip()
-            print(sline)
-            if (len(sline) > 0) and (sline[0][0] != '#'):
-                self.instr.write(sline)
-                errmsg = self.getError()
-                if (errmsg[0][0] == '-'):
-                    print(errmsg)
+        for lineno, command in lines:
+            print(command)
+            if not self.setState(command):
+                continue
+            errmsg = self.getError()
+            if (errmsg[0][0] == '-'):
+                print("%s:%d: %s" % (filename, lineno, errmsg))
+                if self.shadow is not None:
+                    self.shadow.invalidate(command)
+                if outputsOff:
+                    self.outputsOff()
+                    raise SettingsError(filename, lineno, command,
+                                        [errmsg] + self.drainErrors())
+
+    def compileSettings(self, filename):
+        """ compile a settings file for this instrument
+
+        See SettingsCompiler: comments are stripped, commands checked,
+        overridden settings dropped and the rest packed into ';' joined
+        messages. The result is cached on disk, keyed by path, modification
+        time and instrument model.
+
+        :param str filename: string name of text file to read from
+        :returns: program -- SettingsProgram
+        """
+        from SettingsCompiler import SettingsCompiler
+
+        if self.compiler is None:
+            self.compiler = SettingsCompiler(self.makeShadow())
+        if self.model is None:
+            idn = self.getIdn().split(',')
+            self.model = idn[1].strip() if len(idn) > 1 else idn[0]
+        return self.compiler.compile(filename, self.model)
+
+    def readSettings(self, filename):
+        """ read the commands of a settings file
+
+        :param str filename: string name of text file to read from
+        :returns: lines -- list of (line number, command) tuples, without
+        empty and comment lines
+        """
+
+        lines = []
+        with open(filename, 'r') as f:
+            for lineno, line in enumerate(f, 1):
+                sline = line.strip()
+                if sline and not sline.startswith('#'):
+                    lines.append((lineno, sline))
+        return lines
+
+    @transaction
+    def checkErrors(self):
+        """ check the standard event status register for errors
+
+        A single *ESR? query; the error queue is only read if one of the
+        query, device, execution or command error bits is set. Reading *ESR?
+        clears the register.
+
+        :returns: errors -- list of error messages, empty if there were none
+        """
+
+        if int(self.instr.ask("*ESR?")) & 0x3C:
+            return self.drainErrors()
+        return []
+
+    @transaction
+    def drainErrors(self, depth=8):
+        """ read the error queue until it is empty
+
+        Reads up to depth errors per round trip.
+
+        :param int depth: (optional, default 8) SYSTem:ERRor? queries per
+        message
+        :returns: errors -- list of error messages
+        """
+
+        errors = []
+        while True:
+            for errmsg in self.askBatch(["SYSTem:ERRor?"] * depth):
+                if errmsg.lstrip('+').startswith('0,'):
+                    return errors
+                errors.append(errmsg)
+
+    @transaction
+    def settingsFailed(self, filename, lines, errors, outputsOff):
+        """ locate the line of a failed batch and raise SettingsError
+
+        Finds the first failing line by bisection, then resends every other
+        line so the instrument ends as if that line had been left out.
+        """
+
+        lo, hi = 0, len(lines)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            self.clearErrors()
+            for lineno, command in lines[lo:mid]:
+                self.instr.write(command)
+            if self.checkErrors():
+                hi = mid
+            else:
+                lo = mid
+
+        lineno, command = lines[lo]
+        self.clearErrors()
+        self.instr.write(command)
+        located = self.checkErrors()
+
+        # restore a known state, and a shadow that matches it
+        if self.shadow is not None:
+            self.shadow.clear()
+        with self.batch():
+            for i, (restoredLine, restored) in enumerate(lines):
+                if i != lo:
+                    self.write(restored)
+        self.clearErrors()
+        if outputsOff:
+            self.outputsOff()
+        if located:
+            raise SettingsError(filename, lineno, command, located)
+        raise SettingsError(filename, None, None, errors)
+
+    @transaction
+    def outputsOff(self):
+        """ turns both outputs OFF
+        """
+
+        self.write("OUTPUT1 OFF;:OUTPUT2 OFF")
 
     def clearErrors(self):
         """ clear errors
@@ -166,15 +702,30 @@ class FunctionGenerator:
         """
         self.instr.write("*CLS")
 
+    def waitComplete(self, timeout=10.0):
+        """ wait for pending operations
+
+        Blocks until the function generator has finished all pending
+        operations (*OPC), returning as soon as it is done.
+
+        :param float timeout: (optional, default 10) seconds to wait before
+        raising usbtmc.usbtmc.UsbtmcException
+        """
+
+        self.instr.wait_opc(timeout)
+
+    @transaction
     def reset(self):
         """ resets function generator to defaults
         """
 
-        import time
         self.instr.write("*RST")
-        time.sleep(1)
+        self.byteOrder = None  # *RST restores FORM:BORD NORM
+        self.clearWaveformCache(False)
+        if self.shadow is not None:
+            self.shadow.clear()
+        self.waitComplete()
         self.clearErrors()
-        time.sleep(0.1)
 
     def setOutput(self, channel, state):
         """ sets the specified channel to the ON or OFF state
@@ -196,19 +747,120 @@ class FunctionGenerator:
             return
         syscmd = 'OUTPUT'+str(channel)+" "+cmdstate
         print(syscmd)
-        self.instr.write(syscmd)
+        self.setState(syscmd)
 
-    def pushArbitraryWaveform(self, intWaveform):
+    @transaction
+    def pushArbitraryWaveform(self, intWaveform, binary=False,
+                              policy='reject'):
         """
         Loads arbitrary waveform into memory according to
         loadArbitraryWaveform() and then selects and outputs the waveform.
 
         :param list intWaveform: A list of ints between -2047 and +2047 with
         length between 8 and 16,000 inclusive.
+        :param bool binary: (optional, default False) upload the waveform as a
+        binary block, see loadArbitraryWaveformBinary().
+        :param policy: (optional, default 'reject') validation policy, see
+        loadArbitraryWaveform().
+        """
+
+        self.loadArbitraryWaveform(intWaveform, binary, policy)  # Loads arb
+                                                    # into volatile memory
+        self.write("FUNC:ARB VOLATILE")  # Selects volatile for the arb shape
+        self.write("FUNC:SHAP ARB")  # Selects the arb function
+
+    @transaction
+    def pushCachedWaveform(self, intWaveform, policy='reject'):
+        """
+        Selects and outputs an arbitrary waveform, uploading it only if it is
+        not already held in volatile memory. When memory or arbCacheLimit
+        runs out, the least recently used half of the cache is evicted; this
+        clears volatile memory, including loadArbitraryWaveform() uploads.
+
+        :param intWaveform: list or NumPy array of ints between -2047 and
+        +2047 with length between 8 and 16,000 inclusive.
+        :param policy: (optional, default 'reject') validation policy, see
+        loadArbitraryWaveform().
+        :returns: name -- the name of the waveform in volatile memory
+        :raises WaveformError: if the waveform fails validation or is larger
+        than the volatile memory
+        """
+        import hashlib
+
+        if policy is not None:
+            intWaveform = self.validateWaveform(intWaveform, policy)
+        payload = self.waveformBytes(intWaveform)
+        digest = hashlib.sha1(payload).hexdigest()
+
+        if digest in self.arbCache:
+            self.arbCache[digest] = self.arbCache.pop(digest)  # now MRU
+        else:
+            self.cacheWaveform(digest, payload)
+
+        name = self.cachedWaveformName(digest)
+        self.write("FUNC:ARB " + name + ";:FUNC:SHAP ARB")
+        return name
+
+    def cachedWaveformName(self, digest):
+        """ volatile memory name for a cached waveform
+
+        Arb names must start with a letter and be at most 12 characters.
         """
+        return "W" + digest[:11].upper()
+
+    @transaction
+    def cacheWaveform(self, digest, payload):
+        """ upload a waveform into the cache, evicting LRU entries
 
-        self.loadArbitraryWaveform(intWaveform)     # Loads arb waveform into
-                                                    # volatile memory
-        self.instr.write("FUNC:ARB VOLATILE")  # Selects volatile for the arb
-                                               # shape
-        self.instr.write("FUNC:SHAP ARB")  # Selects the arb function
+        :param str digest: SHA-1 hex digest of payload
+        :param bytes payload: native int16 points
+        :raises WaveformError: if the waveform does not fit in volatile
+        memory even with the cache emptied; nothing is sent or evicted
+        """
+        points = len(payload) // 2
+        if self.arbFree is None:
+            self.arbFree = int(float(self.instr.ask("DATA:VOL:FREE?")))
+        used = sum(len(p) for p in self.arbCache.values()) // 2
+        if points > self.arbFree + used:
+            raise WaveformError("Waveform of %d points does not fit in %d "
+                                "points of volatile memory" %
+                                (points, self.arbFree + used), 'memory')
+
+        limit = self.arbCacheLimit
+        evicted = False
+        if self.arbCache and (points > self.arbFree or (
+                limit is not None and len(self.arbCache) >= limit)):
+            keepPoints = int((self.arbFree + used) * self.arbCacheKeep)
+            keepCount = (max(int(limit * self.arbCacheKeep), 1)
+                         if limit is not None else None)
+            while self.arbCache and (used + points > keepPoints or (
+                    keepCount is not None and
+                    len(self.arbCache) >= keepCount)):
+                old = self.arbCache.popitem(last=False)[1]
+                used -= len(old) // 2
+                evicted = True
+
+        if evicted:
+            self.instr.write("DATA:VOL:CLE")
+            self.arbFree = int(float(self.instr.ask("DATA:VOL:FREE?")))
+            for kept, keptPayload in self.arbCache.items():
+                self.loadArbitraryWaveformBinary(
+                    keptPayload, self.cachedWaveformName(kept))
+                self.arbFree -= len(keptPayload) // 2
+
+        self.loadArbitraryWaveformBinary(payload,
+                                         self.cachedWaveformName(digest))
+        self.arbCache[digest] = payload
+        self.arbFree -= points
+
+    @transaction
+    def clearWaveformCache(self, clearInstrument=True):
+        """ forget all waveforms cached by pushCachedWaveform()
+
+        :param bool clearInstrument: (optional, default True) also free the
+        instrument's volatile memory with DATA:VOL:CLE
+        """
+        if clearInstrument:
+            self.instr.write("DATA:VOL:CLE")
+        self.arbCache.clear()
+        self.arbFree = None
@@ -0,0 +1,645 @@
+"""
+InstrumentServer.py
+
+Owns the USB connections to the instruments and serves them to any number
+of local processes over a Unix domain socket, e.g.::
+
+    python InstrumentServer.py --fgen 1
+
+and in the analysis workers::
+
+    from InstrumentServer import RemoteFunctionGenerator
+    fgen = RemoteFunctionGenerator()
+    print(fgen.getStatus())
+
+Every request and response is a frame header followed by its payload. The
+header is op (status in responses), device index, sequence number and
+payload length, little endian '<BBHL'. Clients may send requests without
+waiting for the responses; they are paired by sequence number.
+
+The socket lives in a directory only the user running the server can
+enter (defaultPath) and is itself only accessible to that user.
+"""
+import argparse
+import concurrent.futures
+import functools
+import os
+import socket
+import struct
+import tempfile
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import usbtmc
+from FunctionGenerator import FunctionGenerator
+
+frameHeader = struct.Struct('<BBHL')
+
+# Request ops
+OP_LOOKUP = 0  # payload: device name, response: '<BB' device index, flags
+OP_WRITE = 1
+OP_ASK = 2
+OP_WRITE_RAW = 3
+OP_READ_RAW = 4  # payload: '<l' byte count, -1 to read to the end
+OP_ASK_RAW = 5  # payload: '<l' byte count, then the data
+OP_TRIGGER = 6
+OP_READ_STB = 7
+OP_CLEAR = 8
+OP_WAIT_OPC = 9  # payload: '<d' timeout in seconds
+
+# Lookup flags
+FLAG_TRIGGER = 1  # the device supports the USB488 TRIGGER message
+
+# Response status
+STATUS_OK = 0
+STATUS_ERROR = 1  # payload: error message
+
+defaultPath = os.path.join(tempfile.gettempdir(),
+                           'fgen_interface-%d' % os.getuid(), 'instruments.sock')
+
+
+class RemoteError(Exception):
+
+    """
+    Raised by the client when the server failed to execute a request.
+    """
+
+
+def privateDirectory(path):
+    """ create the directory of a socket path, readable only by this user,
+    or check that an existing one is """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RemoteError("%s must belong to this user and not be accessible "
+                          "to others" % directory)
+
+
+def serverRunning(path):
+    """ whether a server answers on the socket path """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def recvExactly(sock, size):
+    """ read size bytes, None if the connection was closed before any """
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    while offset < size:
+        count = sock.recv_into(view[offset:], size - offset)
+        if count == 0:
+            if offset == 0:
+                return None
+            raise RemoteError("Connection closed inside a frame")
+        offset += count
+    return bytes(data)
+
+
+class ScopeAdapter:
+
+    """
+    Gives an Oscilloscope the subset of the usbtmc.Instrument interface the
+    server uses, so it can be served like the function generator.
+    """
+
+    def __init__(self, scope, readSize=100000, timeout=10.0):
+        """
+        :param scope: an open Oscilloscope
+        :param int readSize: (optional) bytes to read for a response when no
+        count is given
+        :param float timeout: (optional) seconds the ActiveDSO control waits
+        for a response, restored after wait_opc()
+        """
+        self.scope = scope
+        self.readSize = readSize
+        self.timeout = timeout
+
+    def write(self, message):
+        self.scope.write(message)
+
+    def ask(self, message):
+        self.scope.write(message)
+        return self.scope.readBuffer(self.readSize).rstrip('\r\n')
+
+    def write_raw(self, data):
+        self.scope.write(data.decode('latin-1'))
+
+    def read_raw(self, num=-1):
+        data = self.scope.readBuffer(num if num > 0 else self.readSize)
+        return data.encode('latin-1')
+
+    def ask_raw(self, data, num=-1):
+        self.write_raw(data)
+        return self.read_raw(num)
+
+    def trigger(self):
+        self.scope.write('*TRG')
+
+    def read_stb(self):
+        return int(self.ask('*STB?'))
+
+    def clear(self):
+        self.scope.write('*CLS')
+
+    def wait_opc(self, timeout=10.0):
+        # ReadString gives up after the control's timeout
+        self.scope.dso.SetTimeout(timeout)
+        try:
+            self.ask('*OPC?')
+        finally:
+            self.scope.dso.SetTimeout(self.timeout)
+
+
+class DeviceWorker:
+
+    """
+    Runs the requests for one device, from all clients, in arrival order on
+    its own thread. Writes of one client waiting in the queue are sent
+    coalesced as one message together with that client's query behind
+    them, if the instrument supports batch().
+    """
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.coalesce = hasattr(instrument, 'batch')
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, op, payload, done, client=None):
+        """ queue a request, done(result or exception) is called on the
+        worker thread; only requests of the same client are coalesced """
+        self.requests.put((op, payload, done, client))
+
+    def stop(self):
+        self.requests.put((None, None, None, None))
+        self.thread.join()
+
+    def run(self):
+        held = None
+        while True:
+            if held is not None:
+                request, held = held, None
+            else:
+                request = self.requests.get()
+            if request[0] is None:
+                return
+            client = request[3]
+            group = [request[:3]]
+            while self.coalesce and group[-1][0] == OP_WRITE:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request[0] in (OP_WRITE, OP_ASK) and request[3] is client:
+                    group.append(request[:3])
+                else:
+                    held = request
+                    break
+            if len(group) == 1:
+                op, payload, done = group[0]
+                try:
+                    result = self.execute(op, payload)
+                except Exception as e:
+                    result = e
+                done(result)
+            else:
+                self.executeGroup(group)
+
+    def executeGroup(self, group):
+        """ send a run of writes of one client, and possibly its query, as
+        one message
+
+        If the coalesced message fails, every request in it gets the error:
+        there is no telling which commands took effect, and running them
+        again would repeat triggers, uploads and resets.
+        """
+        writes = []
+        for op, payload, done in group[:-1]:
+            try:
+                writes.append((payload.decode('utf-8'), done))
+            except UnicodeDecodeError as e:
+                done(e)
+        try:
+            with self.instrument.batch():
+                for message, done in writes:
+                    self.instrument.write(message)
+                result = self.execute(*group[-1][:2])
+        except Exception as e:
+            for message, done in writes:
+                done(e)
+            group[-1][2](e)
+            return
+        for message, done in writes:
+            done(b'')
+        group[-1][2](result)
+
+    def execute(self, op, payload):
+        """ run a single request, returns the response payload """
+        instr = self.instrument
+        if op == OP_WRITE:
+            instr.write(payload.decode('utf-8'))
+        elif op == OP_ASK:
+            return instr.ask(payload.decode('utf-8')).encode('utf-8')
+        elif op == OP_WRITE_RAW:
+            instr.write_raw(payload)
+        elif op == OP_READ_RAW:
+            return instr.read_raw(struct.unpack('<l', payload)[0])
+        elif op == OP_ASK_RAW:
+            num = struct.unpack_from('<l', payload)[0]
+            return instr.ask_raw(payload[4:], num)
+        elif op == OP_TRIGGER:
+            instr.trigger()
+        elif op == OP_READ_STB:
+            return struct.pack('<B', instr.read_stb())
+        elif op == OP_CLEAR:
+            instr.clear()
+        elif op == OP_WAIT_OPC:
+            instr.wait_opc(struct.unpack('<d', payload)[0])
+        else:
+            raise RemoteError("Unknown op %d" % op)
+        return b''
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+
+    """
+    Reads the frames of one client and hands them to the device workers,
+    without waiting for the responses, which are sent as they complete.
+    """
+
+    def handle(self):
+        self.sendLock = threading.Lock()
+        while True:
+            head = recvExactly(self.request, frameHeader.size)
+            if head is None:
+                return
+            op, device, seq, length = frameHeader.unpack(head)
+            payload = recvExactly(self.request, length) if length else b''
+            if op == OP_LOOKUP:
+                name = payload.decode('utf-8')
+                if name in self.server.names:
+                    index = self.server.names.index(name)
+                    instrument = self.server.workers[index].instrument
+                    flags = (FLAG_TRIGGER if getattr(instrument, 'support_trigger',
+                                                     False) else 0)
+                    self.reply(seq, device, struct.pack('<BB', index, flags))
+                else:
+                    self.reply(seq, device,
+                               RemoteError("Unknown device " + name))
+            elif device >= len(self.server.workers):
+                self.reply(seq, device,
+                           RemoteError("Unknown device %d" % device))
+            else:
+                self.server.workers[device].submit(
+                    op, payload, functools.partial(self.reply, seq, device),
+                    self)
+
+    def reply(self, seq, device, result):
+        if isinstance(result, Exception):
+            status = STATUS_ERROR
+            result = ("%s: %s" % (type(result).__name__,
+                                  result)).encode('utf-8')
+        else:
+            status = STATUS_OK
+        try:
+            with self.sendLock:
+                self.request.sendall(frameHeader.pack(status, device, seq,
+                                                      len(result)))
+                if result:
+                    self.request.sendall(result)
+        except socket.error:
+            pass  # client went away, nobody to tell
+
+
+class InstrumentServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+
+    """
+    Serves named instruments over a Unix domain socket, see RequestHandler
+    and DeviceWorker.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, devices, path=defaultPath):
+        """
+        :param dict devices: maps names to usbtmc.Instrument or
+        ScopeAdapter objects, e.g. {'fgen': fgen.instr}
+        :param str path: (optional) socket path, in a directory only this
+        user can access
+        """
+        privateDirectory(path)
+        if os.path.exists(path):
+            if serverRunning(path):
+                raise RemoteError("A server is already running on " + path)
+            os.unlink(path)  # left behind by a server that died
+        self.path = path
+        self.names = sorted(devices)
+        self.workers = [DeviceWorker(devices[name]) for name in self.names]
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def server_bind(self):
+        # no window in which others could connect to the new socket
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for worker in self.workers:
+            worker.stop()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class RemoteInstrument:
+
+    """
+    Client for one device of an InstrumentServer, with the interface of
+    usbtmc.Instrument that FunctionGenerator uses.
+
+    Writes and triggers are pipelined: they return as soon as they are
+    sent. If one fails on the server, the error is raised by a later call.
+
+    set_metrics() times commands on the client side, round trips through the
+    server included; transfer metrics and recording need the USB device and
+    are only available in the server process.
+    """
+
+    def __init__(self, device='fgen', path=defaultPath, timeout=10.0):
+        """
+        :param str device: name the server knows the device by
+        :param str path: (optional) socket path
+        :param float timeout: (optional) seconds to wait for a response
+        """
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sendLock = threading.Lock()
+        self.futures = {}
+        self.seq = 0
+        self.pending = []  # futures of writes not known to have succeeded
+        self.device = 0
+
+        self.io_lock = threading.RLock()
+        self.batch_depth = 0
+        self.batch_owner = None
+        self.write_queue = []
+        self.max_recv_size = 1024*1024
+        self.metrics = None
+        self.recorder = None
+        self.support_trigger = False
+
+        self.reader = threading.Thread(target=self.readResponses)
+        self.reader.daemon = True
+        self.reader.start()
+
+        result = self.call(OP_LOOKUP, device.encode('utf-8'))
+        self.device, flags = struct.unpack('<BB', result)
+        self.support_trigger = bool(flags & FLAG_TRIGGER)
+
+    def request(self, op, payload=b''):
+        """ send a request, returns a Future of the response payload """
+        future = concurrent.futures.Future()
+        with self.sendLock:
+            self.seq = (self.seq + 1) & 0xFFFF
+            self.futures[self.seq] = future
+            self.sock.sendall(frameHeader.pack(op, self.device, self.seq,
+                                               len(payload)))
+            if payload:
+                self.sock.sendall(payload)
+        return future
+
+    def readResponses(self):
+        try:
+            while True:
+                head = recvExactly(self.sock, frameHeader.size)
+                if head is None:
+                    break
+                status, device, seq, length = frameHeader.unpack(head)
+                payload = recvExactly(self.sock, length) if length else b''
+                future = self.futures.pop(seq, None)
+                if future is None:
+                    continue  # not ours, or already given up on
+                if status == STATUS_OK:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RemoteError(payload.decode('utf-8')))
+        except (socket.error, RemoteError):
+            pass
+        for seq in list(self.futures):
+            self.futures.pop(seq).set_exception(
+                RemoteError("Connection to server closed"))
+
+    def post(self, op, payload=b''):
+        """ send a request without waiting for its response """
+        self.pending.append(self.request(op, payload))
+        while self.pending and self.pending[0].done():
+            self.pending.pop(0).result()
+
+    def call(self, op, payload=b''):
+        """ send a request and wait for its response """
+        result = self.request(op, payload).result(self.timeout)
+        self.sync()
+        return result
+
+    def sync(self):
+        """ wait for all pipelined writes, raise the first failure """
+        pending = self.pending
+        self.pending = []
+        for future in pending:
+            future.result(self.timeout)
+
+    def write(self, message, encoding='utf-8'):
+        with self.io_lock:
+            if type(message) is tuple or type(message) is list:
+                for message_i in message:
+                    self.write(message_i, encoding)
+                return
+            data = str(message).encode(encoding)
+            if self.batch_depth > 0:
+                self.write_queue.append(data)
+            else:
+                self.post(OP_WRITE, data)
+
+    def flush(self):
+        with self.io_lock:
+            commands = self.write_queue
+            self.write_queue = []
+            for data in usbtmc.join_commands(commands, self.max_recv_size):
+                self.post(OP_WRITE, data)
+
+    # queued and split exactly as by usbtmc.Instrument, through flush() and
+    # ask_raw() of this class
+    batch = usbtmc.Instrument.batch
+    ask_batch = usbtmc.Instrument.ask_batch
+
+    def set_metrics(self, metrics):
+        """ time the commands of this client in a usbtmc.metrics.Metrics,
+        or stop with None """
+        from usbtmc.metrics import COMMAND_METHODS
+        from usbtmc.usbtmc import remove_wrapper
+
+        with self.io_lock:
+            if self.metrics is not None:
+                for name in COMMAND_METHODS:
+                    remove_wrapper(self, name, self.metrics)
+                self.metrics.remove_gauge('write_queue')
+            self.metrics = metrics
+            if metrics is not None:
+                for name in COMMAND_METHODS:
+                    if hasattr(self, name):
+                        setattr(self, name, metrics.timed_command(
+                            name, getattr(self, name)))
+                metrics.add_gauge('write_queue',
+                                  lambda: len(self.write_queue))
+
+    def start_recording(self, path, hash_threshold=4096):
+        raise RemoteError("Recording needs the USB device: start it on the "
+                          "instrument in the server process")
+
+    def stop_recording(self):
+        raise RemoteError("Recording needs the USB device: stop it on the "
+                          "instrument in the server process")
+
+    def ask(self, message, num=-1, encoding='utf-8'):
+        with self.io_lock:
+            if type(message) is tuple or type(message) is list:
+                return [self.ask(m, num, encoding) for m in message]
+            if num > 0:
+                data = self.ask_raw(str(message).encode(encoding), num)
+                return data.decode(encoding).rstrip('\r\n')
+            self.flush()
+            return self.call(OP_ASK,
+                             str(message).encode(encoding)).decode(encoding)
+
+    def write_raw(self, data):
+        with self.io_lock:
+            self.flush()
+            self.post(OP_WRITE_RAW, memoryview(data).cast('B').tobytes())
+
+    def read_raw(self, num=-1):
+        with self.io_lock:
+            self.flush()
+            return self.call(OP_READ_RAW, struct.pack('<l', num))
+
+    def read(self, num=-1, encoding='utf-8'):
+        return self.read_raw(num).decode(encoding).rstrip('\r\n')
+
+    def ask_raw(self, data, num=-1):
+        with self.io_lock:
+            self.flush()
+            data = memoryview(data).cast('B').tobytes()
+            return self.call(OP_ASK_RAW, struct.pack('<l', num) + data)
+
+    def trigger(self):
+        with self.io_lock:
+            self.flush()
+            self.post(OP_TRIGGER)
+
+    def read_stb(self):
+        with self.io_lock:
+            self.flush()
+            return struct.unpack('<B', self.call(OP_READ_STB))[0]
+
+    def clear(self):
+        with self.io_lock:
+            self.call(OP_CLEAR)
+
+    def wait_opc(self, timeout=10.0):
+        with self.io_lock:
+            self.flush()
+            future = self.request(OP_WAIT_OPC, struct.pack('<d', timeout))
+            future.result(self.timeout + timeout)
+            self.sync()
+
+    def close(self):
+        """ wait for pipelined writes and disconnect """
+        try:
+            self.sync()
+        finally:
+            self.sock.close()
+
+
+class RemoteFunctionGenerator(FunctionGenerator):
+
+    """
+    FunctionGenerator talking to an InstrumentServer instead of the USB
+    device, for processes that share the instrument with the one that runs
+    the server.
+    """
+
+    def __init__(self, device='fgen', path=defaultPath, shadow=False):
+        """
+        :param str device: (optional) name the server knows the function
+        generator by
+        :param str path: (optional) socket path
+        :param bool shadow: (optional, default False) see FunctionGenerator.
+        The shadow only sees this client's writes, so leave it off when
+        several processes change settings.
+        """
+        FunctionGenerator.__init__(self, RemoteInstrument(device, path),
+                                   shadow=shadow)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share instruments with "
+                                     "other processes over a Unix socket")
+    parser.add_argument('--socket', default=defaultPath, help="socket path")
+    parser.add_argument('--fgen', action='append', default=[],
+                        help="function generator to serve as NAME=ADDRESS, "
+                        "or a selectorMap number served as 'fgen'")
+    parser.add_argument('--scope', action='append', default=[],
+                        help="oscilloscope to serve as NAME=ADDRESS, or a "
+                        "selectorMap number served as 'scope'")
+    args = parser.parse_args()
+
+    def selectors(specs, default):
+        for spec in specs:
+            name, sep, address = spec.rpartition('=')
+            if not sep:
+                name = default
+            yield name, int(address) if address.isdigit() else address
+
+    devices = {}
+    for name, selector in selectors(args.fgen, 'fgen'):
+        devices[name] = FunctionGenerator(selector).instr
+    for name, selector in selectors(args.scope, 'scope'):
+        from Oscilloscope import Oscilloscope
+        devices[name] = ScopeAdapter(Oscilloscope(selector))
+
+    server = InstrumentServer(devices, args.socket)
+    print("Serving " + ", ".join(server.names) + " on " + args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
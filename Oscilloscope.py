@@ -8,7 +8,7 @@ class Oscilloscope:
     # Holds USBTMC addresses of fgens in the Nightingale lab
     selectorMap = {1: "IP:192.168.3.220"}
 
-    def __init__(self, instrumentSelector):
+    def __init__(self, instrumentSelector, shadow=False, dso=None):
         """
         The constructor for the function generator object needs to know the
         USBTMC address of the device being used. The address can be directly
@@ -18,8 +18,12 @@ class Oscilloscope:
         :param instrumentSelector: Either a string representing the USBTMC
         address of the function generator or a int identifier representing one
         of the function generators in Kathy Nightingale's lab.
+        :param shadow: (optional, default False) keep a StateShadow of the
+        parameters written through setParam() and loadParams() and skip
+        writes that would not change anything.
+        :param dso: (optional) ActiveDSO control to use instead of the
+        LeCroy.ActiveDSOCtrl.1 COM object, e.g. a SimulatedDSO
         """
-        import win32com.client
 
         # Check if instrumentSelector is a string or an int, assign/lookup
         # address as needed
@@ -30,7 +34,18 @@ class Oscilloscope:
             self.addr = instrumentSelector
             #print "str"
         
-        self.dso = win32com.client.Dispatch("LeCroy.ActiveDSOCtrl.1")
+        from StateShadow import StateShadow
+        self.shadow = (StateShadow(shortForms=False, relativePaths=False)
+                       if shadow else None)
+        self.compiler = None
+        self.model = None
+        self.tracer = None
+        self.metrics = None
+        self.recorder = None
+        if dso is None:
+            import win32com.client
+            dso = win32com.client.Dispatch("LeCroy.ActiveDSOCtrl.1")
+        self.dso = dso
         # Instantiate instrument
         self.connect()
         self.outputBuffer = ''
@@ -62,13 +77,65 @@ class Oscilloscope:
 
         :param command:    A string representing the oscilloscope command
         """
+        if self.shadow is not None:
+            self.shadow.observe(command)
         if (self.addr != ''):
             if echo:
-                print command
+                print(command)
             self.dso.WriteString(command,1)
         else:
-            print command
+            print(command)
         
+    def setMetrics(self,metrics):
+        """
+        records the latency and size of every command written and response read in a usbtmc.metrics.Metrics
+
+        :param metrics: the Metrics to record in, or None to stop recording
+        """
+        from usbtmc.metrics import MeteredDSO
+        from usbtmc.usbtmc import remove_layer
+        if self.metrics is not None:
+            self.dso = remove_layer(self.dso,'dso',MeteredDSO)
+        self.metrics = metrics
+        if metrics is not None:
+            self.dso = MeteredDSO(self.dso,metrics)
+
+    def setTracer(self,tracer):
+        """
+        records a span per call of every public method in a SpanTracer, so nested calls show where the time of an operation goes
+
+        :param tracer: the SpanTracer to record in, or None to stop tracing
+        """
+        if self.tracer is not None:
+            self.tracer.detach(self)
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.attach(self)
+
+    def startRecording(self,path):
+        """
+        logs every command written and response read to a binary trace, which usbtmc.trace.ReplayDSO can serve again:
+        Oscilloscope(address, dso=ReplayDSO(path))
+
+        :param path: the trace file to write
+        """
+        from usbtmc.trace import RecordingDSO, TraceWriter
+        self.stopRecording()
+        self.recorder = TraceWriter(path)
+        self.dso = RecordingDSO(self.dso,self.recorder)
+
+    def stopRecording(self):
+        """
+        stops recording and closes the trace file
+        """
+        from usbtmc.trace import RecordingDSO
+        from usbtmc.usbtmc import remove_layer
+        if self.recorder is None:
+            return
+        self.dso = remove_layer(self.dso,'dso',RecordingDSO)
+        self.recorder.close()
+        self.recorder = None
+
     def readBuffer(self,bytes=80):
         """
         returns the string in the oscilloscope's output buffer
@@ -86,7 +153,7 @@ class Oscilloscope:
         self.write(cmd)
         lastErrorID = int(self.readBuffer(80))
         errorList = {0:"No Error",1:"Unrecognized command/query header",2:"Illegal header path",3:"Illegal number",4:"Illegal number suffix",5:"Unrecognized keyword",6:"String error",7:"GET embedded in another message",10:"Arbitrary data block expected",11:"Non-digit character in byte count field of arbitrary data block",12:"EOI detected during definite length data block transfer",13:"Extra bytes detected during definite length data block transfer"}
-        print errorList[lastErrorID]
+        print(errorList[lastErrorID])
         
     # Acquisition Control
     
@@ -124,7 +191,38 @@ class Oscilloscope:
         channel = self.checkInput(channel,self.channels,'C')
         cmd = channel + ':WAVEFORM?'
         self.write(cmd)
-    
+
+    def readWaveform(self,channel='C1',size=1e9):
+        """
+        Reads the specified waveform as a list of floats, using the INSPECT? "SIMPLE" text format. The number of points is set with setupWaveForm().
+
+        :param channel: String specifying which trace to use {'C1'|'C2} or {1|2}. Defaults to C1 if blank.
+        :param size: optional maximum number of bytes to read
+        """
+        channel = self.checkInput(channel,self.channels,'C')
+        self.write(channel + ':INSPECT? "SIMPLE"')
+        return self.parseInspect(self.dso.ReadString(size))
+
+    def parseInspect(self,text):
+        """
+        Extracts the values from the response to an INSPECT? "SIMPLE" query
+
+        :param text: the response string, e.g. 'C1:INSP "  0.1  0.2 ..."'.
+        Tokens that are not numbers, such as a header left on by
+        COMM_HEADER, are skipped.
+        """
+        start = text.find('"')
+        end = text.rfind('"')
+        if end > start >= 0:
+            text = text[start+1:end]
+        values = []
+        for v in text.split():
+            try:
+                values.append(float(v))
+            except ValueError:
+                pass
+        return values
+
     def sequence(self,mode='ON',segments=[],max_size=[]):
         """
         sets up the scope for sequence mode acquisition
@@ -219,13 +317,19 @@ class Oscilloscope:
         cmd = 'CLSW'
         self.write(cmd)
     
-    def loadParams(self, filename):
+    def loadParams(self, filename, compiled=False):
         """
         Loads a series of settings from a text file.
         Empty lines and lines beginning with # are ignored
 
         :param str filename: string name of text file to read from
+        :param compiled: (optional, default False) send the cached program
+        built by compileParams() instead of one command per line
         """
+        if compiled:
+            for message in self.compileParams(filename).messages:
+                self.write(message)
+            return
 
         print("Loading from " + filename + ":")
         f = open(filename, 'r')
@@ -233,7 +337,26 @@ class Oscilloscope:
             sline = line.strip()
             print(sline)
             if (len(sline) > 0) and (sline[0][0] != '#'):
-                self.write(sline)
+                if self.shadow is None or self.shadow.update(sline):
+                    self.write(sline)
+                                  
+    def compileParams(self, filename):
+        """
+        Compiles a settings file into a cached SettingsProgram (see
+        SettingsCompiler), keyed by path, modification time and model.
+        
+        :param str filename: string name of text file to read from
+        """
+        from SettingsCompiler import SettingsCompiler
+        from StateShadow import StateShadow
+        if self.compiler is None:
+            self.compiler = SettingsCompiler(StateShadow(shortForms=False),
+                                             rootReset=False)
+        if self.model is None:
+            self.write('*IDN?')
+            idn = self.readBuffer(200).split(',')
+            self.model = idn[1].strip() if len(idn) > 1 else idn[0].strip()
+        return self.compiler.compile(filename, self.model)
                                   
     def setVisibility(self,trace,visibility):
         """
@@ -267,8 +390,26 @@ class Oscilloscope:
         :param value: A numeric or string value to set
         """
         cmd = parameter + ' ' + str(value)
+        if self.shadow is not None and not self.shadow.update(cmd):
+            return
         self.write(cmd)
         
+    def resync(self):
+        """
+        reloads the state shadow from the oscilloscope's *LRN? panel setup
+        """
+        if self.shadow is None:
+            return
+        self.write('*LRN?')
+        self.shadow.load(self.readBuffer(100000))
+        
+    def reset(self):
+        """
+        resets the oscilloscope to its default setup and forgets the state
+        shadow
+        """
+        self.write('*RST')
+        
     def queryParam(self,parameter):
         """
         constructs and sends the command to query a particular parameter. The result is stored in the oscilloscope's output buffer
@@ -295,7 +436,7 @@ class Oscilloscope:
         cmd = ''+ header + ':INSPECT? "' + parameter + '"'
         if(format != 'default'):
             cmd = cmd + ', ' + format
-        print cmd
+        print(cmd)
         self.write(cmd)
         
     # Formatting/Configuration
@@ -0,0 +1,158 @@
+"""
+ParameterSweep.py
+"""
+import itertools
+import time
+from array import array
+from collections import OrderedDict
+
+try:
+    perfCounter = time.perf_counter
+except AttributeError:
+    perfCounter = time.time
+
+
+def snakeOrder(sizes):
+    """ indices of a grid in reflected (boustrophedon) order
+
+    The first axis is the outermost one. Every inner axis runs backwards on
+    every other pass, so consecutive points differ in exactly one axis, a
+    mixed-radix Gray code.
+
+    :param sizes: number of values of each axis
+    :returns: list of index tuples
+    """
+    indices = [()]
+    for size in sizes:
+        forward = list(range(size))
+        backward = forward[::-1]
+        indices = [prefix + (j,)
+                   for k, prefix in enumerate(indices)
+                   for j in (backward if k % 2 else forward)]
+    return indices
+
+
+def rasterOrder(sizes):
+    """ indices of a grid in nested loop order, the last axis fastest """
+    return list(itertools.product(*[range(size) for size in sizes]))
+
+
+class ParameterSweep:
+
+    """
+    Steps a function generator through a grid of settings, sending only the
+    SCPI nodes that change from one point to the next::
+
+        sweep = ParameterSweep(fgen, [
+            ('SOUR1:FREQ', [1e3, 2e3, 5e3]),
+            ('SOUR1:VOLT', [0.1, 0.2, 0.5]),
+            ('SOUR1:BURS:NCYC', [1, 10, 100])], opc=['SOUR1:FREQ'])
+        results = sweep.run(acquire)
+
+    Each axis is a node and its values; a node containing '%' is a
+    template for the whole command, e.g. 'APPL:SIN %s, 1, 0'. Points are
+    visited in snake order, so every step changes a single node and the
+    last axis changes most often: list expensive settings first. Axes named
+    in opc are moved outermost, and *OPC is waited for only after a point
+    that changed one of them.
+
+    The changed nodes of a point go out as one coalesced message through
+    fgen.batch() and fgen.setState(), so a StateShadow on the function
+    generator also drops values the instrument already has.
+    """
+
+    orders = {'snake': snakeOrder, 'raster': rasterOrder}
+
+    def __init__(self, fgen, axes, opc=(), order='snake', timeout=10.0):
+        """
+        :param fgen: FunctionGenerator to set up
+        :param axes: list of (node, values) pairs, or an OrderedDict, the
+        outermost axis first
+        :param opc: (optional) nodes after whose change the sweep waits for
+        the instrument to finish (*OPC), or True for every point
+        :param str order: (optional, default 'snake') 'snake' or 'raster'
+        (plain nested loops)
+        :param float timeout: (optional) seconds to wait for *OPC
+        """
+        if order not in self.orders:
+            raise ValueError("Unknown sweep order %r" % order)
+        axes = list(axes.items() if isinstance(axes, dict) else axes)
+        self.opcAll = opc is True
+        self.opc = set() if opc is True else set(opc)
+        # stable sort: axes that need *OPC change least
+        axes.sort(key=lambda axis: axis[0] not in self.opc)
+        self.nodes = [node for node, values in axes]
+        self.values = [list(values) for node, values in axes]
+        self.order = order
+        self.timeout = timeout
+        self.fgen = fgen
+        self.setupTimes = array('d')
+        self.sent = 0
+
+    def __len__(self):
+        n = 1
+        for values in self.values:
+            n *= len(values)
+        return n
+
+    def command(self, axis, value):
+        """ SCPI command setting an axis to a value """
+        node = self.nodes[axis]
+        if '%' in node:
+            return node % (value,)
+        return '%s %s' % (node, value)
+
+    def points(self):
+        """ the grid points in sweep order
+
+        :returns: list of OrderedDict node -> value
+        """
+        return [OrderedDict((node, values[j]) for node, values, j in
+                            zip(self.nodes, self.values, index))
+                for index in self.orders[self.order]([len(v) for v in
+                                                       self.values])]
+
+    def steps(self):
+        """ the commands each point needs after the one before
+
+        :returns: list of (point, commands, waitOpc)
+        """
+        steps = []
+        previous = None
+        for index in self.orders[self.order]([len(v) for v in self.values]):
+            changed = [axis for axis, j in enumerate(index)
+                       if previous is None or previous[axis] != j]
+            point = OrderedDict((node, values[j]) for node, values, j in
+                                zip(self.nodes, self.values, index))
+            commands = [self.command(axis, self.values[axis][index[axis]])
+                        for axis in changed]
+            waitOpc = self.opcAll or any(self.nodes[axis] in self.opc
+                                         for axis in changed)
+            steps.append((point, commands, waitOpc))
+            previous = index
+        return steps
+
+    def run(self, measure=None):
+        """ set up every point, calling measure after each one
+
+        :param measure: (optional) called with the point (OrderedDict node
+        -> value) once it is set up, e.g. to trigger and acquire
+        :returns: list of (point, setup seconds, measure result)
+        """
+        fgen = self.fgen
+        steps = self.steps()
+        self.setupTimes = array('d', [0.0]) * len(steps)
+        self.sent = 0
+        results = []
+        for i, (point, commands, waitOpc) in enumerate(steps):
+            start = perfCounter()
+            with fgen.batch():
+                for command in commands:
+                    if fgen.setState(command):
+                        self.sent += 1
+            if waitOpc:
+                fgen.waitComplete(self.timeout)
+            self.setupTimes[i] = perfCounter() - start
+            result = measure(point) if measure is not None else None
+            results.append((point, self.setupTimes[i], result))
+        return results
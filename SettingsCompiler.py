@@ -0,0 +1,162 @@
+"""
+SettingsCompiler.py
+"""
+import hashlib
+import json
+import os
+import re
+
+from SettingsError import SettingsError
+
+
+class SettingsProgram:
+
+    """
+    A settings file compiled into the messages that apply it.
+
+    :ivar filename: the settings file
+    :ivar lines: (line number, command) tuples of the commands that are kept
+    :ivar messages: the kept commands packed into ';' joined messages
+    """
+
+    def __init__(self, filename, lines, messages):
+        self.filename = filename
+        self.lines = [tuple(line) for line in lines]
+        self.messages = list(messages)
+
+    def toDict(self):
+        return {'filename': self.filename, 'lines': self.lines,
+                'messages': self.messages}
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(d['filename'], d['lines'], d['messages'])
+
+
+class SettingsCompiler:
+
+    """
+    Compiles settings files (one command per line, # comments) into a
+    SettingsProgram: comments and empty lines are stripped, commands are
+    syntax checked, earlier writes to a node that is written again are
+    dropped and the rest is packed into as few messages as possible.
+
+    A write is only dropped if no node coupled to it in the shadow (e.g.
+    APPL and FUNC, FREQ and the pulse period) is written before the node
+    is written again, so coupled settings are applied in file order.
+
+    Programs are cached in memory and as JSON on disk, keyed by the file's
+    path, modification time and size, the instrument model, the compiler
+    options and compilerVersion.
+    """
+
+    # Part of the cache key; bump it when build() or pack() change what they
+    # produce, so programs cached by an older version are not reused
+    compilerVersion = 1
+
+    commandPattern = re.compile(r'^(\*[A-Za-z]+|:?[A-Za-z][A-Za-z0-9_]*'
+                                r'(:[A-Za-z][A-Za-z0-9_]*)*)(\s+\S.*)?$')
+
+    def __init__(self, shadow, rootReset=True, maxLength=4096,
+                 cacheDir=None):
+        """
+        :param shadow: StateShadow used to normalize nodes, so that e.g.
+        OUTPUT1 and OUTP1 are recognized as the same setting
+        :param bool rootReset: (optional, default True) prefix joined
+        commands with ':' so each one starts from the SCPI root
+        :param int maxLength: (optional, default 4096) longest message in
+        bytes
+        :param str cacheDir: (optional) directory for compiled programs,
+        defaults to ~/.cache/fgen_interface. '' disables the disk cache.
+        """
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.expanduser('~'), '.cache',
+                                    'fgen_interface')
+        self.shadow = shadow
+        self.rootReset = rootReset
+        self.maxLength = maxLength
+        self.cacheDir = cacheDir
+        self.programs = {}
+
+    def cacheKey(self, filename, model):
+        st = os.stat(filename)
+        key = "|".join([os.path.abspath(filename), repr(st.st_mtime),
+                        str(st.st_size), model, str(self.rootReset),
+                        str(self.maxLength), str(self.compilerVersion)])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def compile(self, filename, model=''):
+        """ compile a settings file, using the cache when possible
+
+        :param str filename: string name of text file to read from
+        :param str model: instrument model the program is compiled for
+        :returns: program -- SettingsProgram
+        :raises SettingsError: on a line that is not a valid command
+        """
+        key = self.cacheKey(filename, model)
+        if key in self.programs:
+            return self.programs[key]
+
+        path = None
+        if self.cacheDir:
+            path = os.path.join(self.cacheDir, key + '.json')
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    program = SettingsProgram.fromDict(json.load(f))
+                self.programs[key] = program
+                return program
+
+        program = self.build(filename)
+        self.programs[key] = program
+        if path is not None:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            with open(path, 'w') as f:
+                json.dump(program.toDict(), f)
+        return program
+
+    def build(self, filename):
+        """ compile a settings file without looking at the cache """
+        lines = []
+        with open(filename, 'r') as f:
+            for lineno, line in enumerate(f, 1):
+                sline = line.strip()
+                if not sline or sline.startswith('#'):
+                    continue
+                if (self.commandPattern.match(sline) is None or
+                        sline.split(None, 1)[0].endswith('?')):
+                    raise SettingsError(filename, lineno, sline,
+                                        ["Invalid settings command"])
+                lines.append((lineno, sline))
+
+        # keep only the last write to each node since the last reset, or
+        # since the last write to a node coupled to it
+        kept = [True] * len(lines)
+        written = {}
+        for i, (lineno, command) in enumerate(lines):
+            if self.shadow.isReset(command):
+                written = {}
+                continue
+            node, value = self.shadow.parse(command)
+            if node is None or value == '':
+                continue
+            if node in written:
+                kept[written[node]] = False
+            for other in [n for n in written if n != node and
+                          (self.shadow.coupled(node, n) or
+                           self.shadow.coupled(n, node))]:
+                del written[other]
+            written[node] = i
+        lines = [line for line, keep in zip(lines, kept) if keep]
+
+        return SettingsProgram(filename, lines,
+                               self.pack([c for n, c in lines]))
+
+    def pack(self, commands):
+        """ join commands into messages of at most maxLength bytes, the
+        way usbtmc.Instrument coalesces writes """
+        from usbtmc import join_commands
+
+        return [m.decode('utf-8') for m in join_commands(
+            [c.encode('utf-8') for c in commands], self.maxLength,
+            self.rootReset)]
@@ -0,0 +1,29 @@
+"""
+SettingsError.py
+"""
+
+
+class SettingsError(Exception):
+
+    """
+    Raised when a settings file can not be compiled, or when the instrument
+    reports an error while loading it.
+
+    :ivar filename: the settings file
+    :ivar lineno: line number of the failing command, None if it could not
+    be located
+    :ivar command: the failing command
+    :ivar errors: error messages read off the instrument's error queue, or
+    found by the compiler
+    """
+
+    def __init__(self, filename, lineno, command, errors):
+        self.filename = filename
+        self.lineno = lineno
+        self.command = command
+        self.errors = list(errors)
+        where = filename if lineno is None else "%s:%d" % (filename, lineno)
+        message = where + ": " + "; ".join(self.errors)
+        if command is not None:
+            message += " (" + command + ")"
+        Exception.__init__(self, message)
@@ -0,0 +1,118 @@
+"""
+SimulatedDSO.py
+"""
+import math
+import re
+import time
+
+
+class SimulatedDSO:
+
+    """
+    Stand-in for the LeCroy ActiveDSO control used by Oscilloscope, so that
+    scope code can run and be timed without the instrument or Windows::
+
+        osc = Oscilloscope('IP:127.0.0.1', dso=SimulatedDSO())
+
+    Parameters written as "HEADER VALUE" are stored and answered by
+    "HEADER?". The channel waveform is a sine, returned by
+    "Cn:INSPECT? SIMPLE" as whitespace separated values like the real scope,
+    with the number of points set by WFSU NP.
+    """
+
+    idn = "LECROY,WS42MXS-B,SIM00001,7.6.0"
+
+    def __init__(self, latency=0.0, bandwidth=None, points=5000):
+        """
+        :param float latency: (optional) seconds added to every WriteString
+        and ReadString call
+        :param float bandwidth: (optional) bytes per second of the link,
+        None for unlimited
+        :param int points: (optional) points in a waveform when WFSU NP is 0
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.points = points
+        self.connected = None
+        self.timeout = 10.0
+        self.settings = {}
+        self.output = ''
+        self.writes = 0
+        self.traces = {}  # (channel, points) -> INSPECT? text
+
+    def MakeConnection(self, address):
+        self.connected = address
+        return True
+
+    def Disconnect(self):
+        self.connected = None
+        return True
+
+    def SetTimeout(self, seconds):
+        self.timeout = seconds
+        return True
+
+    def delay(self, size):
+        seconds = self.latency
+        if self.bandwidth:
+            seconds += float(size) / self.bandwidth
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def WriteString(self, command, eoi):
+        self.delay(len(command))
+        self.writes += 1
+        responses = [self.execute(c.strip()) for c in command.split(';')]
+        responses = [r for r in responses if r is not None]
+        if responses:
+            self.output = ';'.join(responses)
+        return True
+
+    def ReadString(self, count):
+        data, self.output = (self.output[:int(count)],
+                             self.output[int(count):])
+        self.delay(len(data))
+        return data
+
+    def execute(self, command):
+        if not command:
+            return None
+        parts = command.split(None, 1)
+        header = parts[0].upper()
+        value = parts[1] if len(parts) > 1 else ''
+        if header == '*IDN?':
+            return self.idn
+        if header == '*RST':
+            self.settings.clear()
+            return None
+        if header in ('CMR?', '*OPC?'):
+            return '0' if header == 'CMR?' else '1'
+        if header == '*LRN?':
+            return ';'.join(h + ' ' + v
+                            for h, v in sorted(self.settings.items()))
+        if header.endswith(':INSPECT?') or header.endswith(':INSP?'):
+            return self.inspect(header.split(':')[0])
+        if header.startswith('VBS?'):
+            return 'VBS 0'
+        if header.endswith('?'):
+            return self.settings.get(header[:-1], '')
+        self.settings[header] = value
+        return None
+
+    def waveformPoints(self):
+        m = re.search(r'NP,(\d+)', self.settings.get('WFSU', ''))
+        n = int(m.group(1)) if m is not None else 0
+        return n if n > 0 else self.points
+
+    def inspect(self, channel):
+        """ waveform of a channel as the text of an INSPECT? "SIMPLE" """
+        n = self.waveformPoints()
+        if (channel, n) in self.traces:
+            return self.traces[channel, n]
+        cycles = 2.0 if channel == 'C1' else 3.0
+        values = ['% .4e' % math.sin(2 * math.pi * cycles * i / n)
+                  for i in range(n)]
+        lines = ['  '.join(values[i:i+5]) for i in range(0, n, 5)]
+        text = channel + ':INSP "\r\n' + '\r\n'.join(lines) + '\r\n"'
+        self.traces[channel, n] = text
+        return text
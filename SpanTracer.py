@@ -0,0 +1,245 @@
+"""
+SpanTracer.py
+"""
+import collections
+import inspect
+import json
+import random
+import threading
+import time
+
+try:
+    perfCounter = time.perf_counter
+except AttributeError:
+    perfCounter = time.time
+
+
+def payloadSize(value):
+    """ bytes carried by an argument or result, 0 if it is not a payload """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    nbytes = getattr(value, 'nbytes', None)
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+class SpanTracer:
+
+    """
+    Opt-in tracing of nested method calls. attach() replaces the public
+    methods of an instrument object with wrappers that record a span per
+    call: start, duration, thread, the bytes passed in and returned and
+    the exception raised, if any. Calls made inside a traced call become
+    its children, so a slow pushArbitraryWaveform splits into validation,
+    encoding, USB writes and error polling::
+
+        tracer = SpanTracer()
+        fgen.setTracer(tracer)
+        fgen.pushArbitraryWaveform(waveform, binary=True)
+        tracer.export('trace.json')  # open in chrome://tracing or Perfetto
+
+    With sampleRate below 1 only that fraction of top-level calls is
+    traced, together with everything they call; the others cost a
+    thread-local lookup per call. Only the latest maxEvents spans are kept.
+
+    Generator methods such as Instrument.read_chunks are traced over their
+    iteration, from the first chunk until the generator is exhausted or
+    closed, with the bytes of every chunk.
+
+    Wrappers follow the convention of usbtmc.metrics: each keeps the method
+    it wraps in .wrapped and its tracer in .installed_by, so metrics and
+    tracers can be attached and detached in any order.
+    """
+
+    # Methods that are not traced: context managers, and the methods
+    # managing tracing, metrics and recording themselves
+    untraced = ('batch', 'setTracer', 'setMetrics', 'set_metrics',
+                'startRecording', 'stopRecording', 'start_recording',
+                'stop_recording', 'getSession', 'submit')
+
+    def __init__(self, sampleRate=1.0, maxEvents=100000):
+        """
+        :param float sampleRate: (optional) fraction of top-level calls to
+        trace
+        :param int maxEvents: (optional) number of spans kept, the oldest
+        ones are dropped first
+        """
+        self.sampleRate = sampleRate
+        self.events = collections.deque(maxlen=maxEvents)
+        self.local = threading.local()
+        self.origin = perfCounter()
+        self.attached = {}  # id(obj) -> (obj, names of the wrapped methods)
+
+    def attach(self, obj, methods=None):
+        """ trace the public methods of an object
+
+        :param methods: (optional) names of the methods to trace, all
+        public methods not in untraced by default
+        """
+        if id(obj) in self.attached:
+            return
+        cls = type(obj)
+        if methods is None:
+            methods = [name for name in dir(cls)
+                       if not name.startswith('_') and name not in self.untraced
+                       and callable(getattr(cls, name))
+                       and not isinstance(getattr(cls, name), type)]
+        category = cls.__name__
+        for name in methods:
+            function = inspect.unwrap(getattr(cls, name, None) or
+                                      getattr(obj, name))
+            wrap = (self.wrapIteration if inspect.isgeneratorfunction(function)
+                    else self.wrap)
+            setattr(obj, name, wrap(category + '.' + name, category,
+                                    getattr(obj, name)))
+        self.attached[id(obj)] = (obj, methods)
+
+    def detach(self, obj):
+        """ remove the wrappers this tracer installed on an object """
+        from usbtmc.usbtmc import remove_wrapper
+
+        obj, methods = self.attached.pop(id(obj), (obj, []))
+        for name in methods:
+            remove_wrapper(obj, name, self)
+
+    def detachAll(self):
+        for obj, methods in list(self.attached.values()):
+            self.detach(obj)
+
+    def stack(self):
+        """ spans open in the calling thread """
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def sampled(self, stack):
+        """ whether the next call in this thread is traced """
+        if stack:
+            return stack[-1] is not None
+        return self.sampleRate >= 1 or random.random() < self.sampleRate
+
+    def wrap(self, name, category, func):
+        tracer = self
+
+        def traced(*args, **kwargs):
+            stack = tracer.stack()
+            if not tracer.sampled(stack):
+                if stack:
+                    return traced.wrapped(*args, **kwargs)
+                stack.append(None)
+                try:
+                    return traced.wrapped(*args, **kwargs)
+                finally:
+                    stack.pop()
+            nbytes = sum(payloadSize(a) for a in args)
+            nbytes += sum(payloadSize(a) for a in kwargs.values())
+            with tracer.span(name, category, bytesIn=nbytes) as span:
+                result = traced.wrapped(*args, **kwargs)
+                span['bytesOut'] = payloadSize(result)
+                return result
+        return self.mark(traced, func)
+
+    def wrapIteration(self, name, category, func):
+        tracer = self
+
+        def iterate(iterator):
+            # not on the span stack: the consumer runs between chunks
+            args = {'bytesOut': 0}
+            start = perfCounter()
+            try:
+                for item in iterator:
+                    args['bytesOut'] += payloadSize(item)
+                    yield item
+            except Exception as e:
+                args['error'] = type(e).__name__
+                raise
+            finally:
+                tracer.record(name, category, start, perfCounter(), args)
+
+        def traced(*args, **kwargs):
+            iterator = traced.wrapped(*args, **kwargs)
+            if not tracer.sampled(tracer.stack()):
+                return iterator
+            return iterate(iterator)
+        return self.mark(traced, func)
+
+    def mark(self, traced, func):
+        traced.__name__ = func.__name__
+        traced.__doc__ = func.__doc__
+        traced.wrapped = func
+        traced.installed_by = self
+        return traced
+
+    def span(self, name, category='span', **args):
+        """ context manager recording a span around a block, for code
+        that is not a method of its own; yields the dict of span args """
+        return Span(self, name, category, args)
+
+    def record(self, name, category, start, end, args):
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+            'pid': 1, 'tid': threading.current_thread().ident,
+            'args': args})
+
+    def clear(self):
+        self.events.clear()
+
+    def chromeTrace(self):
+        """ spans as a Chrome trace-event dict """
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def export(self, filename):
+        """ write the spans as Chrome trace-event JSON """
+        with open(filename, 'w') as f:
+            json.dump(self.chromeTrace(), f)
+
+    def summary(self):
+        """ total and self time in seconds and calls per span name
+
+        :returns: dict name -> (calls, total, self time)
+        """
+        totals = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        for event in self.events:
+            entry = totals[event['name']]
+            entry[0] += 1
+            entry[1] += event['dur'] * 1e-6
+            entry[2] += (event['dur'] - event['args'].get('childTime', 0.0)) * 1e-6
+        return dict((name, tuple(entry)) for name, entry in totals.items())
+
+
+class Span:
+
+    """ one span open in the current thread, see SpanTracer.span """
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.args['childTime'] = 0.0
+        self.stack = self.tracer.stack()
+        self.skip = bool(self.stack) and self.stack[-1] is None
+        if self.skip:
+            # inside a call that was not sampled
+            return self.args
+        self.stack.append(self)
+        self.start = perfCounter()
+        return self.args
+
+    def __exit__(self, excType, exc, tb):
+        if self.skip:
+            return False
+        end = perfCounter()
+        self.stack.pop()
+        if excType is not None:
+            self.args['error'] = excType.__name__
+        if self.stack and self.stack[-1] is not None:
+            self.stack[-1].args['childTime'] += (end - self.start) * 1e6
+        self.tracer.record(self.name, self.category, self.start, end,
+                           self.args)
+        return False
@@ -0,0 +1,202 @@
+"""
+StateShadow.py
+"""
+import re
+
+from usbtmc.usbtmc import short_form
+
+
+class StateShadow:
+
+    """
+    Write-through mirror of the last value written to each SCPI node of an
+    instrument. Commands that would not change anything can then be dropped
+    before they cost a bus round trip.
+
+    The shadow only knows what went through it: front panel changes or
+    commands sent behind its back make it stale, so it is opt-in on the
+    instrument classes and can be cleared or reloaded at any time.
+    """
+
+    # Commands after which the instrument state is unknown
+    resetCommands = ('*RST', '*RCL', 'MMEM:LOAD:STAT', 'SYST:PRES')
+
+    # Units stripped from numeric values (no multiplier prefixes, so that
+    # "1 KHZ" is never mistaken for "1")
+    baseUnits = ('V', 'S', 'HZ', 'A', 'OHM', 'DIV', 'PCT', 'DEG')
+
+    numberPattern = re.compile(r'^([-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?)'
+                               r'\s*([A-Z]*)$')
+
+    def __init__(self, aliases=None, couplings=(), shortForms=True,
+                 relativePaths=True):
+        """
+        :param dict aliases: (optional) maps a root keyword to the canonical
+        path it stands for, e.g. {'APPL': 'SOUR1:APPL', 'OUTP': 'OUTP1'}, so
+        that implied channels share one node.
+        :param couplings: (optional) pairs of node paths (writes, forgets).
+        Writing a node at or below the first path forgets every known node at
+        or below the second one.
+        :param bool shortForms: (optional, default True) reduce keywords and
+        keyword values to their SCPI short form (FREQUENCY -> FREQ).
+        :param bool relativePaths: (optional, default True) a command after
+        ';' that does not start with ':' continues the header path of the
+        one before, as in SCPI ("SOUR2:FREQ 1000;VOLT 1" sets SOUR2:VOLT).
+        """
+        self.aliases = aliases or {}
+        self.couplings = couplings
+        self.shortForms = shortForms
+        self.relativePaths = relativePaths
+        self.values = {}
+        self.suppressed = 0  # number of writes dropped by update()
+
+    def node(self, header):
+        """ canonical path of a command header """
+        keywords = header.lstrip(':').upper().split(':')
+        if self.shortForms:
+            keywords = [short_form(k) for k in keywords]
+        if keywords[0] in self.aliases:
+            keywords[0] = self.aliases[keywords[0]]
+        return ':'.join(keywords)
+
+    def value(self, text):
+        """ canonical form of a command's parameters """
+        items = []
+        for item in text.split(','):
+            item = item.strip()
+            if item[:1] in ('"', "'"):
+                items.append(item)
+                continue
+            item = item.upper()
+            m = self.numberPattern.match(item)
+            if m is not None and m.group(4) in ('',) + self.baseUnits:
+                items.append(repr(float(m.group(1))))
+            elif item in ('ON', 'OFF'):
+                items.append(repr(1.0) if item == 'ON' else repr(0.0))
+            elif self.shortForms:
+                items.append(short_form(item))
+            else:
+                items.append(item)
+        return ','.join(items)
+
+    def parse(self, command):
+        """ split a single command into (node, value)
+
+        :returns: (node, value) -- node is None for queries and common (*)
+        commands, value is '' for commands without parameters
+        """
+        parts = command.strip().split(None, 1)
+        if not parts or parts[0].endswith('?') or parts[0].startswith('*'):
+            return None, None
+        value = self.value(parts[1]) if len(parts) > 1 else ''
+        return self.node(parts[0]), value
+
+    def split(self, message):
+        """ split a ';' separated message into commands with their full
+        header, resolving relative headers against the path of the command
+        before them """
+        commands = []
+        path = []
+        for command in message.split(';'):
+            parts = command.strip().split(None, 1)
+            if not parts or parts[0].startswith('*'):
+                commands.append(command)
+                continue
+            header = parts[0]
+            if header.startswith(':') or not self.relativePaths:
+                keywords = header.lstrip(':').split(':')
+            else:
+                keywords = path + header.split(':')
+                command = ':'.join(keywords) + command.strip()[len(header):]
+            path = keywords[:-1]
+            commands.append(command)
+        return commands
+
+    def isReset(self, command):
+        header = command.strip().split(None, 1)
+        if not header:
+            return False
+        header = header[0].upper()
+        if not header.startswith('*'):
+            header = self.node(header)
+        return header in self.resetCommands
+
+    def covers(self, path, node):
+        return node == path or node.startswith(path + ':')
+
+    def coupled(self, node, other):
+        """ whether writing node can change other """
+        return any(self.covers(writes, node) and self.covers(forgets, other)
+                   for writes, forgets in self.couplings)
+
+    def forget(self, node):
+        """ forget a node and everything coupled to it """
+        for writes, forgets in self.couplings:
+            if self.covers(writes, node):
+                for known in [k for k in self.values
+                              if self.covers(forgets, k)]:
+                    del self.values[known]
+        self.values.pop(node, None)
+
+    def observe(self, message):
+        """ record a message that was written to the instrument
+
+        Handles ';' separated messages, clears everything on reset commands
+        and ignores queries and commands without parameters.
+        """
+        for command in self.split(message):
+            if self.isReset(command):
+                self.clear()
+                continue
+            node, value = self.parse(command)
+            if node is None or value == '':
+                continue
+            if self.values.get(node) != value:
+                self.forget(node)
+                self.values[node] = value
+
+    def update(self, command):
+        """ check a command against the shadow before writing it
+
+        :returns: bool -- False if the command would not change anything
+        (and should be dropped), True if it must be sent. In that case the
+        shadow already records its effect.
+        """
+        node, value = self.parse(command)
+        if (node is not None and value != '' and ';' not in command and
+                self.values.get(node) == value):
+            self.suppressed += 1
+            return False
+        self.observe(command)
+        return True
+
+    def set(self, command):
+        """ record a known setting without forgetting coupled nodes
+
+        Used to load a consistent snapshot of the instrument state.
+        """
+        node, value = self.parse(command)
+        if node is not None and value != '':
+            self.values[node] = value
+
+    def invalidate(self, command):
+        """ forget the node a command set, e.g. when the instrument rejected
+        it """
+        for part in self.split(command):
+            node, value = self.parse(part)
+            if node is not None:
+                self.forget(node)
+
+    def load(self, text):
+        """ replace the shadow with a settings dump such as a *LRN? response
+
+        :param str text: ';' or newline separated commands
+        """
+        self.clear()
+        for line in text.splitlines():
+            for command in self.split(line):
+                self.set(command)
+
+    def clear(self):
+        """ forget everything, e.g. after *RST """
+        self.values.clear()
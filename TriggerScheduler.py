@@ -0,0 +1,157 @@
+"""
+TriggerScheduler.py
+"""
+import threading
+import time
+from array import array
+
+try:
+    perfCounter = time.perf_counter
+except AttributeError:
+    perfCounter = time.time
+
+
+def waitUntil(deadline, spin=0.002):
+    """ wait for a perfCounter() time: sleep until spin seconds before it,
+    then busy-wait, which avoids the scheduler's wake-up jitter """
+    remaining = deadline - perfCounter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while perfCounter() < deadline:
+        pass
+
+
+def percentile(values, q):
+    """ q-th percentile (0-100) of a sorted sequence """
+    return values[int(round(q / 100.0 * (len(values) - 1)))]
+
+
+class TriggerScheduler:
+
+    """
+    Sends bus triggers at a fixed rate from a dedicated thread, e.g. 100 Hz
+    to a function generator with both channels set to TRIGGER1:SOURCE BUS
+    and TRIGGER2:SOURCE BUS::
+
+        scheduler = TriggerScheduler(fgen, rate=100, count=1000)
+        scheduler.start()
+        scheduler.join()
+        print(scheduler.stats())
+
+    Shot i is due period * i after the start. The thread sleeps until
+    shortly before each deadline and spins for the rest, on the monotonic
+    perfCounter clock. The time every trigger was sent and returned is
+    written to preallocated arrays, so the loop does not allocate. A shot
+    that is due while the previous one is still running is sent at once
+    and counted in overruns; the schedule does not shift.
+
+    With a scope, it is armed before the first shot and re-armed right
+    after every trigger, so arming overlaps the wait for the next shot.
+    """
+
+    def __init__(self, fgen, rate=100.0, count=1000, scope=None, spin=0.002,
+                 delay=0.01):
+        """
+        :param fgen: FunctionGenerator, or usbtmc.Instrument, to trigger
+        :param float rate: (optional) triggers per second
+        :param int count: (optional) number of triggers
+        :param scope: (optional) Oscilloscope to arm before every trigger
+        :param float spin: (optional) seconds spent busy-waiting before
+        each deadline
+        :param float delay: (optional) seconds from start() to the first
+        trigger
+        """
+        # bound once, so a shot costs one call: Instrument.trigger sends a
+        # packet prebuilt for its btag
+        self.fire = getattr(fgen, 'sendTrigger', None) or fgen.trigger
+        self.period = 1.0 / rate
+        self.count = count
+        self.scope = scope
+        self.spin = spin
+        self.delay = delay
+        self.fired = array('d', [0.0]) * count
+        self.returned = array('d', [0.0]) * count
+        self.startTime = None
+        self.shots = 0
+        self.overruns = 0
+        self.error = None
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        """ start triggering on a new thread """
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run,
+                                       name='TriggerScheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ stop after the shot in progress """
+        self.stopping = True
+        self.join()
+
+    def join(self, timeout=None):
+        """ wait for the thread, then raise the error it stopped on, if any
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        """ trigger count times on the calling thread """
+        fire, arm, period, spin = self.fire, None, self.period, self.spin
+        fired, returned = self.fired, self.returned
+        if self.scope is not None:
+            arm = self.scope.arm
+            arm()
+        self.shots = self.overruns = 0
+        self.startTime = start = perfCounter() + self.delay
+        try:
+            for i in range(self.count):
+                if self.stopping:
+                    break
+                deadline = start + i * period
+                if perfCounter() > deadline:
+                    self.overruns += 1
+                else:
+                    waitUntil(deadline, spin)
+                fired[i] = perfCounter()
+                fire()
+                returned[i] = perfCounter()
+                self.shots = i + 1
+                if arm is not None and i + 1 < self.count:
+                    arm()
+        except Exception as e:
+            self.error = e
+
+    def stats(self):
+        """ achieved rate and timing of the shots sent so far
+
+        :returns: dict -- shots, overruns, rate (triggers per second) and,
+        in seconds, percentiles of the lateness of each trigger against its
+        deadline (late*), of the deviation of each interval from the period
+        (jitter*) and of the time a trigger call took (call*)
+        """
+        n = self.shots
+        result = {'shots': n, 'overruns': self.overruns}
+        if n == 0:
+            return result
+        late = sorted(self.fired[i] - (self.startTime + i * self.period)
+                      for i in range(n))
+        call = sorted(self.returned[i] - self.fired[i] for i in range(n))
+        for name, values in (('late', late), ('call', call)):
+            for q in (50, 90, 99):
+                result['%sP%d' % (name, q)] = percentile(values, q)
+            result[name + 'Max'] = values[-1]
+        if n > 1:
+            elapsed = self.fired[n - 1] - self.fired[0]
+            result['rate'] = (n - 1) / elapsed if elapsed > 0 else 0.0
+            jitter = sorted(abs(self.fired[i] - self.fired[i - 1] - self.period)
+                            for i in range(1, n))
+            for q in (50, 90, 99):
+                result['jitterP%d' % q] = percentile(jitter, q)
+            result['jitterMax'] = jitter[-1]
+        return result
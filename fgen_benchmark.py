@@ -0,0 +1,413 @@
+"""
+fgen_benchmark.py
+
+Times the transport, waveform encoding, settings loading, parsing and
+trigger hot paths against simulated instruments (usbtmc.simulator and SimulatedDSO),
+appends the results to a JSON history and flags every case whose median
+got slower than in the previous run with the same device settings::
+
+    python fgen_benchmark.py
+    python fgen_benchmark.py --latency 125e-6 --bandwidth 35e6 --only encoding
+    python fgen_benchmark.py --replay session.trace --only replay
+
+With --replay, the replay case sends the transfers of a session recorded
+with Instrument.start_recording() to a usbtmc.trace.ReplayDevice, which
+answers with the recorded data after the recorded device time (scaled by
+--replay-scale), so a production session can be timed offline.
+
+Exits with status 1 when a regression was flagged.
+"""
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from FunctionGenerator import FunctionGenerator
+
+try:
+    perfCounter = time.perf_counter
+except AttributeError:
+    perfCounter = time.time
+
+here = os.path.dirname(os.path.abspath(__file__))
+defaultHistory = os.path.join(os.path.expanduser('~'), '.cache',
+                              'fgen_interface', 'benchmark_history.json')
+
+
+def makeModel():
+    """ 33522A model with two benchmark commands: BENC:DATA <block> is
+    accepted and dropped, BENC:DATA? returns a block of BENC:SIZE bytes """
+    from usbtmc import pack_block_header
+    from usbtmc.simulator import Agilent33522A
+
+    model = Agilent33522A()
+    size = [0]
+
+    def setSize(header, params):
+        size[0] = int(params)
+
+    model.commands.update({
+        'BENC:SIZE': setSize,
+        'BENC:DATA': lambda header, params: None,
+        'BENC:DATA?': lambda header, params: (pack_block_header(size[0]) +
+                                              b'\0' * size[0]),
+    })
+    return model
+
+
+def makeInstrument(opts, **kwargs):
+    """ open a usbtmc.Instrument on a simulated device """
+    import usbtmc
+    from usbtmc.simulator import SimulatedDevice
+
+    device = SimulatedDevice(makeModel(), latency=opts.latency,
+                             bandwidth=opts.bandwidth)
+    return usbtmc.Instrument(device=device, **kwargs)
+
+
+def timeCalls(func, repeat, setup=None, warmup=3):
+    """ time repeat calls of func, after warmup untimed ones
+
+    :param setup: (optional) called untimed before every call
+    :returns: samples -- list of seconds per call
+    """
+    samples = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = perfCounter()
+        func()
+        elapsed = perfCounter() - start
+        if i >= warmup:
+            samples.append(elapsed)
+    return samples
+
+
+def summarize(name, samples, nbytes=0, commands=1):
+    """ reduce samples to percentiles and throughput
+
+    :param int nbytes: (optional) payload bytes moved by one call
+    :param int commands: (optional) SCPI commands sent by one call
+    """
+    samples = sorted(samples)
+    n = len(samples)
+    total = sum(samples)
+    result = {'name': name, 'n': n,
+              'p50': samples[(n - 1) // 2],
+              'p99': samples[int(round(0.99 * (n - 1)))],
+              'mean': total / n,
+              'stdev': (sum((x - total / n) ** 2 for x in samples) / n) ** 0.5,
+              'cmdPerSec': commands * n / total if total else 0.0}
+    if nbytes:
+        result['MBPerSec'] = nbytes * n / total / 1e6 if total else 0.0
+    return result
+
+
+def repeatFor(opts, size):
+    """ fewer repetitions for large payloads """
+    return max(5, min(opts.repeat, opts.repeat * 65536 // max(size, 1)))
+
+
+def benchTransport(opts):
+    """ writes, reads and a query; reads use bulk-IN transfers of
+    opts.transfer_size bytes, so the larger ones span several transfers """
+    from usbtmc import pack_block_header
+
+    instr = makeInstrument(opts)
+    maxRecvSize = instr.max_recv_size
+    results = []
+    for size in (16, 1024, 65536, 1048576):
+        payload = b'BENC:DATA ' + pack_block_header(size) + b'\0' * size
+        samples = timeCalls(lambda: instr.write_raw(payload),
+                            repeatFor(opts, size))
+        results.append(summarize('write_raw %d' % size, samples,
+                                 len(payload)))
+
+        instr.write('BENC:SIZE %d' % size)
+        instr.max_recv_size = opts.transfer_size
+        samples = timeCalls(instr.read_raw, repeatFor(opts, size),
+                            setup=lambda: instr.write('BENC:DATA?'))
+        results.append(summarize('read_raw %d' % size, samples, size))
+        instr.max_recv_size = maxRecvSize
+
+    samples = timeCalls(lambda: instr.ask('*IDN?'), opts.repeat)
+    results.append(summarize('ask *IDN?', samples))
+    return results
+
+
+def benchEncoding(opts):
+    import numpy as np
+
+    fgen = FunctionGenerator(makeInstrument(opts))
+    results = []
+    for points in (8, 100, 1000, 16000):
+        waveform = np.rint(2047 * np.sin(np.linspace(0, 2 * np.pi, points)))
+        waveform = waveform.astype(np.int16)
+        for binary in (False, True):
+            samples = timeCalls(
+                lambda: fgen.loadArbitraryWaveform(waveform, binary),
+                repeatFor(opts, 8 * points))
+            name = 'loadArbitraryWaveform %s %d' % (
+                'binary' if binary else 'ascii', points)
+            results.append(summarize(name, samples, 2 * points))
+    return results
+
+
+def benchSettings(opts):
+    from SettingsCompiler import SettingsCompiler
+
+    filename = os.path.join(here, 'fparams.txt')
+    fgen = FunctionGenerator(makeInstrument(opts))
+    fgen.compiler = SettingsCompiler(fgen.makeShadow(), cacheDir='')
+    commands = len(fgen.readSettings(filename))
+
+    def perLine():
+        with contextlib.redirect_stdout(io.StringIO()):
+            fgen.loadSettings(filename)
+
+    results = []
+    for name, func in (('per line', perLine),
+                       ('batch', lambda: fgen.loadSettings(filename,
+                                                           batch=True)),
+                       ('compiled', lambda: fgen.loadSettings(filename,
+                                                              compiled=True))):
+        samples = timeCalls(func, max(5, opts.repeat // 5))
+        results.append(summarize('loadSettings ' + name, samples,
+                                 commands=commands))
+    return results
+
+
+def benchParsing(opts):
+    from usbtmc import pack_block_header, split_response, unpack_block
+
+    results = []
+    for size in (1024, 65536, 1048576):
+        block = pack_block_header(size) + b'\0' * size
+        samples = timeCalls(lambda: unpack_block(block),
+                            repeatFor(opts, size) * 10)
+        results.append(summarize('unpack_block %d' % size, samples, size))
+
+    fields = [b'+1.000000000000000E+03', b'"SIN +1.0E+03,+1.0E-01,+0.0E+00"']
+    response = b';'.join(fields * 10 + [pack_block_header(4096) +
+                                        b';' * 4096]) + b'\n'
+    samples = timeCalls(lambda: split_response(response), opts.repeat * 10)
+    results.append(summarize('split_response 21 fields', samples,
+                             len(response)))
+    return results
+
+
+def benchTrigger(opts):
+    fgen = FunctionGenerator(makeInstrument(opts))
+    shots = max(1000, opts.repeat * 40)
+    results = []
+    for name, func in (('*TRG', lambda: fgen.write('*TRG')),
+                       ('sendTrigger', fgen.sendTrigger)):
+        samples = timeCalls(func, shots, warmup=20)
+        results.append(summarize('trigger %s' % name, samples))
+    return results
+
+
+def replaySession(path, scale):
+    """ send the transfers of a recorded session through the endpoints of
+    a usbtmc.Instrument on a ReplayDevice, in recorded order
+
+    Bulk-OUT payloads the trace stores as a digest are sent as zeros of the
+    recorded size, and counted as mismatches by the device.
+
+    :returns: ReplayDevice
+    """
+    import usb.core
+    import usbtmc
+    from usbtmc import trace
+
+    header, records = trace.read_trace(path)
+    device = trace.ReplayDevice(path, scale)
+    instr = usbtmc.Instrument(device=device)
+    for record in records:
+        try:
+            if record.kind == trace.BULK_OUT:
+                data = record.payload
+                if record.flags & trace.HASHED:
+                    data = data[:12] + b'\0' * (record.size - 12)
+                instr.bulk_out_ep.write(data)
+            elif record.kind == trace.BULK_IN:
+                instr.bulk_in_ep.read(record.size)
+            elif record.kind == trace.INTERRUPT_IN:
+                instr.interrupt_in_ep.read(record.size)
+            elif record.kind == trace.CONTROL_IN:
+                if record.flags & trace.ERROR:
+                    # the setup packet was not stored: any class request
+                    # pops the record and fails with the recorded error
+                    setup = (0xA1, 0, 0, 0, 0)
+                else:
+                    setup = trace.CONTROL.unpack_from(record.payload)
+                device.ctrl_transfer(*setup)
+        except usb.core.USBError:
+            # recorded as failed, and failing again
+            pass
+    return device
+
+
+def benchReplay(opts):
+    from usbtmc import trace
+
+    if opts.replay is None:
+        return []
+    header, records = trace.read_trace(opts.replay)
+    nbytes = sum(r.size for r in records
+                 if r.kind in (trace.BULK_OUT, trace.BULK_IN))
+    transfers = sum(1 for r in records if r.kind != trace.CONTROL_IN)
+    devices = []
+    samples = timeCalls(lambda: devices.append(
+        replaySession(opts.replay, opts.replay_scale)),
+        max(5, opts.repeat // 10), warmup=1)
+    result = summarize('replay ' + os.path.basename(opts.replay), samples,
+                       nbytes, commands=transfers)
+    result['mismatches'] = devices[-1].mismatches
+    return [result]
+
+
+def benchScope(opts):
+    from Oscilloscope import Oscilloscope
+    from SimulatedDSO import SimulatedDSO
+
+    results = []
+    for points in (500, 5000, 50000):
+        osc = Oscilloscope('IP:simulated', dso=SimulatedDSO(points=points))
+        text = osc.dso.inspect('C1')
+        samples = timeCalls(lambda: osc.parseInspect(text),
+                            repeatFor(opts, 16 * points))
+        results.append(summarize('parseInspect %d' % points, samples,
+                                 len(text)))
+        samples = timeCalls(lambda: osc.readWaveform('C1'),
+                            repeatFor(opts, 16 * points))
+        results.append(summarize('readWaveform %d' % points, samples,
+                                 len(text)))
+    return results
+
+
+cases = collections.OrderedDict([
+    ('transport', benchTransport),
+    ('encoding', benchEncoding),
+    ('settings', benchSettings),
+    ('parsing', benchParsing),
+    ('trigger', benchTrigger),
+    ('scope', benchScope),
+    ('replay', benchReplay),
+])
+
+
+def version():
+    """ git commit of the tree being measured """
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always',
+                                       '--dirty'], cwd=here,
+                                      stderr=subprocess.STDOUT)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def loadHistory(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def saveHistory(path, history):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=1)
+
+
+def findRegressions(run, history, threshold):
+    """ compare a run with the latest earlier run on the same device
+    settings and host
+
+    :returns: list of (name, old p50, new p50)
+    """
+    previous = [r for r in history if r['config'] == run['config'] and
+                r['host'] == run['host']]
+    if not previous:
+        return []
+    old = dict((r['name'], r) for r in previous[-1]['results'])
+    regressions = []
+    for result in run['results']:
+        before = old.get(result['name'])
+        if before is not None and result['p50'] > before['p50'] * threshold:
+            regressions.append((result['name'], before['p50'],
+                                result['p50']))
+    return regressions
+
+
+def report(results):
+    print("%-36s %6s %10s %10s %10s %10s %10s" % ('case', 'n', 'p50 us',
+                                                 'p99 us', 'sd us', 'MB/s',
+                                                 'cmd/s'))
+    for r in results:
+        mbps = '%10.2f' % r['MBPerSec'] if 'MBPerSec' in r else ' ' * 10
+        print("%-36s %6d %10.1f %10.1f %10.1f %s %10.0f" % (
+            r['name'], r['n'], r['p50'] * 1e6, r['p99'] * 1e6,
+            r['stdev'] * 1e6, mbps, r['cmdPerSec']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transport, "
+                                     "encoding and parsing hot paths")
+    parser.add_argument('--only', action='append', choices=list(cases),
+                        help="run only these cases (repeatable)")
+    parser.add_argument('--repeat', type=int, default=50,
+                        help="timed calls per small case")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated seconds per USB transfer")
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help="simulated USB bytes per second")
+    parser.add_argument('--transfer-size', type=int, default=16384,
+                        help="bulk-IN transfer size of the read cases")
+    parser.add_argument('--replay', default=None, metavar='TRACE',
+                        help="time a session recorded with "
+                        "Instrument.start_recording()")
+    parser.add_argument('--replay-scale', type=float, default=1.0,
+                        help="factor applied to the recorded device times")
+    parser.add_argument('--history', default=defaultHistory,
+                        help="JSON history file")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="flag cases whose p50 grew by this factor")
+    parser.add_argument('--no-save', action='store_true',
+                        help="do not append this run to the history")
+    opts = parser.parse_args()
+
+    results = []
+    for name in opts.only or list(cases):
+        results.extend(cases[name](opts))
+    report(results)
+
+    run = {'version': version(), 'time': time.time(),
+           'host': platform.node(), 'python': platform.python_version(),
+           'config': {'latency': opts.latency, 'bandwidth': opts.bandwidth,
+                      'repeat': opts.repeat, 'transferSize': opts.transfer_size,
+                      'replay': opts.replay,
+                      'replayScale': opts.replay_scale},
+           'results': results}
+    history = loadHistory(opts.history)
+    regressions = findRegressions(run, history, opts.threshold)
+    for name, before, after in regressions:
+        print("REGRESSION %s: p50 %.1f us -> %.1f us (x%.2f)" % (
+            name, before * 1e6, after * 1e6, after / before))
+    if not opts.no_save:
+        history.append(run)
+        saveHistory(opts.history, history)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import usbtmc
+from usbtmc.simulator import SimulatedDevice
+from FunctionGenerator import FunctionGenerator
+
+
+@pytest.fixture
+def device():
+    return SimulatedDevice()
+
+
+@pytest.fixture
+def instr(device):
+    return usbtmc.Instrument(device=device)
+
+
+@pytest.fixture
+def fgen(instr):
+    return FunctionGenerator(instr, shadow=True)
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """ write a settings file from a list of lines, return its path """
+    def write(lines):
+        path = tmp_path / 'settings.txt'
+        path.write_text('\n'.join(lines) + '\n')
+        return str(path)
+    return write
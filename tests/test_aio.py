@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import usbtmc
+from usbtmc.aio import AsyncInstrument
+from usbtmc.simulator import SimulatedDevice
+from AsyncFunctionGenerator import AsyncFunctionGenerator
+from FunctionGenerator import FunctionGenerator, WaveformError
+
+
+def recordThreads(device):
+    """ list the threads the model executes messages on """
+    threads = []
+    write = device.model.write
+
+    def record(message):
+        threads.append(threading.current_thread())
+        return write(message)
+    device.model.write = record
+    return threads
+
+
+def test_write_and_ask(instr, device):
+    threads = recordThreads(device)
+
+    async def main():
+        ainstr = AsyncInstrument(instr)
+        try:
+            await ainstr.write('SOUR1:FREQ 2500')
+            assert float(await ainstr.ask('SOUR1:FREQ?')) == 2500
+            await ainstr.write_raw(b'*IDN?\n')
+            assert (await ainstr.read_raw()).startswith(b'Agilent')
+            assert await ainstr.ask_batch(['SOUR1:FREQ?', '*OPC?'],
+                                          [float, int]) == [2500, 1]
+        finally:
+            ainstr.close()
+    asyncio.run(main())
+    # all on the session's I/O thread, never on the event loop's
+    assert len(set(threads)) == 1
+    assert threads[0] is not threading.current_thread()
+
+
+def test_calls_keep_await_order(instr):
+    async def main():
+        ainstr = AsyncInstrument(instr)
+        try:
+            pending = [ainstr.write('SOUR1:VOLT:OFFS 0.%d' % i)
+                       for i in range(1, 6)]
+            pending.append(ainstr.ask('SOUR1:VOLT:OFFS?'))
+            return await asyncio.gather(*pending)
+        finally:
+            ainstr.close()
+    assert float(asyncio.run(main())[-1]) == 0.5
+
+
+def test_each_instrument_has_an_io_thread():
+    devices = [SimulatedDevice(serial=s) for s in ('A', 'B')]
+    threads = [recordThreads(d) for d in devices]
+
+    async def main():
+        ainstrs = [AsyncInstrument(usbtmc.Instrument(device=d))
+                   for d in devices]
+        try:
+            return await asyncio.gather(*[a.ask('*IDN?') for a in ainstrs])
+        finally:
+            for a in ainstrs:
+                a.close()
+    assert all(idn.startswith('Agilent') for idn in asyncio.run(main()))
+    assert set(threads[0]).isdisjoint(threads[1])
+
+
+def test_function_generator(fgen, device):
+    async def main():
+        afgen = AsyncFunctionGenerator(fgen)
+        try:
+            # wrapped on access
+            await afgen.setOutput(2, 'ON')
+            await afgen.pushSin(1000, 0.5)
+            assert (await afgen.getIdn()).startswith('Agilent')
+            assert float(await afgen.ask('SOUR1:VOLT?')) == 0.5
+            await afgen.pushArbitraryWaveform(np.arange(-50, 50),
+                                              binary=True)
+            with pytest.raises(WaveformError):
+                await afgen.pushArbitraryWaveform([0] * 3)
+            # the wrapper shares the generator's session
+            assert afgen.instr.session is fgen.getSession()
+        finally:
+            afgen.close()
+    asyncio.run(main())
+    assert device.model.settings['OUTP2'] == '1'
+    assert len(device.model.waveforms['VOLATILE']) == 100
+
+
+def test_open(device):
+    async def main():
+        afgen = await AsyncFunctionGenerator.open(
+            usbtmc.Instrument(device=device))
+        try:
+            assert isinstance(afgen.fgen, FunctionGenerator)
+            return await afgen.ask('*IDN?')
+        finally:
+            afgen.close()
+    assert asyncio.run(main()).startswith('Agilent')
@@ -0,0 +1,41 @@
+import pytest
+
+from usbtmc import split_response, pack_block_header
+from usbtmc.usbtmc import UsbtmcException
+
+
+def test_split_plain_fields():
+    assert split_response(b'+1.0E+03; 0.5 ;1\n') == [b'+1.0E+03', b'0.5', b'1']
+
+
+def test_split_keeps_quoted_strings():
+    data = b'"a;b";\'c;d\';"say ""x;y""";1'
+    assert split_response(data) == [b'"a;b"', b"'c;d'", b'"say ""x;y"""', b'1']
+
+
+def test_split_keeps_blocks():
+    block = pack_block_header(5) + b';\n; \n'
+    assert split_response(b'1;' + block + b';2') == [b'1', block, b'2']
+    # an indefinite length block runs to the end of the response
+    assert split_response(b'1;#0a;b\n') == [b'1', b'#0a;b\n']
+
+
+def test_ask_batch(fgen, device):
+    device.model.commands['DATA:TEST?'] = \
+        lambda header, params: pack_block_header(3) + b'a;b'
+    fgen.instr.write('SOUR1:FREQ 2000')
+    transfers = device.transfers
+    freq, name, block, idn = fgen.instr.ask_batch(
+        ['SOUR1:FREQ?', 'SOUR1:FUNC:ARB?', 'DATA:TEST?', '*IDN?'],
+        [float, None, None, None])
+    # one message, one read request and one response
+    assert device.transfers == transfers + 3
+    assert freq == 2000
+    assert name == '"INT:\\BUILTIN\\EXP_RISE.ARB"'
+    assert block == b'a;b'
+    assert idn.startswith('Agilent')
+
+
+def test_ask_batch_counts_responses(fgen):
+    with pytest.raises(UsbtmcException):
+        fgen.instr.ask_batch(['*IDN?', 'SOUR1:FREQ'])
@@ -0,0 +1,66 @@
+import usbtmc
+from usbtmc import join_commands
+
+
+def recordMessages(device):
+    """ list the program messages the model receives """
+    messages = []
+    write = device.model.write
+
+    def record(message):
+        messages.append(message)
+        return write(message)
+    device.model.write = record
+    return messages
+
+
+def test_join_commands_resets_to_root():
+    assert join_commands([b'FREQ 1000', b'*WAI', b':VOLT 1', b'OUTP1 ON'],
+                         100) == [b'FREQ 1000;*WAI;:VOLT 1;:OUTP1 ON']
+
+
+def test_join_commands_respects_max_size():
+    commands = [b'FREQ 1000', b'VOLT 1', b'OUTP1 ON', b'X' * 30]
+    messages = join_commands(commands, 20)
+    assert messages == [b'FREQ 1000;:VOLT 1', b'OUTP1 ON', b'X' * 30]
+    # a command longer than max_size goes out alone, never split
+    assert join_commands([b'X' * 30], 20) == [b'X' * 30]
+    assert join_commands([], 20) == []
+
+
+def test_join_commands_without_root_reset():
+    assert join_commands([b'SOUR1:FREQ 1000', b'VOLT 1'], 100,
+                         root_reset=False) == [b'SOUR1:FREQ 1000;VOLT 1']
+
+
+def test_coalesced_list_write(device):
+    instr = usbtmc.Instrument(device=device, coalesce=True)
+    messages = recordMessages(device)
+    instr.write(['SOUR1:FREQ 2000', 'SOUR1:VOLT 0.5', 'OUTP1 ON'])
+    assert messages == [b'SOUR1:FREQ 2000;:SOUR1:VOLT 0.5;:OUTP1 ON']
+    assert device.model.settings['OUTP1'] == '1'
+
+
+def test_nested_batch_sends_once(instr, device):
+    messages = recordMessages(device)
+    with instr.batch():
+        instr.write('SOUR1:FREQ 2000')
+        with instr.batch():
+            instr.write('SOUR1:VOLT 0.5')
+        assert messages == []
+        instr.write('OUTP1 ON')
+    assert messages == [b'SOUR1:FREQ 2000;:SOUR1:VOLT 0.5;:OUTP1 ON']
+    assert instr.write_queue == []
+
+
+def test_read_flushes_batch(instr, device):
+    messages = recordMessages(device)
+    with instr.batch():
+        instr.write('SOUR1:FREQ 2000')
+        assert float(instr.ask('SOUR1:FREQ?')) == 2000
+        # the query goes out in the same message as the queued write
+        assert messages == [b'SOUR1:FREQ 2000;:SOUR1:FREQ?']
+        instr.write('SOUR1:VOLT 0.5')
+        instr.trigger()
+    assert len(messages) == 2
+    assert device.model.settings['SOUR1:VOLT'] == 0.5
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import usbtmc
+from usbtmc.aio import AsyncInstrument
+from usbtmc.simulator import SimulatedDevice
+from usbtmc.usbtmc import UsbtmcException
+from FunctionGenerator import FunctionGenerator
+
+
+def test_threads_share_waveform_cache():
+    # transfer latency lets the threads interleave
+    device = SimulatedDevice(latency=0.0005)
+    fgen = FunctionGenerator(usbtmc.Instrument(device=device))
+    fgen.arbCacheLimit = 6
+    waveforms = [(np.arange(500) + i).astype(np.int16) for i in range(10)]
+    errors = []
+
+    def push(offset):
+        try:
+            for i in range(30):
+                fgen.pushCachedWaveform(waveforms[(i + offset) % 10])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=push, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    for digest in fgen.arbCache:
+        assert fgen.cachedWaveformName(digest) in device.model.waveforms
+    used = sum(len(p) for p in fgen.arbCache.values()) // 2
+    assert fgen.arbFree + used == device.model.volatile_size
+
+
+def test_await_inside_batch_raises(instr):
+    async def main():
+        ainstr = AsyncInstrument(instr)
+        try:
+            assert (await ainstr.ask('*IDN?')).startswith('Agilent')
+            with instr.batch():
+                with pytest.raises(UsbtmcException):
+                    await ainstr.ask('*IDN?')
+        finally:
+            ainstr.close()
+    asyncio.run(main())
+
+
+def test_submit_after_async_close(fgen):
+    from AsyncFunctionGenerator import AsyncFunctionGenerator
+
+    session = fgen.getSession()
+    AsyncFunctionGenerator(fgen).close()
+    session.thread.join(2)
+    with pytest.raises(UsbtmcException):
+        session.submit(fgen.instr.ask, '*IDN?')
+    # the generator starts a new session instead of queueing on the dead one
+    assert fgen.submit(fgen.instr.ask, '*IDN?').result(2).startswith('Agilent')
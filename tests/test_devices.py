@@ -0,0 +1,110 @@
+import errno
+
+import pytest
+
+from usbtmc import usbtmc
+from usbtmc.simulator import SimulatedDevice, usb_error
+
+
+class Bus(list):
+    """ attached devices, with a count of enumerations and a settable clock """
+    scans = 0
+    now = 1000.0
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    bus = Bus([SimulatedDevice(serial='A', address=1),
+               SimulatedDevice(serial='B', address=2)])
+
+    def list_devices():
+        bus.scans += 1
+        return list(bus)
+    monkeypatch.setattr(usbtmc, 'list_devices', list_devices)
+    monkeypatch.setattr(usbtmc.usb.util, 'get_string',
+                        lambda dev, index: dev.serial)
+    monkeypatch.setattr(usbtmc, 'monotonic', lambda: bus.now)
+    monkeypatch.setattr(usbtmc, 'device_cache', {})
+    monkeypatch.setattr(usbtmc, 'serial_cache', {})
+    return bus
+
+
+def unplug(device):
+    def ctrl_transfer(*args, **kwargs):
+        raise usb_error("No such device", errno.ENODEV)
+    device.ctrl_transfer = ctrl_transfer
+
+
+def test_find_device_cached(bus):
+    dev = usbtmc.find_device(0x0957, 0x2307, 'B')
+    assert dev is bus[1]
+    assert usbtmc.find_device(0x0957, 0x2307, 'B') is dev
+    assert bus.scans == 1
+    assert usbtmc.find_device(0x0957, 0x2307, 'B', use_cache=False) is dev
+    assert bus.scans == 2
+    assert usbtmc.find_device(0x0957, 0x1234) is None
+    assert usbtmc.find_device(0x0957, 0x1234) is None
+    # misses are not cached
+    assert bus.scans == 4
+
+
+def test_find_device_expires(bus):
+    usbtmc.find_device(0x0957, 0x2307, 'A')
+    bus.now += usbtmc.DEVICE_CACHE_TTL / 2
+    usbtmc.find_device(0x0957, 0x2307, 'A')
+    assert bus.scans == 1
+    bus.now += usbtmc.DEVICE_CACHE_TTL
+    usbtmc.find_device(0x0957, 0x2307, 'A')
+    assert bus.scans == 2
+
+
+def test_find_device_checks_presence(bus):
+    dev = usbtmc.find_device(0x0957, 0x2307, 'A')
+    unplug(dev)
+    bus.remove(dev)
+    assert usbtmc.find_device(0x0957, 0x2307, 'A') is None
+    assert bus.scans == 2
+    assert usbtmc.device_cache == {}
+
+
+def test_serial_cache(bus, monkeypatch):
+    reads = []
+    monkeypatch.setattr(usbtmc.usb.util, 'get_string',
+                        lambda dev, index: reads.append(dev) or dev.serial)
+    for i in range(2):
+        assert usbtmc.find_device(0x0957, 0x2307, 'B', use_cache=False)
+    # each serial number was read once
+    assert reads == bus
+    bus.now += usbtmc.DEVICE_CACHE_TTL
+    usbtmc.find_device(0x0957, 0x2307, 'A', use_cache=False)
+    assert reads == bus + [bus[0]]
+
+
+def test_hotplug_invalidation(bus):
+    usbtmc.find_device(0x0957, 0x2307, 'B')
+    # a different instrument plugged in at the same bus address
+    bus[1] = SimulatedDevice(serial='C', address=2)
+    assert usbtmc.find_device(0x0957, 0x2307, 'B') is not bus[1]
+    usbtmc.invalidate_device_cache()
+    assert usbtmc.device_cache == {} and usbtmc.serial_cache == {}
+    assert usbtmc.find_device(0x0957, 0x2307, 'B') is None
+    assert usbtmc.find_device(0x0957, 0x2307, 'C') is bus[1]
+
+
+def test_open_instruments_enumerates_once(bus):
+    instruments = usbtmc.open_instruments(['USB::0x0957::0x2307::B::INSTR',
+                                           'USB::0x0957::0x2307::A::INSTR'])
+    assert bus.scans == 1
+    assert [i.device for i in instruments] == [bus[1], bus[0]]
+    assert all(i.ask('*IDN?') for i in instruments)
+    # and primed the cache for find_device
+    assert usbtmc.find_device(0x0957, 0x2307, 'A') is bus[0]
+    assert bus.scans == 1
+
+
+def test_open_instruments_missing(bus):
+    with pytest.raises(usbtmc.UsbtmcException):
+        usbtmc.open_instruments(['USB::0x0957::0x2307::A::INSTR',
+                                 'USB::0x0957::0x2307::Z::INSTR'])
+    with pytest.raises(usbtmc.UsbtmcException):
+        usbtmc.open_instruments(['USB::INSTR'])
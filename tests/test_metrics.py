@@ -0,0 +1,43 @@
+from usbtmc.metrics import Metrics, command_root
+
+
+def test_commands_and_transfers_recorded(instr):
+    metrics = Metrics()
+    instr.set_metrics(metrics)
+    instr.write('FREQ 1000')
+    instr.ask('FREQ?')
+    snap = metrics.snapshot()
+    assert snap['transfers']['bulk_out'].count >= 3
+    assert ('write', 'FREQ') in snap['commands']
+    instr.set_metrics(None)
+    assert 'write' not in instr.__dict__
+
+
+def test_command_root():
+    assert command_root('SOURce1:FREQuency 1e3') == 'SOUR'
+    assert command_root(':output:state on') == 'OUTP'
+    assert command_root(b'APPLY:SIN 1000') == 'APPL'
+    assert command_root(['*IDN?', 'FREQ?']) == '*IDN'
+    assert command_root('') == ''
+
+
+def test_gauges_removed_on_detach(fgen):
+    first, second = Metrics(), Metrics()
+    fgen.setMetrics(first)
+    assert set(first.gauges) == {'session', 'write_queue'}
+    fgen.setMetrics(second)
+    assert first.gauges == {}
+    fgen.setMetrics(None)
+    assert second.gauges == {}
+
+
+def test_detach_keeps_other_wrappers(instr):
+    def wrapper(*args, **kwargs):
+        return wrapper.wrapped(*args, **kwargs)
+    wrapper.wrapped = instr.write
+    instr.write = wrapper
+    metrics = Metrics()
+    instr.set_metrics(metrics)
+    instr.set_metrics(None)
+    assert instr.write is wrapper
+    assert wrapper.wrapped.__self__ is instr
@@ -0,0 +1,52 @@
+import pytest
+
+import usbtmc
+from usbtmc.simulator import SimulatedDevice
+from usbtmc.usbtmc import UsbtmcException, monotonic
+
+
+@pytest.mark.parametrize('interrupt', [True, False])
+def test_wait_opc(interrupt):
+    instr = usbtmc.Instrument(device=SimulatedDevice(interrupt=interrupt))
+    instr.wait_opc(timeout=2)
+    # the event status register is read, and so cleared, on return
+    assert int(instr.ask('*ESR?')) == 0
+
+
+@pytest.mark.parametrize('interrupt', [True, False])
+def test_wait_opc_times_out(interrupt):
+    device = SimulatedDevice(interrupt=interrupt)
+    device.model.commands['*OPC'] = lambda header, params: None
+    instr = usbtmc.Instrument(device=device)
+    with pytest.raises(UsbtmcException):
+        instr.wait_opc(timeout=0.05)
+
+
+def test_wait_complete(fgen):
+    fgen.write('SOUR1:FREQ 1000')
+    fgen.waitComplete(2)
+    assert float(fgen.instr.ask('SOUR1:FREQ?')) == 1000
+
+
+@pytest.mark.parametrize('interrupt', [True, False])
+def test_wait_opc_after_timeout(interrupt):
+    device = SimulatedDevice(interrupt=interrupt)
+    commands = device.model.commands
+    opc = commands['*OPC']
+    commands['*OPC'] = lambda header, params: None
+    instr = usbtmc.Instrument(device=device)
+    with pytest.raises(UsbtmcException):
+        instr.wait_opc(timeout=0.05)
+
+    # the operation completes late, leaving the OPC bit and an SRQ behind
+    device.model.set_esr(0x01)
+    with device.lock:
+        device.check_srq()
+    with pytest.raises(UsbtmcException):
+        instr.wait_opc(timeout=0.05)
+
+    commands['*OPC'] = opc
+    for _ in range(2):
+        start = monotonic()
+        instr.wait_opc(timeout=2)
+        assert monotonic() - start < 1
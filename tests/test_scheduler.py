@@ -0,0 +1,100 @@
+import pytest
+
+import usbtmc
+from usbtmc.simulator import SimulatedDevice
+from FunctionGenerator import FunctionGenerator
+from Oscilloscope import Oscilloscope
+from SimulatedDSO import SimulatedDSO
+from TriggerScheduler import TriggerScheduler, percentile
+
+
+def countTriggers(device):
+    """ count the triggers the model receives """
+    fired = []
+    trigger = device.model.trigger
+    device.model.trigger = lambda: (fired.append(1), trigger())
+    return fired
+
+
+def test_percentile():
+    values = list(range(101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 90) == 7
+
+
+def test_sends_every_shot(fgen, device):
+    fired = countTriggers(device)
+    scheduler = TriggerScheduler(fgen, rate=500, count=20, delay=0)
+    scheduler.start()
+    scheduler.join()
+    stats = scheduler.stats()
+    assert len(fired) == 20
+    assert stats['shots'] == 20
+    for name in ('late', 'call', 'jitter'):
+        assert 0 <= stats[name + 'P50'] <= stats[name + 'P90'] <= \
+            stats[name + 'P99'] <= stats[name + 'Max']
+    assert stats['rate'] == pytest.approx(500, rel=0.5)
+
+
+def test_counts_overruns():
+    # every trigger transfer takes longer than the period
+    device = SimulatedDevice(latency=0.004)
+    fgen = FunctionGenerator(usbtmc.Instrument(device=device))
+    fired = countTriggers(device)
+    scheduler = TriggerScheduler(fgen, rate=1000, count=10, delay=0)
+    scheduler.start()
+    scheduler.join()
+    assert len(fired) == 10
+    assert scheduler.stats()['overruns'] >= 8
+
+
+def test_rearms_scope(fgen):
+    dso = SimulatedDSO()
+    scope = Oscilloscope('IP:simulated', dso=dso)
+    scheduler = TriggerScheduler(fgen, rate=500, count=5, scope=scope,
+                                 delay=0)
+    scheduler.start()
+    scheduler.join()
+    # armed before the first shot and after every one but the last
+    assert dso.writes == 5
+    assert 'ARM' in dso.settings
+
+
+def failAfter(fgen, n):
+    """ make sendTrigger raise once n triggers went through """
+    calls = []
+
+    def sendTrigger():
+        if len(calls) == n:
+            raise usbtmc.usbtmc.UsbtmcException("Trigger failed", 'trigger')
+        calls.append(1)
+        fgen.instr.trigger()
+    fgen.sendTrigger = sendTrigger
+
+
+def test_join_raises_thread_error(fgen):
+    failAfter(fgen, 3)
+    scheduler = TriggerScheduler(fgen, rate=500, count=10, delay=0)
+    scheduler.start()
+    with pytest.raises(usbtmc.usbtmc.UsbtmcException):
+        scheduler.join()
+    assert scheduler.stats()['shots'] == 3
+    # raised once
+    scheduler.join()
+
+
+def test_stop_raises_thread_error(fgen):
+    failAfter(fgen, 0)
+    scheduler = TriggerScheduler(fgen, rate=100, count=10, delay=0)
+    scheduler.start()
+    scheduler.thread.join(2)
+    with pytest.raises(usbtmc.usbtmc.UsbtmcException):
+        scheduler.stop()
+
+
+def test_stop_ends_early(fgen):
+    scheduler = TriggerScheduler(fgen, rate=100, count=1000, delay=0)
+    scheduler.start()
+    scheduler.stop()
+    assert scheduler.stats()['shots'] < 1000
@@ -0,0 +1,39 @@
+import pytest
+
+from Oscilloscope import Oscilloscope
+from SimulatedDSO import SimulatedDSO
+
+
+def test_parse_inspect_skips_non_numbers():
+    osc = Oscilloscope('IP:simulated', dso=SimulatedDSO())
+    text = 'C1:INSP "DATA:\r\n  0.1  -0.2\r\n 3e-3 \r\n"'
+    assert osc.parseInspect(text) == [0.1, -0.2, 3e-3]
+
+
+def test_read_waveform():
+    osc = Oscilloscope('IP:simulated', dso=SimulatedDSO(points=500))
+    assert len(osc.readWaveform('C1')) == 500
+
+
+@pytest.mark.parametrize('order', ['metrics first', 'recording first'])
+def test_detach_layers_in_any_order(tmp_path, order):
+    from usbtmc.metrics import Metrics
+    from usbtmc.trace import read_trace
+
+    dso = SimulatedDSO()
+    osc = Oscilloscope('IP:simulated', dso=dso)
+    path = str(tmp_path / 'scope.trace')
+    if order == 'metrics first':
+        osc.setMetrics(Metrics())
+        osc.startRecording(path)
+    else:
+        osc.startRecording(path)
+        osc.setMetrics(Metrics())
+    osc.write('TDIV 1E-3')
+
+    osc.stopRecording()
+    osc.setMetrics(None)
+    assert osc.dso is dso
+    osc.write('TDIV 2E-3')
+    header, records = read_trace(path)
+    assert len(records) == 1
@@ -0,0 +1,168 @@
+import os
+import stat
+import threading
+
+import pytest
+
+import usbtmc
+from usbtmc.metrics import Metrics
+from usbtmc.usbtmc import UsbtmcException
+from InstrumentServer import (DeviceWorker, InstrumentServer, RemoteError,
+                              RemoteFunctionGenerator, OP_ASK, OP_WRITE)
+
+
+@pytest.fixture
+def server(tmp_path, instr):
+    path = str(tmp_path / 'server' / 'instruments.sock')
+    server = InstrumentServer({'fgen': instr}, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def remote(server):
+    fgen = RemoteFunctionGenerator(path=server.path)
+    yield fgen
+    fgen.instr.close()
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(server.path)).st_mode) == 0o700
+
+
+def test_remote_commands(remote, device):
+    remote.instr.write('SOUR1:FREQ 1234')
+    assert float(remote.instr.ask('SOUR1:FREQ?')) == 1234
+    assert remote.instr.support_trigger
+
+
+def test_remote_metrics(remote):
+    metrics = Metrics()
+    remote.setMetrics(metrics)
+    remote.instr.ask('*IDN?')
+    assert ('ask', '*IDN') in metrics.commands
+    assert 'write_queue' in metrics.gauges
+    remote.setMetrics(None)
+    assert 'write_queue' not in metrics.gauges
+    assert 'ask' not in remote.instr.__dict__
+
+
+def test_remote_recording_rejected(remote, tmp_path):
+    with pytest.raises(RemoteError):
+        remote.instr.start_recording(str(tmp_path / 'trace.bin'))
+
+
+class FailingInstrument(usbtmc.Instrument):
+
+    """ raises on writes containing BAD, as a broken transfer would """
+
+    def write_raw(self, data):
+        if b'BAD' in data:
+            raise UsbtmcException("Write failed", 'write_raw')
+        return usbtmc.Instrument.write_raw(self, data)
+
+
+def test_group_error_is_not_replayed(device):
+    worker = DeviceWorker(FailingInstrument(device=device))
+    results = {}
+
+    def done(key):
+        return lambda result: results.__setitem__(key, result)
+
+    transfers = device.transfers
+    worker.executeGroup([(OP_WRITE, b'SOUR1:FREQ 2000', done('good')),
+                         (OP_WRITE, b'BAD', done('bad')),
+                         (OP_WRITE, b'\xff', done('undecodable')),
+                         (OP_ASK, b'SOUR1:FREQ?', done('query'))])
+    worker.stop()
+    assert device.transfers == transfers
+    assert isinstance(results['undecodable'], UnicodeDecodeError)
+    for key in ('good', 'bad', 'query'):
+        assert isinstance(results[key], UsbtmcException)
+
+
+def test_groups_do_not_mix_clients(device):
+    worker = DeviceWorker(FailingInstrument(device=device))
+    results = {}
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(result):
+        started.set()
+        release.wait(2)
+
+    def done(key):
+        return lambda result: results.__setitem__(key, result)
+
+    # hold the worker so the requests behind are queued together
+    worker.submit(OP_ASK, b'*IDN?', block, 'a')
+    assert started.wait(2)
+    worker.submit(OP_WRITE, b'SOUR1:FREQ 2000', done('a'), 'a')
+    worker.submit(OP_WRITE, b'BAD', done('b'), 'b')
+    worker.submit(OP_ASK, b'SOUR1:FREQ?', done('query'), 'b')
+    release.set()
+    worker.stop()
+    assert results['a'] == b''
+    assert isinstance(results['b'], UsbtmcException)
+    assert isinstance(results['query'], UsbtmcException)
+    assert float(device.model.settings['SOUR1:FREQ']) == 2000
+
+
+def test_second_server_is_refused(server, instr):
+    with pytest.raises(RemoteError):
+        InstrumentServer({'fgen': instr}, server.path)
+    assert os.path.exists(server.path)
+
+
+def test_stale_socket_is_replaced(tmp_path, instr):
+    import socket
+
+    path = str(tmp_path / 'server' / 'instruments.sock')
+    os.makedirs(os.path.dirname(path), 0o700)
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = InstrumentServer({'fgen': instr}, path)
+    server.server_close()
+
+
+def test_unknown_response_is_skipped(remote):
+    from InstrumentServer import frameHeader
+
+    instr = remote.instr
+    with instr.sendLock:
+        # a request whose response nobody waits for
+        instr.sock.sendall(frameHeader.pack(OP_ASK, instr.device, 0x7777, 5) +
+                           b'*IDN?')
+    instr.timeout = 2
+    assert instr.ask('*IDN?').startswith('Agilent')
+    assert instr.reader.is_alive()
+
+
+def test_remote_ask_batch(remote):
+    remote.instr.write('SOUR1:FREQ 1234')
+    freq, idn = remote.instr.ask_batch(['SOUR1:FREQ?', '*IDN?'], [float, None])
+    assert freq == 1234
+    assert idn.startswith('Agilent')
+
+
+def test_scope_wait_opc_bounds_read():
+    from InstrumentServer import ScopeAdapter
+    from Oscilloscope import Oscilloscope
+    from SimulatedDSO import SimulatedDSO
+
+    dso = SimulatedDSO()
+    timeouts = []
+    setTimeout = dso.SetTimeout
+
+    def record(seconds):
+        timeouts.append(seconds)
+        return setTimeout(seconds)
+    dso.SetTimeout = record
+    ScopeAdapter(Oscilloscope('IP:simulated', dso=dso)).wait_opc(2.5)
+    assert timeouts == [2.5, 10.0]
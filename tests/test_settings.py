@@ -0,0 +1,115 @@
+import pytest
+
+from SettingsError import SettingsError
+
+
+def frequency(fgen):
+    return float(fgen.instr.ask('SOUR1:FREQ?'))
+
+
+def test_batch_failure_locates_line(fgen, settings):
+    path = settings(['FREQ 1000', 'OUTPUT1 MAYBE', 'VOLT 0.5', 'FREQ 2000'])
+    with pytest.raises(SettingsError) as info:
+        fgen.loadSettings(path, batch=True)
+    assert info.value.lineno == 2
+    assert info.value.command == 'OUTPUT1 MAYBE'
+
+
+def test_batch_failure_leaves_shadow_consistent(fgen, settings):
+    path = settings(['FREQ 1000', 'OUTPUT1 MAYBE', 'VOLT 0.5', 'FREQ 2000'])
+    with pytest.raises(SettingsError):
+        fgen.loadSettings(path, batch=True)
+    # the instrument has every line but the failing one applied
+    assert frequency(fgen) == 2000
+    assert float(fgen.instr.ask('SOUR1:VOLT?')) == 0.5
+    assert not fgen.setState('SOURCE1:FREQUENCY 2000')
+    assert fgen.setState('SOURCE1:FREQUENCY 1000')
+    assert frequency(fgen) == 1000
+
+
+def test_compiled_failure_leaves_shadow_consistent(fgen, settings, tmp_path):
+    from SettingsCompiler import SettingsCompiler
+
+    fgen.compiler = SettingsCompiler(fgen.makeShadow(), cacheDir='')
+    path = settings(['FREQ 1000', 'OUTPUT1 MAYBE', 'VOLT 0.5'])
+    with pytest.raises(SettingsError) as info:
+        fgen.loadSettings(path, compiled=True)
+    assert info.value.lineno == 2
+    assert frequency(fgen) == 1000
+    assert not fgen.setState('FREQ 1000')
+
+
+def test_per_line_failure_invalidates_shadow(fgen, settings):
+    path = settings(['FREQ 1000', 'FREQ BOGUS'])
+    fgen.loadSettings(path)
+    # the rejected write made the node unknown, so it is sent again
+    assert fgen.setState('FREQ 1000')
+    assert frequency(fgen) == 1000
+
+
+def test_settings_shadow_skips_unchanged(fgen, device, settings):
+    path = settings(['FREQ 1000', 'VOLT 0.5'])
+    fgen.loadSettings(path, batch=True)
+    transfers = device.transfers
+    assert not fgen.setState('SOUR1:FREQ 1000')
+    assert device.transfers == transfers
+
+
+def compiledLines(fgen, settings, lines):
+    from SettingsCompiler import SettingsCompiler
+
+    compiler = SettingsCompiler(fgen.makeShadow(), cacheDir='')
+    return [command for lineno, command in
+            compiler.compile(settings(lines)).lines]
+
+
+def test_compiler_drops_overwritten_nodes(fgen, settings):
+    assert compiledLines(fgen, settings,
+                         ['FREQ 1000', 'VOLT 1', 'FREQ 2000']) == \
+        ['VOLT 1', 'FREQ 2000']
+
+
+def test_compiler_keeps_order_of_coupled_nodes(fgen, settings):
+    lines = ['FUNC SQU', 'APPL:SIN 1000, 1, 0', 'FUNC SQU']
+    assert compiledLines(fgen, settings, lines) == lines
+    lines = ['FREQ 1000', 'FUNC:PULS:PER 0.01', 'FREQ 1000']
+    assert compiledLines(fgen, settings, lines) == lines
+
+
+def test_compiler_packs_like_join_commands(fgen):
+    from SettingsCompiler import SettingsCompiler
+    from usbtmc import join_commands
+
+    commands = ['FREQ 1000', '*WAI', ':VOLT 1', u'DISP:TEXT "µs"',
+                'OUTP1 ON']
+    for rootReset in (True, False):
+        compiler = SettingsCompiler(fgen.makeShadow(), rootReset=rootReset,
+                                    maxLength=30, cacheDir='')
+        expected = join_commands([c.encode('utf-8') for c in commands], 30,
+                                 rootReset)
+        assert [m.encode('utf-8') for m in compiler.pack(commands)] == \
+            expected
+        assert all(len(m) <= 30 for m in expected)
+
+
+def test_compiler_version_invalidates_disk_cache(fgen, settings, tmp_path,
+                                                 monkeypatch):
+    from SettingsCompiler import SettingsCompiler
+
+    filename = settings(['FREQ 1000', 'FREQ 2000'])
+    cacheDir = str(tmp_path / 'cache')
+    program = SettingsCompiler(fgen.makeShadow(),
+                               cacheDir=cacheDir).compile(filename)
+    builds = []
+    build = SettingsCompiler.build
+    monkeypatch.setattr(SettingsCompiler, 'build', lambda self, filename:
+                        builds.append(filename) or build(self, filename))
+
+    cached = SettingsCompiler(fgen.makeShadow(), cacheDir=cacheDir)
+    assert cached.compile(filename).messages == program.messages
+    assert builds == []
+    monkeypatch.setattr(SettingsCompiler, 'compilerVersion',
+                        SettingsCompiler.compilerVersion + 1)
+    rebuilt = SettingsCompiler(fgen.makeShadow(), cacheDir=cacheDir)
+    assert rebuilt.compile(filename).messages == program.messages
+    assert builds == [filename]
@@ -0,0 +1,100 @@
+import pytest
+
+from StateShadow import StateShadow
+from usbtmc.usbtmc import UsbtmcException
+
+
+def shadow():
+    return StateShadow({'FREQ': 'SOUR1:FREQ', 'VOLT': 'SOUR1:VOLT',
+                        'FUNC': 'SOUR1:FUNC', 'OUTP': 'OUTP1'},
+                       [('SOUR1:APPL', 'SOUR1'), ('SOUR1:FUNC', 'SOUR1:FREQ')])
+
+
+def test_parse_canonical_nodes_and_values():
+    s = shadow()
+    assert s.parse('SOURCE1:FREQUENCY 1000 HZ') == ('SOUR1:FREQ', '1000.0')
+    # multiplier prefixes are kept, never mistaken for the bare number
+    assert s.parse(':FREQ 1 KHZ') == ('SOUR1:FREQ', '1 KHZ')
+    assert s.parse('OUTPUT ON') == ('OUTP1', '1.0')
+    assert s.parse('FUNC SQUARE') == ('SOUR1:FUNC', 'SQU')
+    assert s.parse('DISP:TEXT "Hello"') == ('DISP:TEXT', '"Hello"')
+    assert s.parse('FREQ?') == (None, None)
+    assert s.parse('*TRG') == (None, None)
+
+
+def test_update_suppresses_unchanged():
+    s = shadow()
+    assert s.update('FREQ 1000')
+    assert not s.update('SOUR1:FREQUENCY 1E3')
+    assert s.suppressed == 1
+    assert s.update('FREQ 2000')
+
+
+def test_relative_paths_continue_header():
+    s = shadow()
+    s.observe('SOUR2:FREQ 2000;VOLT 2')
+    assert s.values == {'SOUR2:FREQ': '2000.0', 'SOUR2:VOLT': '2.0'}
+    # channel 1 was not written, so its voltage is still sent
+    assert s.update('VOLT 2')
+    s.observe('SOUR2:VOLT:OFFS 1;:VOLT 3;FREQ 5')
+    assert s.values['SOUR2:VOLT:OFFS'] == '1.0'
+    assert s.values['SOUR1:VOLT'] == '3.0'
+    assert s.values['SOUR1:FREQ'] == '5.0'
+
+
+def test_absolute_commands_without_relative_paths():
+    s = StateShadow(shortForms=False, relativePaths=False)
+    s.observe('C1:VDIV 1;TDIV 2')
+    assert s.values == {'C1:VDIV': '1.0', 'TDIV': '2.0'}
+
+
+def test_couplings_forget():
+    s = shadow()
+    s.observe('SOUR1:FREQ 1000;SOUR1:VOLT 1')
+    s.observe('SOUR1:APPL:SIN 500, 1, 0')
+    assert 'SOUR1:FREQ' not in s.values
+    assert 'SOUR1:VOLT' not in s.values
+    s.observe('FREQ 1000')
+    s.observe('FUNC SQU')
+    assert 'SOUR1:FREQ' not in s.values
+
+
+def test_reset_clears():
+    s = shadow()
+    s.observe('FREQ 1000;*RST;VOLT 1')
+    assert s.values == {'SOUR1:VOLT': '1.0'}
+
+
+def test_invalidate_and_load():
+    s = shadow()
+    s.observe('SOUR2:FREQ 2000;VOLT 2')
+    s.invalidate('SOUR2:FREQ 2000;VOLT 2')
+    assert s.values == {}
+    s.load(':SOUR1:FREQ 1000;:SOUR1:VOLT 0.5\n:OUTP1 OFF')
+    assert s.values == {'SOUR1:FREQ': '1000.0', 'SOUR1:VOLT': '0.5',
+                        'OUTP1': '0.0'}
+
+
+def test_fgen_relative_write(fgen):
+    fgen.write('SOUR2:FREQ 2000;VOLT 2')
+    assert fgen.setState('VOLT 2')
+    assert float(fgen.instr.ask('SOUR1:VOLT?')) == 2
+
+
+def test_fgen_list_write(fgen):
+    fgen.write(['SOUR1:FREQ 2000', 'SOUR1:VOLT 0.5'])
+    assert float(fgen.instr.ask('SOUR1:VOLT?')) == 0.5
+    assert not fgen.setState('SOUR1:FREQ 2000')
+
+
+def test_fgen_failed_write_leaves_no_state(fgen, monkeypatch):
+    def fail(data):
+        raise UsbtmcException("Write failed", 'write_raw')
+    monkeypatch.setattr(fgen.instr, 'write_raw', fail)
+    with pytest.raises(UsbtmcException):
+        fgen.write('SOUR1:FREQ 2000')
+    with pytest.raises(UsbtmcException):
+        fgen.setState('SOUR1:VOLT 0.5')
+    monkeypatch.undo()
+    assert fgen.setState('SOUR1:FREQ 2000')
+    assert fgen.setState('SOUR1:VOLT 0.5')
@@ -0,0 +1,77 @@
+import pytest
+
+from usbtmc.simulator import split_program
+from ParameterSweep import ParameterSweep, rasterOrder, snakeOrder
+
+AXES = [('SOUR1:FREQ', [1e3, 2e3, 5e3]),
+        ('SOUR1:VOLT', [0.2, 0.3, 0.5]),
+        ('SOUR1:BURS:NCYC', [10, 100])]
+
+
+def recordWrites(device):
+    """ list the settings commands the model executes """
+    commands = []
+    write = device.model.write
+
+    def record(message):
+        commands.extend(c.decode('ascii') for c in split_program(message)
+                        if c.startswith(b'SOUR') or c.startswith(b':SOUR'))
+        return write(message)
+    device.model.write = record
+    return commands
+
+
+@pytest.mark.parametrize('sizes', [(3, 3, 2), (2, 4, 3), (5,), (1, 3)])
+def test_snake_order_is_a_gray_code(sizes):
+    indices = snakeOrder(sizes)
+    assert sorted(indices) == rasterOrder(sizes)
+    for a, b in zip(indices, indices[1:]):
+        assert sum(i != j for i, j in zip(a, b)) == 1
+
+
+@pytest.mark.parametrize('order, writes', [('snake', 20), ('raster', 30)])
+def test_sends_only_changed_nodes(fgen, device, order, writes):
+    commands = recordWrites(device)
+    sweep = ParameterSweep(fgen, AXES, order=order)
+    visited = [point for point, seconds, result in
+               sweep.run(lambda point: dict(point))]
+    assert sweep.sent == writes
+    assert len(commands) == writes
+    assert visited == [dict(point) for point in sweep.points()]
+    assert len(visited) == 18
+    last = visited[-1]
+    assert float(fgen.instr.ask('SOUR1:FREQ?')) == last['SOUR1:FREQ']
+    assert float(fgen.instr.ask('SOUR1:BURS:NCYC?')) == \
+        last['SOUR1:BURS:NCYC']
+
+
+def test_opc_axes_move_outermost(fgen):
+    sweep = ParameterSweep(fgen, AXES, opc=['SOUR1:BURS:NCYC'])
+    assert sweep.nodes == ['SOUR1:BURS:NCYC', 'SOUR1:FREQ', 'SOUR1:VOLT']
+    assert [p['SOUR1:BURS:NCYC'] for p in sweep.points()] == [10] * 9 + [100] * 9
+
+
+def test_waits_only_after_opc_changes(fgen, device):
+    events = recordWrites(device)
+    waitComplete = fgen.waitComplete
+
+    def wait(timeout):
+        events.append('wait')
+        return waitComplete(timeout)
+    fgen.waitComplete = wait
+
+    sweep = ParameterSweep(fgen, AXES, opc=['SOUR1:VOLT'])
+    steps = sweep.steps()
+    assert [waitOpc for point, commands, waitOpc in steps].count(True) == 3
+    sweep.run()
+    assert events.count('wait') == 3
+    # each wait follows the writes of a point that changed the node, and
+    # no later point changes it without a wait
+    segments = ' '.join(events).split('wait')
+    assert all('SOUR1:VOLT' in segment for segment in segments[:-1])
+    assert 'SOUR1:VOLT' not in segments[-1]
+
+
+def test_unknown_order(fgen):
+    with pytest.raises(ValueError):
+        ParameterSweep(fgen, AXES, order='spiral')
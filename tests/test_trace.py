@@ -0,0 +1,83 @@
+import usbtmc
+from usbtmc.metrics import Metrics, MeteredDevice
+from usbtmc.simulator import SimulatedDevice
+from usbtmc.trace import ReplayDevice, RecordingDevice, read_trace, BULK_OUT
+
+
+def session(instr):
+    idn = instr.ask('*IDN?')
+    instr.write('FREQ 1234')
+    freq = instr.ask('FREQ?')
+    stb = instr.read_stb()
+    instr.write('*ESE 1')
+    instr.wait_opc(timeout=2)
+    instr.clear()
+    return idn, freq, stb
+
+
+def test_record_replay(instr, tmp_path):
+    path = str(tmp_path / 'session.trace')
+    instr.start_recording(path)
+    recorded = session(instr)
+    instr.stop_recording()
+
+    replay = usbtmc.Instrument(device=ReplayDevice(path, scale=0, strict=True))
+    assert session(replay) == recorded
+    assert replay.device.mismatches == 0
+
+
+def test_replay_counts_mismatches(instr, tmp_path):
+    path = str(tmp_path / 'session.trace')
+    instr.start_recording(path)
+    instr.write('FREQ 1000')
+    instr.stop_recording()
+
+    replay = usbtmc.Instrument(device=ReplayDevice(path, scale=0))
+    replay.write('FREQ 2000')
+    assert replay.device.mismatches == 1
+
+
+def test_large_writes_are_hashed(instr, tmp_path):
+    path = str(tmp_path / 'session.trace')
+    instr.start_recording(path, hash_threshold=64)
+    instr.write('DATA:ARB:DAC test,' + ','.join(['100'] * 100))
+    instr.stop_recording()
+    header, records = read_trace(path)
+    out = [r for r in records if r.kind == BULK_OUT]
+    assert out[0].size > 64 and len(out[0].payload) == 12 + 20
+
+
+def test_stop_recording_under_metrics(instr, tmp_path):
+    instr.start_recording(str(tmp_path / 'session.trace'))
+    instr.set_metrics(Metrics())
+    instr.stop_recording()
+    assert isinstance(instr.device, MeteredDevice)
+    assert not isinstance(instr.device.device, RecordingDevice)
+    instr.ask('*IDN?')
+    instr.set_metrics(None)
+    assert isinstance(instr.device, SimulatedDevice)
+    assert isinstance(instr.bulk_out_ep, type(instr.device.bulk_out_ep))
+    assert instr.ask('*IDN?').startswith('Agilent')
+
+
+def test_metrics_detach_under_recording(instr, tmp_path):
+    instr.set_metrics(Metrics())
+    instr.start_recording(str(tmp_path / 'session.trace'))
+    instr.set_metrics(None)
+    assert isinstance(instr.device, RecordingDevice)
+    instr.ask('*IDN?')
+    instr.stop_recording()
+    assert isinstance(instr.device, SimulatedDevice)
+
+
+def test_benchmark_replays_session(instr, tmp_path):
+    from fgen_benchmark import replaySession
+
+    path = str(tmp_path / 'session.trace')
+    instr.start_recording(path)
+    session(instr)
+    instr.stop_recording()
+
+    device = replaySession(path, 0)
+    assert device.mismatches == 0
+    assert not any(device.replay.queues.values())
@@ -0,0 +1,60 @@
+import numpy as np
+
+from SpanTracer import SpanTracer
+from usbtmc.metrics import Metrics
+
+
+def names(tracer):
+    return [event['name'] for event in tracer.events]
+
+
+def test_nested_spans(fgen):
+    tracer = SpanTracer()
+    fgen.setTracer(tracer)
+    fgen.pushArbitraryWaveform(np.arange(-100, 100).astype(np.int16),
+                               binary=True)
+    spans = names(tracer)
+    assert spans[-1] == 'FunctionGenerator.pushArbitraryWaveform'
+    assert 'Instrument.write_raw' in spans
+    root = tracer.events[-1]
+    assert root['args']['childTime'] > 0
+    fgen.setTracer(None)
+    assert 'pushArbitraryWaveform' not in fgen.__dict__
+    assert 'write_raw' not in fgen.instr.__dict__
+
+
+def test_generator_methods_span_iteration(instr):
+    tracer = SpanTracer()
+    tracer.attach(instr)
+    instr.write('*IDN?')
+    data = b''.join(instr.read_chunks())
+    event = [e for e in tracer.events if e['name'] == 'Instrument.read_chunks']
+    assert len(event) == 1
+    assert event[0]['args']['bytesOut'] == len(data)
+
+
+def test_sampling_skips_whole_calls(fgen):
+    tracer = SpanTracer(sampleRate=0.0)
+    fgen.setTracer(tracer)
+    fgen.getIdn()
+    assert len(tracer.events) == 0
+
+
+def test_tracer_and_metrics_detach_in_any_order(fgen):
+    tracer, metrics = SpanTracer(), Metrics()
+    fgen.setTracer(tracer)
+    fgen.setMetrics(metrics)
+    fgen.setTracer(None)
+    fgen.getIdn()
+    assert metrics.snapshot()['commands']
+    assert len(tracer.events) == 0
+    fgen.setMetrics(None)
+    assert 'ask' not in fgen.instr.__dict__
+
+    fgen.setMetrics(metrics)
+    fgen.setTracer(tracer)
+    fgen.setMetrics(None)
+    fgen.getIdn()
+    assert 'FunctionGenerator.getIdn' in names(tracer)
+    fgen.setTracer(None)
+    assert 'ask' not in fgen.instr.__dict__
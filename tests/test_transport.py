@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+
+import pytest
+
+import usbtmc
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    """ count the threads started """
+    started = []
+    base = threading.Thread
+
+    class Thread(base):
+        def start(self):
+            started.append(self)
+            base.start(self)
+
+    monkeypatch.setattr(threading, 'Thread', Thread)
+    return started
+
+
+def test_long_reply_spans_transfers(instr, device, threads):
+    idn = instr.ask('*IDN?')
+    instr.max_recv_size = 8
+    transfers = device.transfers
+    assert instr.ask('*IDN?') == idn
+    # a request and a response per 8 byte transfer, on this thread
+    assert device.transfers - transfers == 1 + 2 * ((len(idn) + 1 + 7) // 8)
+    assert threads == []
+
+
+def test_serial_cache_expires(device, monkeypatch):
+    from usbtmc import usbtmc
+
+    serials = iter(['A', 'B'])
+    monkeypatch.setattr(usbtmc.usb.util, 'get_string',
+                        lambda dev, index: next(serials))
+    monkeypatch.setattr(usbtmc, 'serial_cache', {})
+    now = [1000.0]
+    monkeypatch.setattr(usbtmc, 'monotonic', lambda: now[0])
+
+    assert usbtmc.get_serial(device) == 'A'
+    now[0] += usbtmc.DEVICE_CACHE_TTL / 2
+    assert usbtmc.get_serial(device) == 'A'
+    now[0] += usbtmc.DEVICE_CACHE_TTL
+    assert usbtmc.get_serial(device) == 'B'
+
+
+def test_trigger_btag_wraps(instr):
+    instr.last_btag = 254
+    instr.trigger()
+    instr.trigger()
+    assert instr.last_btag == 1
+    assert instr.ask('*IDN?')
+
+
+def test_read_into(instr):
+    idn = instr.ask('*IDN?').encode('ascii') + b'\n'
+    instr.max_recv_size = 8  # several transfers
+    instr.write('*IDN?')
+    buffer = bytearray(100)
+    n = instr.read_into(buffer)
+    assert buffer[:n] == idn
+
+
+def test_read_into_typed_buffer(instr):
+    import numpy as np
+
+    idn = instr.ask('*IDN?').encode('ascii') + b'\n'
+    instr.write('*IDN?')
+    buffer = np.zeros(100, dtype=np.int16)
+    n = instr.read_into(buffer)
+    assert buffer.tobytes()[:n] == idn
+
+
+def test_read_into_leaves_rest(instr):
+    idn = instr.ask('*IDN?').encode('ascii') + b'\n'
+    instr.write('*IDN?')
+    buffer = bytearray(10)
+    assert instr.read_into(buffer, 6) == 6
+    assert buffer[:6] == idn[:6]
+    assert instr.read_raw() == idn[6:]
+
+
+def test_alternating_reads_reuse_buffers(instr):
+    idn = instr.ask('*IDN?').encode('ascii') + b'\n'
+    instr.write('*IDN?')
+    assert instr.read_raw(6) == idn[:6]
+    assert instr.read_raw() == idn[6:]
+    buffers = dict(instr.read_buffers)
+    assert len(buffers) == 2
+    for i in range(3):
+        instr.write('*IDN?')
+        data = instr.read_raw(6)
+        assert isinstance(data, bytearray) and data == idn[:6]
+        assert instr.read_raw() == idn[6:]
+    assert all(instr.read_buffers[k] is v for k, v in buffers.items())
+
+
+def test_write_spans_transfers(instr, device):
+    instr.max_recv_size = 8
+    transfers = device.transfers
+    instr.write('SOUR1:FREQ 2500')
+    # 16 bytes with the newline, two full transfers
+    assert device.transfers - transfers == 2
+    full = instr.write_buffers[20]
+    # 20 bytes, the last 4 go out in their own 16 byte transfer buffer
+    instr.write('SOUR1:VOLT:OFFS 0.1')
+    assert sorted(instr.write_buffers) == [16, 20]
+    assert instr.write_buffers[20] is full
+    assert float(instr.ask('SOUR1:FREQ?')) == 2500
+    assert float(instr.ask('SOUR1:VOLT:OFFS?')) == 0.1
+
+
+def test_write_numpy(instr):
+    import numpy as np
+
+    data = np.frombuffer(b'SOUR1:VOLT 0.75\n', dtype=np.int16)
+    instr.max_recv_size = 12
+    instr.write_raw(data)
+    assert float(instr.ask('SOUR1:VOLT?')) == 0.75
+
+
+@pytest.fixture
+def capabilityCache(tmp_path, monkeypatch):
+    from usbtmc import usbtmc
+
+    path = str(tmp_path / 'usbtmc' / 'capabilities.json')
+    monkeypatch.setattr(usbtmc, 'CAPABILITY_CACHE', path)
+    monkeypatch.setattr(usbtmc, 'serial_cache', {})
+    return path
+
+
+def countRequests(device):
+    """ count GET_CAPABILITIES requests and device resets """
+    from usbtmc.usbtmc import USBTMC_REQUEST_GET_CAPABILITIES
+
+    counts = {'capabilities': 0, 'reset': 0}
+    ctrl_transfer, reset = device.ctrl_transfer, device.reset
+
+    def counted(bmRequestType, bRequest, *args, **kwargs):
+        if bRequest == USBTMC_REQUEST_GET_CAPABILITIES:
+            counts['capabilities'] += 1
+        return ctrl_transfer(bmRequestType, bRequest, *args, **kwargs)
+
+    def counted_reset():
+        counts['reset'] += 1
+        return reset()
+    device.ctrl_transfer = counted
+    device.reset = counted_reset
+    return counts
+
+
+def test_fast_connect_caches_capabilities(device, capabilityCache):
+    counts = countRequests(device)
+    usbtmc.Instrument(device=device, fast_connect=True)
+    assert counts == {'capabilities': 1, 'reset': 0}
+    with open(capabilityCache) as f:
+        entry = list(json.load(f).values())[0]
+    assert entry['bcdDevice'] == device.bcdDevice
+
+    instr = usbtmc.Instrument(device=device, fast_connect=True)
+    assert counts == {'capabilities': 1, 'reset': 0}
+    assert instr.support_trigger
+    assert instr.ask('*IDN?')
+
+
+def test_fast_connect_reprobes_new_firmware(device, capabilityCache):
+    counts = countRequests(device)
+    usbtmc.Instrument(device=device, fast_connect=True)
+    device.bcdDevice += 1
+    usbtmc.Instrument(device=device, fast_connect=True)
+    assert counts['capabilities'] == 2
+    usbtmc.Instrument(device=device, fast_connect=True)
+    assert counts['capabilities'] == 2
+
+
+def test_slow_connect_resets(device, capabilityCache):
+    counts = countRequests(device)
+    usbtmc.Instrument(device=device)
+    assert counts['capabilities'] == 1
+    assert counts['reset'] == (1 if os.name == 'posix' else 0)
+    assert not os.path.exists(capabilityCache)
+
+
+def test_failed_capability_save_keeps_cache(device, capabilityCache,
+                                            monkeypatch):
+    from usbtmc import usbtmc as module
+
+    usbtmc.Instrument(device=device, fast_connect=True)
+    with open(capabilityCache) as f:
+        saved = f.read()
+
+    def dump(obj, f):
+        f.write('{"truncated')
+        raise OSError("No space left on device")
+    monkeypatch.setattr(module.json, 'dump', dump)
+    device.bcdDevice += 1
+    usbtmc.Instrument(device=device, fast_connect=True)
+    with open(capabilityCache) as f:
+        assert f.read() == saved
+    assert os.listdir(os.path.dirname(capabilityCache)) == \
+        [os.path.basename(capabilityCache)]
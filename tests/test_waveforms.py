@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+
+from FunctionGenerator import WaveformError
+
+
+def ramp(points, step=1, offset=0):
+    return ((np.arange(points) * step + offset) % 4000 - 2000).astype(np.int16)
+
+
+def stored(device, name):
+    return list(device.model.waveforms[name.upper()])
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_upload(fgen, device, binary):
+    waveform = ramp(100, 37)
+    fgen.loadArbitraryWaveform(waveform, binary)
+    expected = [int(v) for v in waveform]
+    assert [int(round(v)) for v in stored(device, 'volatile')] == expected
+
+
+def test_upload_rejects_out_of_range(fgen):
+    with pytest.raises(WaveformError):
+        fgen.loadArbitraryWaveform([0] * 7 + [3000])
+
+
+def test_reject_reports_indices(fgen, device):
+    waveform = [0] * 20
+    waveform[3], waveform[11] = 2048, -3000
+    with pytest.raises(WaveformError) as info:
+        fgen.loadArbitraryWaveform(waveform, binary=True)
+    assert info.value.reason == 'range'
+    assert info.value.indices == [3, 11]
+    assert 'at index 3, 11' in str(info.value)
+    assert 'VOLATILE' not in device.model.waveforms
+
+
+def test_many_offending_indices_are_summarized(fgen):
+    with pytest.raises(WaveformError) as info:
+        fgen.validateWaveform([5000] * 30)
+    assert info.value.indices == list(range(30))
+    assert '(30 total)' in str(info.value)
+
+
+def test_clip_policy(fgen, device):
+    waveform = ramp(20)
+    waveform[2], waveform[5] = 2047, -2047
+    unclipped = waveform.astype(np.int32)
+    unclipped[2], unclipped[5] = 2500, -4000
+    fgen.loadArbitraryWaveform(unclipped, binary=True, policy='clip')
+    assert [int(round(v)) for v in stored(device, 'volatile')] == \
+        [int(v) for v in waveform]
+
+
+def test_unknown_policy(fgen):
+    with pytest.raises(ValueError):
+        fgen.validateWaveform(ramp(20), policy='wrap')
+
+
+def test_float_points(fgen):
+    assert fgen.validateWaveform(np.arange(10.0)).dtype == np.int16
+    with pytest.raises(WaveformError) as info:
+        fgen.validateWaveform([0.0] * 4 + [0.5] + [1.0] * 4 + [2.25])
+    assert info.value.reason == 'dtype'
+    assert info.value.indices == [4, 9]
+
+
+@pytest.mark.parametrize('waveform', [['0'] * 10, [True] * 10,
+                                      np.zeros(10, dtype=complex)])
+def test_non_integer_dtype(fgen, waveform):
+    with pytest.raises(WaveformError) as info:
+        fgen.validateWaveform(waveform)
+    assert info.value.reason == 'dtype'
+    assert info.value.indices == []
+
+
+@pytest.mark.parametrize('points', [0, 7, 16001])
+def test_length(fgen, points):
+    with pytest.raises(WaveformError) as info:
+        fgen.validateWaveform(np.zeros(points, dtype=np.int16))
+    assert info.value.reason == 'length'
+    assert str(points) in str(info.value)
+
+
+@pytest.mark.parametrize('points', [8, 16000])
+def test_length_limits_accepted(fgen, points):
+    assert len(fgen.validateWaveform(np.zeros(points, dtype=np.int16))) == \
+        points
+
+
+@pytest.mark.parametrize('waveform', [np.zeros((2, 10)), 5])
+def test_shape(fgen, waveform):
+    with pytest.raises(WaveformError) as info:
+        fgen.validateWaveform(waveform)
+    assert info.value.reason == 'shape'
+
+
+def counting(fgen):
+    uploads = []
+    load = fgen.loadArbitraryWaveformBinary
+
+    def counted(waveform, name=None):
+        uploads.append(name)
+        return load(waveform, name)
+    fgen.loadArbitraryWaveformBinary = counted
+    return uploads
+
+
+def test_cache_hits_do_not_upload(fgen):
+    uploads = counting(fgen)
+    first = fgen.pushCachedWaveform(ramp(1000))
+    assert fgen.pushCachedWaveform(ramp(1000)) == first
+    assert len(uploads) == 1
+
+
+def test_cache_eviction_is_amortized(fgen):
+    fgen.arbCacheLimit = 8
+    uploads = counting(fgen)
+    misses = 40
+    for i in range(misses):
+        fgen.pushCachedWaveform(ramp(1000, offset=i))
+    assert len(fgen.arbCache) <= 8
+    # each miss uploads once, re-uploads after bulk evictions add at most
+    # about one more per miss
+    assert len(uploads) <= 2 * misses
+
+
+def test_cache_evicts_when_memory_is_full(fgen, device):
+    uploads = counting(fgen)
+    points = 16000
+    for i in range(12):
+        fgen.pushCachedWaveform(ramp(points, offset=i))
+    assert len(fgen.arbCache) * points <= device.model.volatile_size
+    assert len(uploads) <= 2 * 12
+    name = fgen.pushCachedWaveform(ramp(points, offset=11))
+    assert name.upper() in device.model.waveforms
+
+
+def test_cache_rejects_waveform_larger_than_memory(fgen, device):
+    device.model.volatile_size = 10000
+    uploads = counting(fgen)
+    with pytest.raises(WaveformError) as info:
+        fgen.pushCachedWaveform(ramp(12000))
+    assert info.value.reason == 'memory'
+    assert uploads == []
+
+    kept = fgen.pushCachedWaveform(ramp(4000))
+    with pytest.raises(WaveformError):
+        fgen.pushCachedWaveform(ramp(11000, offset=1))
+    # nothing was evicted for it
+    assert kept.upper() in device.model.waveforms
+    assert len(fgen.arbCache) == 1
+    assert len(uploads) == 1
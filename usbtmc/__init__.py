@@ -28,3 +28,11 @@ __all__ = ["usbtmc"]
 
 from .usbtmc import Instrument
 from .usbtmc import list_devices
+from .usbtmc import pack_block_header
+from .usbtmc import join_commands
+from .usbtmc import short_form
+from .usbtmc import split_response
+from .usbtmc import unpack_block
+from .usbtmc import find_device
+from .usbtmc import open_instruments
+from .usbtmc import invalidate_device_cache
@@ -0,0 +1,92 @@
+"""
+
+asyncio interface for USBTMC instruments
+
+Every Instrument gets one I/O thread (a usbtmc.session.Session); its calls are
+queued on that thread in the order they were awaited, so btags stay consistent
+while the event loop keeps running and many instruments are driven
+concurrently. Threads may share the same Session.
+
+"""
+
+import asyncio
+import functools
+import threading
+
+from .usbtmc import Instrument, UsbtmcException
+from .session import Session
+
+class AsyncInstrument(object):
+    "asyncio wrapper running all I/O of one Instrument through its Session"
+    def __init__(self, instrument, session = None):
+        self.instrument = instrument
+        if session is None:
+            session = Session(instrument)
+        self.session = session
+    
+    @classmethod
+    async def open(cls, *args, **kwargs):
+        "Open an Instrument (same arguments) without blocking the event loop"
+        loop = asyncio.get_running_loop()
+        instrument = await loop.run_in_executor(
+            None, functools.partial(Instrument, *args, **kwargs))
+        return cls(instrument)
+    
+    def run(self, func, *args, **kwargs):
+        """Run a blocking call on the I/O thread, returns an awaitable.
+        Raises UsbtmcException when called inside a batch() block of the
+        instrument on this thread: the call could not start before the block
+        exits, so awaiting it would deadlock the event loop."""
+        if getattr(self.instrument, 'batch_owner', None) == threading.current_thread().ident:
+            raise UsbtmcException("Awaiting the instrument inside its batch() "
+                                  "block would deadlock", 'aio')
+        return asyncio.wrap_future(self.session.submit(func, *args, **kwargs))
+    
+    async def write_raw(self, data):
+        "Write binary data to instrument"
+        return await self.run(self.instrument.write_raw, data)
+    
+    async def read_raw(self, num = -1):
+        "Read binary data from instrument"
+        return await self.run(self.instrument.read_raw, num)
+    
+    async def ask_raw(self, data, num = -1):
+        "Write then read binary data"
+        return await self.run(self.instrument.ask_raw, data, num)
+    
+    async def write(self, message, encoding = 'utf-8'):
+        "Write string to instrument"
+        return await self.run(self.instrument.write, message, encoding)
+    
+    async def read(self, num = -1, encoding = 'utf-8'):
+        "Read string from instrument"
+        return await self.run(self.instrument.read, num, encoding)
+    
+    async def ask(self, message, num = -1, encoding = 'utf-8'):
+        "Write then read string"
+        return await self.run(self.instrument.ask, message, num, encoding)
+    
+    async def ask_batch(self, messages, types = None, encoding = 'utf-8'):
+        "Send several queries as one message, see Instrument.ask_batch"
+        return await self.run(self.instrument.ask_batch, messages, types, encoding)
+    
+    async def read_stb(self):
+        "Read status byte"
+        return await self.run(self.instrument.read_stb)
+    
+    async def trigger(self):
+        "Send trigger command"
+        return await self.run(self.instrument.trigger)
+    
+    async def wait_opc(self, timeout = 10.0):
+        "Wait until the instrument has finished all pending operations"
+        return await self.run(self.instrument.wait_opc, timeout)
+    
+    async def clear(self):
+        "Send clear command"
+        return await self.run(self.instrument.clear)
+    
+    def close(self):
+        "Stop the I/O thread once queued calls have finished"
+        self.session.close(wait = False)
+
@@ -0,0 +1,411 @@
+"""
+
+Latency and throughput instrumentation for USBTMC instruments
+
+Metrics collects, per instrument:
+
+* latency histograms of bulk-OUT, bulk-IN, interrupt-IN and control
+  transfers and of commands (write, ask, ...) per SCPI command root
+* byte counters per transfer type
+* timeout, retry (control requests answered STATUS_PENDING) and error counts
+* queue depths, sampled when a snapshot is taken
+
+Instrument.set_metrics(metrics) wraps the endpoints, the device's
+ctrl_transfer and the command methods of one instrument in recording
+proxies; set_metrics(None) removes them again, so a detached instrument
+runs the original code with no overhead at all. Hooks added with
+add_hook() see every event as it is recorded. export() writes snapshots of
+any number of Metrics in the Prometheus text format.
+
+"""
+
+import os
+import re
+import threading
+import time
+
+import usb.core
+
+from .usbtmc import (is_timeout, innermost, remove_layer, remove_wrapper, short_form,
+    USBTMC_STATUS_PENDING)
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+# Instrument methods timed as commands, by the SCPI root of their argument
+COMMAND_METHODS = ('write', 'ask', 'ask_batch', 'write_raw', 'ask_raw', 'read_raw',
+                   'read_into', 'trigger', 'read_stb', 'clear', 'wait_opc')
+
+ROOT_RE = re.compile(r'^[\s:]*(\*?[A-Za-z]+)')
+
+def command_root(message):
+    """Root keyword of the first command in a message, in short form without
+    numeric suffix ('SOURce1:FREQ 1e3' -> 'SOUR'), '' if there is none"""
+    if isinstance(message, (list, tuple)):
+        message = message[0] if message else ''
+    if not isinstance(message, str):
+        try:
+            message = bytes(memoryview(message)[:32]).decode('ascii', 'replace')
+        except TypeError:
+            message = str(message)
+    m = ROOT_RE.match(message)
+    if m is None:
+        return ''
+    return short_form(m.group(1).upper())
+
+class Histogram(object):
+    """Log-linear latency histogram in the style of HdrHistogram: values
+    are counted in buckets that are never wider than 1/2**precision of the
+    values they hold, so percentiles keep that relative precision over the
+    whole range while recording stays O(1)"""
+    def __init__(self, precision = 5, unit = 1e-9):
+        self.precision = precision
+        self.unit = unit
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        value = max(int(seconds / self.unit), 0)
+        shift = max(value.bit_length() - self.precision - 1, 0)
+        key = (shift, value >> shift)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        "Upper bound of the bucket holding the q-th percentile (0..100), in seconds"
+        if not self.count:
+            return 0.0
+        rank = max(int(round(q / 100.0 * self.count)), 1)
+        seen = 0
+        for shift, mantissa in sorted(self.counts):
+            seen += self.counts[shift, mantissa]
+            if seen >= rank:
+                value = ((mantissa + 1) << shift) - 1
+                return min(value * self.unit, self.max)
+        return self.max
+
+    def merge(self, other):
+        for key, n in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+        self.count += other.count
+        self.total += other.total
+        for m in (other.min, other.max):
+            if m is not None:
+                self.min = m if self.min is None else min(self.min, m)
+                self.max = m if self.max is None else max(self.max, m)
+
+class Metrics(object):
+    "Counters, histograms, gauges and hooks of one instrument"
+    def __init__(self, labels = None, precision = 5):
+        """labels are added to every exported series, e.g.
+        {'instrument': 'fgen'}"""
+        self.labels = dict(labels or {})
+        self.precision = precision
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.gauges = {}
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        "Forget everything recorded so far"
+        with self.lock:
+            self.transfers = {}     # op -> Histogram
+            self.commands = {}      # (op, root) -> Histogram
+            self.bytes = {}         # op -> bytes moved
+            self.timeouts = {}      # op -> count
+            self.retries = {}       # op -> count
+            self.errors = {}        # op -> count
+
+    def add_hook(self, hook):
+        """Call hook(kind, op, root, seconds, nbytes, error) for every
+        recorded event. kind is 'transfer' or 'command'; error is the
+        exception that ended the call, or None."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def add_gauge(self, name, func):
+        "Sample func() as queue depth gauge name when a snapshot is taken"
+        self.gauges[name] = func
+
+    def remove_gauge(self, name):
+        self.gauges.pop(name, None)
+
+    def histogram(self, table, key):
+        h = table.get(key)
+        if h is None:
+            h = table[key] = Histogram(self.precision)
+        return h
+
+    def record_transfer(self, op, seconds, nbytes, error = None):
+        with self.lock:
+            self.histogram(self.transfers, op).record(seconds)
+            self.bytes[op] = self.bytes.get(op, 0) + nbytes
+            if error is not None:
+                table = self.timeouts if is_timeout(error) else self.errors
+                table[op] = table.get(op, 0) + 1
+        for hook in self.hooks:
+            hook('transfer', op, '', seconds, nbytes, error)
+
+    def record_retry(self, op):
+        with self.lock:
+            self.retries[op] = self.retries.get(op, 0) + 1
+
+    def record_command(self, op, root, seconds, error = None):
+        with self.lock:
+            self.histogram(self.commands, (op, root)).record(seconds)
+            if error is not None:
+                self.errors[op] = self.errors.get(op, 0) + 1
+        for hook in self.hooks:
+            hook('command', op, root, seconds, 0, error)
+
+    def timed_command(self, op, func):
+        """Wrap a command method so the outermost call on each thread is
+        recorded; commands called by commands (ask calls write) are not
+        counted twice"""
+        local = self.local
+        def timed(*args, **kwargs):
+            depth = getattr(local, 'depth', 0)
+            if depth:
+                return timed.wrapped(*args, **kwargs)
+            local.depth = 1
+            error = None
+            start = perf_counter()
+            try:
+                return timed.wrapped(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                local.depth = 0
+                self.record_command(op, command_root(args[0]) if args else '',
+                                    perf_counter() - start, error)
+        timed.__doc__ = func.__doc__
+        timed.wrapped = func
+        timed.installed_by = self
+        return timed
+
+    def snapshot(self):
+        "Copy of the current values, gauges sampled now"
+        with self.lock:
+            snap = dict(
+                transfers = dict((k, self.copy(h)) for k, h in self.transfers.items()),
+                commands = dict((k, self.copy(h)) for k, h in self.commands.items()),
+                bytes = dict(self.bytes),
+                timeouts = dict(self.timeouts),
+                retries = dict(self.retries),
+                errors = dict(self.errors)
+            )
+        snap['gauges'] = dict((name, func()) for name, func in self.gauges.items())
+        return snap
+
+    def copy(self, h):
+        c = Histogram(h.precision, h.unit)
+        c.merge(h)
+        return c
+
+    def prometheus(self, prefix = 'usbtmc'):
+        "Snapshot in the Prometheus text exposition format"
+        return format_prometheus([self], prefix)
+
+class MeteredEndpoint(object):
+    "Endpoint proxy recording the duration and size of every transfer"
+    def __init__(self, ep, metrics, op):
+        self.ep = ep
+        self.metrics = metrics
+        self.op = op
+
+    def __getattr__(self, name):
+        return getattr(self.ep, name)
+
+    def write(self, data, timeout = None):
+        error = None
+        start = perf_counter()
+        try:
+            return self.ep.write(data, timeout)
+        except usb.core.USBError as e:
+            error = e
+            raise
+        finally:
+            self.metrics.record_transfer(self.op, perf_counter() - start,
+                                         len(data), error)
+
+    def read(self, size_or_buffer, timeout = None):
+        error = None
+        count = 0
+        start = perf_counter()
+        try:
+            result = self.ep.read(size_or_buffer, timeout)
+            count = result if isinstance(result, int) else len(result)
+            return result
+        except usb.core.USBError as e:
+            error = e
+            raise
+        finally:
+            self.metrics.record_transfer(self.op, perf_counter() - start,
+                                         count, error)
+
+class MeteredDevice(object):
+    "Device proxy recording control transfers"
+    def __init__(self, device, metrics):
+        self.device = device
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def __iter__(self):
+        return iter(self.device)
+
+    def clear_halt(self, ep):
+        # pyusb only accepts its own Endpoint objects or addresses
+        return self.device.clear_halt(innermost(ep, 'ep'))
+
+    def ctrl_transfer(self, *args, **kwargs):
+        error = None
+        count = 0
+        start = perf_counter()
+        try:
+            b = self.device.ctrl_transfer(*args, **kwargs)
+            count = b if isinstance(b, int) else len(b)
+            if not isinstance(b, int) and len(b) and b[0] == USBTMC_STATUS_PENDING:
+                self.metrics.record_retry('control')
+            return b
+        except usb.core.USBError as e:
+            error = e
+            raise
+        finally:
+            self.metrics.record_transfer('control', perf_counter() - start,
+                                         count, error)
+
+class MeteredDSO(object):
+    """LeCroy ActiveDSO control proxy (see Oscilloscope) recording every
+    WriteString and ReadString as a command, by the root of the last
+    command written, and their sizes as transfers"""
+    def __init__(self, dso, metrics):
+        self.dso = dso
+        self.metrics = metrics
+        self.root = ''
+
+    def __getattr__(self, name):
+        return getattr(self.dso, name)
+
+    def WriteString(self, command, eoi):
+        self.root = command_root(command)
+        error = None
+        start = perf_counter()
+        try:
+            return self.dso.WriteString(command, eoi)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            self.metrics.record_transfer('dso_write', elapsed, len(command))
+            self.metrics.record_command('write', self.root, elapsed, error)
+
+    def ReadString(self, count):
+        error = None
+        data = ''
+        start = perf_counter()
+        try:
+            data = self.dso.ReadString(count)
+            return data
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            self.metrics.record_transfer('dso_read', elapsed, len(data or ''))
+            self.metrics.record_command('read', self.root, elapsed, error)
+
+def attach(instrument, metrics):
+    "Install recording proxies on an Instrument, see Instrument.set_metrics"
+    detach(instrument)
+    instrument.metrics = metrics
+    instrument.device = MeteredDevice(instrument.device, metrics)
+    instrument.bulk_out_ep = MeteredEndpoint(instrument.bulk_out_ep, metrics, 'bulk_out')
+    instrument.bulk_in_ep = MeteredEndpoint(instrument.bulk_in_ep, metrics, 'bulk_in')
+    if instrument.interrupt_in_ep is not None:
+        instrument.interrupt_in_ep = MeteredEndpoint(instrument.interrupt_in_ep, metrics,
+                                                     'interrupt_in')
+    for name in COMMAND_METHODS:
+        setattr(instrument, name, metrics.timed_command(name, getattr(instrument, name)))
+    metrics.add_gauge('write_queue', lambda: len(instrument.write_queue))
+
+def detach(instrument):
+    "Remove the proxies installed by attach()"
+    if instrument.metrics is None:
+        return
+    for name in COMMAND_METHODS:
+        remove_wrapper(instrument, name, instrument.metrics)
+    instrument.device = remove_layer(instrument.device, 'device', MeteredDevice)
+    for name in ('bulk_out_ep', 'bulk_in_ep', 'interrupt_in_ep'):
+        ep = getattr(instrument, name)
+        if ep is not None:
+            setattr(instrument, name, remove_layer(ep, 'ep', MeteredEndpoint))
+    instrument.metrics.remove_gauge('write_queue')
+    instrument.metrics = None
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def series(name, labels, value):
+    if labels:
+        name += '{' + ','.join('%s="%s"' % (k, escape(v)) for k, v in sorted(labels.items())) + '}'
+    return '%s %r' % (name, float(value))
+
+def format_prometheus(metrics_list, prefix = 'usbtmc'):
+    "Prometheus text exposition of snapshots of several Metrics"
+    snaps = [(m.labels, m.snapshot()) for m in metrics_list]
+    lines = []
+    def summary(name, help, key, label_names):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s summary' % (prefix, name))
+        for labels, snap in snaps:
+            for k, h in sorted(snap[key].items()):
+                l = dict(labels)
+                l.update(zip(label_names, k if isinstance(k, tuple) else (k,)))
+                for q in (50, 90, 99, 99.9):
+                    ql = dict(l, quantile = '%g' % (q / 100.0))
+                    lines.append(series('%s_%s' % (prefix, name), ql, h.percentile(q)))
+                lines.append(series('%s_%s_sum' % (prefix, name), l, h.total))
+                lines.append(series('%s_%s_count' % (prefix, name), l, h.count))
+    def counter(name, help, key, label_name, kind = 'counter'):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+        for labels, snap in snaps:
+            for k, v in sorted(snap[key].items()):
+                lines.append(series('%s_%s' % (prefix, name), dict(labels, **{label_name: k}), v))
+    summary('transfer_seconds', 'USB transfer latency', 'transfers', ('op',))
+    summary('command_seconds', 'Command latency by SCPI root', 'commands', ('op', 'root'))
+    counter('transfer_bytes_total', 'Bytes moved by USB transfers', 'bytes', 'op')
+    counter('timeouts_total', 'Transfers that timed out', 'timeouts', 'op')
+    counter('retries_total', 'Control requests answered STATUS_PENDING', 'retries', 'op')
+    counter('errors_total', 'Failed transfers and commands', 'errors', 'op')
+    counter('queue_depth', 'Requests waiting in a queue', 'gauges', 'queue', 'gauge')
+    return '\n'.join(lines) + '\n'
+
+def export(path, metrics_list, prefix = 'usbtmc'):
+    """Write snapshots of several Metrics to a file in the Prometheus text
+    format, e.g. for the node_exporter textfile collector. The file is
+    replaced atomically."""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(format_prometheus(metrics_list, prefix))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
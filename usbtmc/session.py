@@ -0,0 +1,113 @@
+"""
+
+Thread-safe request multiplexing for USBTMC instruments
+
+A Session owns one I/O thread per instrument. Any number of threads submit
+requests to it and get a concurrent.futures.Future back for each one;
+requests are executed one at a time in submission order, each as a whole
+transaction, so a response always belongs to the request that asked for it
+(read_raw additionally checks the btag of every transfer it receives).
+
+"""
+
+import threading
+import concurrent.futures
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .usbtmc import UsbtmcException
+
+class Session(object):
+    "Queue of requests from many threads, executed in order on one I/O thread"
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            future, func, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) on the I/O thread, returns a Future.
+        func may be any callable doing I/O on the instrument, e.g. a method
+        of a FunctionGenerator wrapping it. Raises UsbtmcException once the
+        session is closed, as nothing would run the request."""
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise UsbtmcException("Session is closed", 'submit')
+            self.requests.put((future, func, args, kwargs))
+        return future
+
+    def pending(self):
+        "Number of queued requests that have not started yet"
+        return self.requests.qsize()
+
+    def write_raw(self, data):
+        "Queue a binary write, returns a Future"
+        return self.submit(self.instrument.write_raw, data)
+
+    def read_raw(self, num=-1):
+        "Queue a binary read, returns a Future of the data"
+        return self.submit(self.instrument.read_raw, num)
+
+    def ask_raw(self, data, num=-1):
+        "Queue a binary write and read, returns a Future of the data"
+        return self.submit(self.instrument.ask_raw, data, num)
+
+    def write(self, message, encoding = 'utf-8'):
+        "Queue a string write, returns a Future"
+        return self.submit(self.instrument.write, message, encoding)
+
+    def ask(self, message, num=-1, encoding = 'utf-8'):
+        "Queue a query, returns a Future of the response string"
+        return self.submit(self.instrument.ask, message, num, encoding)
+
+    def ask_batch(self, messages, types = None, encoding = 'utf-8'):
+        "Queue several queries sent as one message, see Instrument.ask_batch"
+        return self.submit(self.instrument.ask_batch, messages, types, encoding)
+
+    def read_stb(self):
+        "Queue a status byte read, returns a Future of the status byte"
+        return self.submit(self.instrument.read_stb)
+
+    def trigger(self):
+        "Queue a trigger, returns a Future"
+        return self.submit(self.instrument.trigger)
+
+    def wait_opc(self, timeout = 10.0):
+        "Queue a wait for pending operations, returns a Future"
+        return self.submit(self.instrument.wait_opc, timeout)
+
+    def clear(self):
+        "Queue a device clear, returns a Future"
+        return self.submit(self.instrument.clear)
+
+    def close(self, wait = True):
+        "Stop the I/O thread after the queued requests"
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.requests.put(None)
+        if wait:
+            self.thread.join()
+
@@ -0,0 +1,613 @@
+"""
+
+Simulated USBTMC devices
+
+SimulatedDevice stands in for a pyusb device: it has one configuration with
+a USB488 interface and bulk-IN, bulk-OUT and interrupt-IN endpoints,
+implements the USBTMC framing, btag and EOM rules and the class control
+requests, and can add a fixed latency per transfer and a bandwidth limit.
+Messages are handed to a SCPI model, Agilent33522A by default:
+
+    from usbtmc import Instrument
+    from usbtmc.simulator import SimulatedDevice
+    instr = Instrument(device = SimulatedDevice(latency = 125e-6, bandwidth = 35e6))
+    instr.ask("*IDN?")
+
+The models are deliberately small: enough SCPI to drive FunctionGenerator
+and time transport and waveform uploads, not an emulation of the
+instrument.
+
+"""
+
+import array
+import collections
+import errno
+import struct
+import threading
+import time
+
+import usb.core
+
+from .usbtmc import (USBTMC_MSGID_DEV_DEP_MSG_OUT, USBTMC_MSGID_REQUEST_DEV_DEP_MSG_IN,
+    USBTMC_MSGID_DEV_DEP_MSG_IN, USB488_MSGID_TRIGGER, USBTMC_STATUS_SUCCESS,
+    USBTMC_STATUS_FAILED, USBTMC_REQUEST_INITIATE_CLEAR, USBTMC_REQUEST_CHECK_CLEAR_STATUS,
+    USBTMC_REQUEST_GET_CAPABILITIES, USBTMC_REQUEST_INDICATOR_PULSE, USB488_READ_STATUS_BYTE,
+    USBTMC_bInterfaceClass, USBTMC_bInterfaceSubClass, USB488_bInterfaceProtocol,
+    monotonic, short_form, unpack_block)
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+def wait(seconds):
+    "Wait precisely: sleep for most of the time, then spin"
+    if seconds <= 0:
+        return
+    deadline = perf_counter() + seconds
+    if seconds > 0.002:
+        time.sleep(seconds - 0.001)
+    while perf_counter() < deadline:
+        pass
+
+def usb_error(message, code):
+    if code == errno.ETIMEDOUT and hasattr(usb.core, 'USBTimeoutError'):
+        return usb.core.USBTimeoutError(message, errno = code)
+    return usb.core.USBError(message, errno = code)
+
+class SimulatedEndpoint(object):
+    "Endpoint of a SimulatedDevice, with the read/write interface of pyusb"
+    def __init__(self, device, bEndpointAddress, bmAttributes, wMaxPacketSize):
+        self.device = device
+        self.bEndpointAddress = bEndpointAddress
+        self.bmAttributes = bmAttributes
+        self.wMaxPacketSize = wMaxPacketSize
+
+    def write(self, data, timeout = None):
+        return self.device.bulk_out(self, data)
+
+    def read(self, size_or_buffer, timeout = None):
+        if self.bmAttributes == usb.ENDPOINT_TYPE_INTERRUPT:
+            data = self.device.interrupt_in(timeout)
+        else:
+            data = self.device.bulk_in(self, size_or_buffer)
+        if isinstance(size_or_buffer, int):
+            return array.array('B', data)
+        n = len(data)
+        size_or_buffer[:n] = array.array('B', data)
+        return n
+
+class SimulatedInterface(object):
+    "USB488 interface of a SimulatedDevice"
+    bInterfaceClass = USBTMC_bInterfaceClass
+    bInterfaceSubClass = USBTMC_bInterfaceSubClass
+    bInterfaceProtocol = USB488_bInterfaceProtocol
+    bInterfaceNumber = 0
+    bAlternateSetting = 0
+    index = 0
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    def set_altsetting(self):
+        pass
+
+class SimulatedConfiguration(object):
+    "Single configuration of a SimulatedDevice"
+    bConfigurationValue = 1
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def __iter__(self):
+        return iter([self.interface])
+
+    def set(self):
+        pass
+
+class SimulatedDevice(object):
+    "Fake pyusb device speaking USBTMC/USB488 to a SCPI model"
+    idVendor = 0x0957
+    idProduct = 0x2307
+    bcdDevice = 0x0100
+    iSerialNumber = 3
+
+    def __init__(self, model = None, latency = 0.0, bandwidth = None,
+                 max_packet = 512, interrupt = True, serial = 'SIM00001',
+                 bus = 0, address = 0):
+        """model is the SCPI model (default Agilent33522A()). Every bulk
+        transfer takes latency seconds plus its size over bandwidth (bytes
+        per second, None for unlimited). interrupt = False leaves out the
+        interrupt endpoint, so the status byte is returned in the control
+        transfer."""
+        self.model = model if model is not None else Agilent33522A()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.serial = serial
+        self.bus = bus
+        self.address = address
+
+        self.bulk_in_ep = SimulatedEndpoint(self, 0x82, usb.ENDPOINT_TYPE_BULK, max_packet)
+        self.bulk_out_ep = SimulatedEndpoint(self, 0x01, usb.ENDPOINT_TYPE_BULK, max_packet)
+        endpoints = [self.bulk_out_ep, self.bulk_in_ep]
+        self.interrupt_in_ep = None
+        if interrupt:
+            self.interrupt_in_ep = SimulatedEndpoint(self, 0x83, usb.ENDPOINT_TYPE_INTERRUPT, 2)
+            endpoints.append(self.interrupt_in_ep)
+        self.cfg = SimulatedConfiguration(SimulatedInterface(endpoints))
+
+        self.lock = threading.Condition()
+        self.message = bytearray()      # DEV_DEP_MSG_OUT payload until EOM
+        self.output = bytearray()       # response not read yet
+        self.request = None             # (btag, size) of REQUEST_DEV_DEP_MSG_IN
+        self.notifications = collections.deque()
+        self.last_stb = 0
+        self.halted = set()
+
+        # counters for benchmarks
+        self.transfers = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def __iter__(self):
+        return iter([self.cfg])
+
+    def is_kernel_driver_active(self, interface):
+        return False
+
+    def detach_kernel_driver(self, interface):
+        pass
+
+    def reset(self):
+        with self.lock:
+            self.message = bytearray()
+            self.output = bytearray()
+            self.request = None
+            self.notifications.clear()
+            self.halted.clear()
+
+    def clear_halt(self, ep):
+        address = ep if isinstance(ep, int) else ep.bEndpointAddress
+        self.halted.discard(address)
+
+    def transfer(self, size):
+        "Account for and wait out one bulk transfer of size bytes"
+        self.transfers += 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(size) / self.bandwidth
+        wait(delay)
+
+    def stall(self, ep, message):
+        self.halted.add(ep.bEndpointAddress)
+        return usb_error(message, errno.EPIPE)
+
+    def bulk_out(self, ep, data):
+        data = bytes(bytearray(data))
+        self.transfer(len(data))
+        self.bytes_out += len(data)
+        with self.lock:
+            if ep.bEndpointAddress in self.halted:
+                raise usb_error("Pipe error", errno.EPIPE)
+            if len(data) < 12 or len(data) % 4:
+                raise self.stall(ep, "Invalid bulk-OUT transfer")
+            msgid, btag, btaginverse = struct.unpack_from('BBB', data)
+            if btag == 0 or btaginverse != ~btag & 0xFF:
+                raise self.stall(ep, "Invalid btag")
+            if msgid == USBTMC_MSGID_DEV_DEP_MSG_OUT:
+                size, attributes = struct.unpack_from('<LB', data, 4)
+                self.message += data[12:12+size]
+                if attributes & 1:
+                    message = bytes(self.message)
+                    self.message = bytearray()
+                    self.output = bytearray(self.model.write(message))
+                    self.check_srq()
+            elif msgid == USBTMC_MSGID_REQUEST_DEV_DEP_MSG_IN:
+                size = struct.unpack_from('<L', data, 4)[0]
+                self.request = (btag, size)
+            elif msgid == USB488_MSGID_TRIGGER:
+                self.model.trigger()
+                self.check_srq()
+            else:
+                raise self.stall(ep, "Unsupported MsgID %d" % msgid)
+            self.lock.notify_all()
+        return len(data)
+
+    def bulk_in(self, ep, size_or_buffer):
+        with self.lock:
+            if ep.bEndpointAddress in self.halted:
+                raise usb_error("Pipe error", errno.EPIPE)
+            if self.request is None or not self.output:
+                # nothing was asked for, a real device lets the read time out
+                self.request = None
+                raise usb_error("Operation timed out", errno.ETIMEDOUT)
+            btag, size = self.request
+            self.request = None
+            if not isinstance(size_or_buffer, int):
+                size_or_buffer = len(size_or_buffer)
+            size = min(size, size_or_buffer - 12)
+            payload = bytes(self.output[:size])
+            del self.output[:size]
+            eom = 0 if self.output else 1
+        data = struct.pack('<BBBxLBxxx', USBTMC_MSGID_DEV_DEP_MSG_IN, btag,
+                           ~btag & 0xFF, len(payload), eom) + payload
+        data += b'\0' * (-len(data) % 4)
+        self.transfer(len(data))
+        self.bytes_in += len(data)
+        return data
+
+    def interrupt_in(self, timeout = None):
+        deadline = None if timeout is None else monotonic() + timeout / 1000.0
+        with self.lock:
+            while not self.notifications:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise usb_error("Operation timed out", errno.ETIMEDOUT)
+                self.lock.wait(remaining)
+            return self.notifications.popleft()
+
+    def check_srq(self):
+        "Queue an SRQ notification when the status byte starts requesting service"
+        stb = self.model.status_byte()
+        if stb & 0x40 and not self.last_stb & 0x40 and self.interrupt_in_ep is not None:
+            self.notifications.append(struct.pack('BB', 0x81, stb))
+        self.last_stb = stb
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        if bmRequestType & 0x60 == 0:
+            # standard GET_STATUS of the device or an endpoint
+            if bRequest == 0:
+                halted = bmRequestType & 0x1F == 2 and wIndex in self.halted
+                return array.array('B', [1 if halted else 0, 0])
+            if bRequest == 6:
+                raise usb_error("String descriptors are not simulated", errno.EPIPE)
+            return array.array('B')
+        if bRequest == USBTMC_REQUEST_GET_CAPABILITIES:
+            b = [USBTMC_STATUS_SUCCESS, 0, 0x00, 0x01, 0x04, 0x00] + [0] * 18
+            b[12:16] = [0x00, 0x01, 0x07, 0x0F]
+            return array.array('B', b)
+        if bRequest == USB488_READ_STATUS_BYTE:
+            with self.lock:
+                stb = self.model.status_byte()
+                if self.interrupt_in_ep is None:
+                    return array.array('B', [USBTMC_STATUS_SUCCESS, wValue, stb])
+                self.notifications.append(struct.pack('BB', 0x80 | wValue, stb))
+                self.lock.notify_all()
+            return array.array('B', [USBTMC_STATUS_SUCCESS, wValue, 0])
+        if bRequest == USBTMC_REQUEST_INITIATE_CLEAR:
+            with self.lock:
+                self.message = bytearray()
+                self.output = bytearray()
+                self.request = None
+            return array.array('B', [USBTMC_STATUS_SUCCESS])
+        if bRequest == USBTMC_REQUEST_CHECK_CLEAR_STATUS:
+            return array.array('B', [USBTMC_STATUS_SUCCESS, 0])
+        if bRequest == USBTMC_REQUEST_INDICATOR_PULSE:
+            return array.array('B', [USBTMC_STATUS_SUCCESS])
+        return array.array('B', [USBTMC_STATUS_FAILED])
+
+def split_program(message):
+    """Split a program message into commands at ';' and newlines. Quoted
+    strings and definite length blocks (which may contain any byte) are
+    kept intact; whitespace around commands is stripped, but never from
+    block data."""
+    commands = []
+    start = i = 0
+    keep = 0    # end of the last block, nothing before it is stripped
+    n = len(message)
+    while i < n:
+        c = message[i:i+1]
+        if c in (b'"', b"'"):
+            i = message.find(c, i+1)
+            while i >= 0 and message[i+1:i+2] == c:
+                i = message.find(c, i+2)
+            i = n if i < 0 else i+1
+        elif c == b'#' and message[i+1:i+2].isdigit():
+            digits = int(message[i+1:i+2])
+            if digits == 0:
+                i = n
+            else:
+                i += 2 + digits + int(message[i+2:i+2+digits])
+            keep = i = min(i, n)
+        elif c in (b';', b'\n'):
+            commands.append(strip_command(message, start, i, keep))
+            start = i = i+1
+        else:
+            i += 1
+    commands.append(strip_command(message, start, n, keep))
+    return commands
+
+def strip_command(message, start, end, keep):
+    keep = min(max(start, keep), end)
+    return (message[start:keep] + message[keep:end].rstrip()).lstrip()
+
+class SCPIError(Exception):
+    "Error queued by a SCPI model, code and message as in SYST:ERR?"
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+class SCPIModel(object):
+    """Base of the simulated instruments: IEEE 488.2 status reporting, the
+    common commands and an error queue. Subclasses map canonical headers
+    (short form, ':' joined, e.g. 'SOUR1:FREQ') to handlers in
+    self.commands; a handler gets the header and its parameter bytes and
+    returns the response string of a query, or None."""
+    idn = 'Simulated,SCPI,0,0'
+
+    def __init__(self):
+        self.esr = 0
+        self.ese = 0
+        self.sre = 0
+        self.errors = collections.deque()
+        self.commands = {
+            '*IDN?': lambda h, p: self.idn,
+            '*RST': lambda h, p: self.reset(),
+            '*CLS': lambda h, p: self.clear_status(),
+            '*OPC': lambda h, p: self.set_esr(0x01),
+            '*OPC?': lambda h, p: '1',
+            '*WAI': lambda h, p: None,
+            '*TRG': lambda h, p: self.trigger(),
+            '*ESR?': lambda h, p: str(self.read_esr()),
+            '*ESE': lambda h, p: setattr(self, 'ese', int(p)),
+            '*ESE?': lambda h, p: str(self.ese),
+            '*SRE': lambda h, p: setattr(self, 'sre', int(p) & 0xBF),
+            '*SRE?': lambda h, p: str(self.sre),
+            '*STB?': lambda h, p: str(self.status_byte()),
+            'SYST:ERR?': lambda h, p: self.next_error(),
+        }
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def trigger(self):
+        pass
+
+    def clear_status(self):
+        self.esr = 0
+        self.errors.clear()
+
+    def set_esr(self, bits):
+        self.esr |= bits
+
+    def read_esr(self):
+        esr, self.esr = self.esr, 0
+        return esr
+
+    def error(self, code, message):
+        self.errors.append('%+d,"%s"' % (code, message))
+        if -199 <= code <= -100:
+            self.set_esr(0x20)
+        elif -299 <= code <= -200:
+            self.set_esr(0x10)
+        elif -499 <= code <= -400:
+            self.set_esr(0x04)
+        else:
+            self.set_esr(0x08)
+
+    def next_error(self):
+        if self.errors:
+            return self.errors.popleft()
+        return '+0,"No error"'
+
+    def status_byte(self):
+        stb = 0
+        if self.errors:
+            stb |= 0x04
+        if self.esr & self.ese:
+            stb |= 0x20
+        if stb & self.sre:
+            stb |= 0x40
+        return stb
+
+    def canonical(self, header, path):
+        "Canonical header of a command and the path later commands are relative to"
+        query = header.endswith('?')
+        header = header.rstrip('?').upper()
+        if header.startswith('*'):
+            return header + ('?' if query else ''), path
+        if header.startswith(':'):
+            path = []
+        keywords = path + [short_form(k) for k in header.lstrip(':').split(':')]
+        return self.resolve(keywords) + ('?' if query else ''), keywords[:-1]
+
+    def resolve(self, keywords):
+        "Hook to expand implied keywords, e.g. a default channel"
+        return ':'.join(keywords)
+
+    def write(self, message):
+        "Execute a program message, returns the response message bytes"
+        responses = []
+        path = []
+        for command in split_program(message):
+            if not command:
+                continue
+            parts = command.split(None, 1)
+            header = parts[0].decode('ascii', 'replace')
+            params = parts[1] if len(parts) > 1 else b''
+            header, path = self.canonical(header, path)
+            handler = self.commands.get(header)
+            try:
+                if handler is None:
+                    handler = self.default_handler(header)
+                result = handler(header, params)
+            except SCPIError as e:
+                self.error(e.code, str(e))
+                continue
+            except (ValueError, IndexError):
+                self.error(-224, "Illegal parameter value")
+                continue
+            if header.endswith('?') and result is not None:
+                responses.append(result)
+        if not responses:
+            return b''
+        return b';'.join(r if isinstance(r, bytes) else r.encode('ascii')
+                         for r in responses) + b'\n'
+
+    def default_handler(self, header):
+        raise SCPIError(-113, "Undefined header")
+
+def number(text):
+    "Parse a numeric parameter, with the MIN/MAX/DEF keywords left to the caller"
+    return float(text.strip().split()[0])
+
+class Agilent33522A(SCPIModel):
+    """SCPI model of an Agilent 33522A: APPLy, output state, FUNCtion,
+    FORMat:BORDer, DATA:DAC / DATA:ARB:DAC uploads (ASCII or binary
+    blocks) into volatile memory, DATA:VOLatile:FREE?/CLEar and generic
+    settings nodes that are stored and read back."""
+    idn = 'Agilent Technologies,33522A,SIM00001,2.00-1.19-2.00-52-00'
+    volatile_size = 65536  # points of volatile arbitrary waveform memory
+    dac_range = (-32767, 32767)
+    channels = 2
+
+    def __init__(self):
+        SCPIModel.__init__(self)
+        self.commands.update({
+            'FORM:BORD': self.set_byte_order,
+            'FORM:BORD?': lambda h, p: self.byte_order,
+            'DATA:DAC': self.load_dac,
+            'DATA:ARB:DAC': self.load_dac,
+            'DATA:VOL:FREE?': lambda h, p: '+%d' % self.volatile_free(),
+            'DATA:VOL:CLE': lambda h, p: self.clear_volatile(),
+            'DATA:VOL:CAT?': lambda h, p: ','.join('"%s"' % n for n in self.waveforms),
+            'MMEM:LOAD:STAT': lambda h, p: self.reset(),
+            'SYST:PRES': lambda h, p: self.reset(),
+        })
+        for ch in range(1, self.channels + 1):
+            self.commands.update({
+                'SOUR%d:APPL:SIN' % ch: self.apply,
+                'SOUR%d:APPL:SQU' % ch: self.apply,
+                'SOUR%d:APPL:RAMP' % ch: self.apply,
+                'SOUR%d:APPL:PULS' % ch: self.apply,
+                'SOUR%d:APPL:NOIS' % ch: self.apply,
+                'SOUR%d:APPL:DC' % ch: self.apply,
+                'SOUR%d:APPL:ARB' % ch: self.apply,
+                'SOUR%d:APPL?' % ch: self.applied,
+                'SOUR%d:FUNC:ARB' % ch: self.select_arb,
+                'OUTP%d' % ch: self.set_output,
+                'OUTP%d?' % ch: lambda h, p: self.settings.get(h[:-1], '0'),
+            })
+
+    def reset(self):
+        self.settings = {}
+        self.waveforms = collections.OrderedDict()
+        self.byte_order = 'NORM'
+        for ch in range(1, self.channels + 1):
+            source = 'SOUR%d' % ch
+            self.settings.update({
+                source + ':FUNC': 'SIN',
+                source + ':FREQ': 1000.0,
+                source + ':VOLT': 0.1,
+                source + ':VOLT:OFFS': 0.0,
+                source + ':FUNC:ARB': '"INT:\\BUILTIN\\EXP_RISE.ARB"',
+                'OUTP%d' % ch: '0',
+            })
+
+    def resolve(self, keywords):
+        # SOURce subsystem keywords without a SOUR node mean channel 1, as do
+        # OUTP and SOUR without a suffix
+        root = keywords[0]
+        if root in ('SOUR', 'OUTP', 'TRIG'):
+            keywords = [root + '1'] + keywords[1:]
+        elif root in ('APPL', 'FUNC', 'FREQ', 'VOLT', 'BURS', 'AM', 'FM',
+                      'PM', 'FSK', 'SWE', 'PHAS', 'PULS', 'MARK', 'SUM',
+                      'TRAC', 'BPSK', 'RAT'):
+            keywords = ['SOUR1'] + keywords
+        return ':'.join(keywords)
+
+    def default_handler(self, header):
+        # generic settings nodes: store what is written and read it back
+        if header.endswith('?'):
+            node = header[:-1]
+            if node not in self.settings:
+                raise SCPIError(-113, "Undefined header")
+            return lambda h, p: self.format(self.settings[node])
+        def store(h, p):
+            if not p:
+                raise SCPIError(-109, "Missing parameter")
+            text = p.decode('ascii', 'replace').strip()
+            if h.endswith(':SHAP'):
+                # the 33220A spelling of FUNCtion
+                h = h[:-5]
+            try:
+                self.settings[h] = number(text)
+            except ValueError:
+                self.settings[h] = short_form(text.upper()) if text[:1] not in '"\'' else text
+        return store
+
+    def format(self, value):
+        if isinstance(value, float):
+            return '%+.15E' % value
+        return value
+
+    def set_output(self, header, params):
+        value = params.strip().upper()
+        if value not in (b'ON', b'OFF', b'1', b'0'):
+            raise SCPIError(-224, "Illegal parameter value")
+        self.settings[header] = '1' if value in (b'ON', b'1') else '0'
+
+    def apply(self, header, params):
+        source, function = header.split(':')[0], header.split(':')[-1]
+        values = [v for v in params.decode('ascii').split(',') if v.strip()]
+        self.settings[source + ':FUNC'] = function
+        for node, value in zip((':FREQ', ':VOLT', ':VOLT:OFFS'), values):
+            if value.strip().upper() not in ('DEF', 'MIN', 'MAX'):
+                self.settings[source + node] = number(value)
+        self.settings['OUTP' + source[4:]] = '1'
+
+    def applied(self, header, params):
+        source = header.split(':')[0]
+        return '"%s %s,%s,%s"' % (self.settings[source + ':FUNC'],
+                                  self.format(self.settings[source + ':FREQ']),
+                                  self.format(self.settings[source + ':VOLT']),
+                                  self.format(self.settings[source + ':VOLT:OFFS']))
+
+    def set_byte_order(self, header, params):
+        value = short_form(params.strip().upper().decode('ascii'))
+        if value not in ('NORM', 'SWAP'):
+            raise SCPIError(-224, "Illegal parameter value")
+        self.byte_order = value
+
+    def volatile_free(self):
+        return self.volatile_size - sum(len(w) for w in self.waveforms.values())
+
+    def clear_volatile(self):
+        self.waveforms.clear()
+
+    def load_dac(self, header, params):
+        name, sep, data = params.partition(b',')
+        name = name.strip().decode('ascii').upper()
+        data = data.lstrip()
+        if not sep or not data:
+            raise SCPIError(-109, "Missing parameter")
+        if data[:1] == b'#':
+            block = unpack_block(data)
+            if len(block) % 2:
+                raise SCPIError(-161, "Invalid block data")
+            points = array.array('h', block)
+            if (self.byte_order == 'SWAP') != (struct.pack('=h', 1) == struct.pack('<h', 1)):
+                # block is big endian (NORM) on a little endian host or vice versa
+                points.byteswap()
+        else:
+            points = array.array('h', [int(v) for v in data.split(b',')])
+        if not 8 <= len(points) <= self.volatile_size:
+            raise SCPIError(-222, "Data out of range")
+        if min(points) < self.dac_range[0] or max(points) > self.dac_range[1]:
+            raise SCPIError(-222, "Data out of range")
+        used = len(self.waveforms.get(name, ()))
+        if len(points) - used > self.volatile_free():
+            raise SCPIError(781, "Not enough free memory")
+        self.waveforms[name] = points
+
+    def select_arb(self, header, params):
+        name = params.strip().decode('ascii').strip('"\'').upper()
+        if name not in self.waveforms and not name.startswith('INT:'):
+            raise SCPIError(-224, "Illegal parameter value")
+        self.settings[header] = name
+
@@ -0,0 +1,390 @@
+"""
+
+Record and replay USBTMC sessions
+
+Instrument.start_recording(path) logs every transfer of a live instrument to
+a compact binary trace; ReplayDevice serves the recorded responses to a new
+Instrument, with the original or scaled device timing, so that a
+production session can be profiled and reworked offline:
+
+    instr = Instrument(device = ReplayDevice('session.trace', scale = 1.0))
+
+The trace starts with a header (magic, version, idVendor, idProduct,
+wall clock start time and the GET_CAPABILITIES response) followed by
+records: the '<dfBBBBLL' fields time since the start of the recording
+(monotonic clock), duration of the transfer, kind, flags, MsgID and btag of
+the USBTMC header, transfer size, and the number of stored bytes that
+follow. Bulk-OUT payloads larger than hash_threshold are stored as their
+12 byte header plus SHA-1 digest; everything the device sent is stored in
+full. The LeCroy ActiveDSO command path of Oscilloscope is recorded in the
+same format (DSO_WRITE/DSO_READ records) and replayed by ReplayDSO.
+
+Run "python -m usbtmc.trace session.trace" for a per-kind summary.
+
+"""
+
+import array
+import collections
+import hashlib
+import struct
+import sys
+import threading
+import time
+
+import usb.core
+
+from .simulator import SimulatedDevice, usb_error, wait
+from .usbtmc import (USBTMC_MSGID_REQUEST_DEV_DEP_MSG_IN, USBTMC_REQUEST_GET_CAPABILITIES,
+    USBTMC_REQUEST_INDICATOR_PULSE, USB488_READ_STATUS_BYTE, innermost, remove_layer)
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:
+    perf_counter = time.time
+
+MAGIC = b'USBTMCTR'
+VERSION = 1
+
+HEADER = struct.Struct('<8sBxHHd24s')
+RECORD = struct.Struct('<dfBBBBLL')
+CONTROL = struct.Struct('<BBHHH')     # setup packet in front of control payloads
+
+# record kinds
+BULK_OUT     = 1
+BULK_IN      = 2
+INTERRUPT_IN = 3
+CONTROL_IN   = 4
+DSO_WRITE    = 5
+DSO_READ     = 6
+
+KIND_NAMES = {BULK_OUT: 'bulk_out', BULK_IN: 'bulk_in', INTERRUPT_IN: 'interrupt_in',
+              CONTROL_IN: 'control', DSO_WRITE: 'dso_write', DSO_READ: 'dso_read'}
+
+# record flags
+HASHED = 1      # payload is the transfer header and the SHA-1 of the transfer
+ERROR  = 2      # the transfer failed, payload is '<i' errno
+
+Record = collections.namedtuple('Record', 'time duration kind flags msgid btag size payload')
+
+class ReplayError(Exception):
+    "The replayed session diverged from the recorded one"
+    pass
+
+class TraceWriter(object):
+    "Writes trace records to a file, thread-safe"
+    def __init__(self, path, idVendor = 0, idProduct = 0, capabilities = b'',
+                 hash_threshold = 4096):
+        self.hash_threshold = hash_threshold
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, idVendor, idProduct, time.time(),
+                                    bytes(bytearray(capabilities))))
+        self.start = perf_counter()
+
+    def record(self, kind, start, duration, data = b'', error = None):
+        "Append a record for a transfer that started at perf_counter() start"
+        data = bytes(bytearray(data)) if not isinstance(data, bytes) else data
+        flags = 0
+        msgid = btag = 0
+        if kind in (BULK_OUT, BULK_IN) and len(data) >= 2:
+            msgid, btag = struct.unpack_from('BB', data)
+        size = len(data)
+        if error is not None:
+            flags |= ERROR
+            data = struct.pack('<i', getattr(error, 'errno', None) or 0)
+        elif kind == BULK_OUT and size > self.hash_threshold:
+            flags |= HASHED
+            data = data[:12] + hashlib.sha1(data).digest()
+        with self.lock:
+            self.file.write(RECORD.pack(start - self.start, duration, kind, flags,
+                                        msgid, btag, size, len(data)))
+            self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_trace(path):
+    "Return (header dict, list of Records) of a trace file"
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, idVendor, idProduct, started, capabilities = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ReplayError("Not a version %d USBTMC trace" % VERSION)
+    header = dict(idVendor = idVendor, idProduct = idProduct, started = started,
+                  capabilities = capabilities)
+    records = []
+    offset = HEADER.size
+    while offset < len(data):
+        fields = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        stored = fields[-1]
+        records.append(Record(*(fields[:-1] + (data[offset:offset+stored],))))
+        offset += stored
+    return header, records
+
+class RecordingEndpoint(object):
+    "Endpoint proxy logging every transfer to a TraceWriter"
+    def __init__(self, ep, writer, kind):
+        self.ep = ep
+        self.writer = writer
+        self.kind = kind
+
+    def __getattr__(self, name):
+        return getattr(self.ep, name)
+
+    def write(self, data, timeout = None):
+        start = perf_counter()
+        try:
+            result = self.ep.write(data, timeout)
+        except usb.core.USBError as e:
+            self.writer.record(self.kind, start, perf_counter() - start, error = e)
+            raise
+        self.writer.record(self.kind, start, perf_counter() - start, data)
+        return result
+
+    def read(self, size_or_buffer, timeout = None):
+        start = perf_counter()
+        try:
+            result = self.ep.read(size_or_buffer, timeout)
+        except usb.core.USBError as e:
+            self.writer.record(self.kind, start, perf_counter() - start, error = e)
+            raise
+        if isinstance(result, int):
+            data = memoryview(size_or_buffer)[:result]
+        else:
+            data = result
+        self.writer.record(self.kind, start, perf_counter() - start, data)
+        return result
+
+class RecordingDevice(object):
+    "Device proxy logging control transfers to a TraceWriter"
+    def __init__(self, device, writer):
+        self.device = device
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def __iter__(self):
+        return iter(self.device)
+
+    def clear_halt(self, ep):
+        return self.device.clear_halt(innermost(ep, 'ep'))
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        setup = CONTROL.pack(bmRequestType, bRequest, wValue, wIndex,
+                             data_or_wLength if isinstance(data_or_wLength, int) else 0)
+        start = perf_counter()
+        try:
+            b = self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex,
+                                          data_or_wLength, timeout)
+        except usb.core.USBError as e:
+            self.writer.record(CONTROL_IN, start, perf_counter() - start, error = e)
+            raise
+        response = b'' if isinstance(b, int) else bytes(bytearray(b))
+        self.writer.record(CONTROL_IN, start, perf_counter() - start, setup + response)
+        return b
+
+class RecordingDSO(object):
+    "LeCroy ActiveDSO control proxy logging WriteString and ReadString"
+    def __init__(self, dso, writer):
+        self.dso = dso
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.dso, name)
+
+    def WriteString(self, command, eoi):
+        start = perf_counter()
+        result = self.dso.WriteString(command, eoi)
+        self.writer.record(DSO_WRITE, start, perf_counter() - start,
+                           command.encode('latin-1'))
+        return result
+
+    def ReadString(self, count):
+        start = perf_counter()
+        data = self.dso.ReadString(count)
+        self.writer.record(DSO_READ, start, perf_counter() - start,
+                           data.encode('latin-1'))
+        return data
+
+def start_recording(instrument, path, hash_threshold = 4096):
+    "Install recording proxies on an Instrument, see Instrument.start_recording"
+    stop_recording(instrument)
+    capabilities = instrument.get_capabilities()
+    writer = TraceWriter(path, instrument.device.idVendor, instrument.device.idProduct,
+                         capabilities, hash_threshold)
+    instrument.recorder = writer
+    instrument.device = RecordingDevice(instrument.device, writer)
+    instrument.bulk_out_ep = RecordingEndpoint(instrument.bulk_out_ep, writer, BULK_OUT)
+    instrument.bulk_in_ep = RecordingEndpoint(instrument.bulk_in_ep, writer, BULK_IN)
+    if instrument.interrupt_in_ep is not None:
+        instrument.interrupt_in_ep = RecordingEndpoint(instrument.interrupt_in_ep, writer,
+                                                       INTERRUPT_IN)
+
+def stop_recording(instrument):
+    """Remove the proxies installed by start_recording() and close the trace.
+    Other proxies (e.g. usbtmc.metrics) stay in place, whichever order they
+    were installed in."""
+    if instrument.recorder is None:
+        return
+    instrument.device = remove_layer(instrument.device, 'device', RecordingDevice)
+    for name in ('bulk_out_ep', 'bulk_in_ep', 'interrupt_in_ep'):
+        ep = getattr(instrument, name)
+        if ep is not None:
+            setattr(instrument, name, remove_layer(ep, 'ep', RecordingEndpoint))
+    instrument.recorder.close()
+    instrument.recorder = None
+
+class Replay(object):
+    "Recorded transfers of a trace, consumed in order per kind"
+    def __init__(self, path, scale = 1.0, strict = False):
+        self.header, records = read_trace(path)
+        self.scale = scale
+        self.strict = strict
+        self.queues = collections.defaultdict(collections.deque)
+        for record in records:
+            self.queues[record.kind].append(record)
+        self.mismatches = 0
+
+    def next(self, kind):
+        "Pop the next record of a kind and wait out its scaled duration"
+        queue = self.queues[kind]
+        if not queue:
+            raise ReplayError("Trace has no more %s records" % KIND_NAMES[kind])
+        record = queue.popleft()
+        if self.scale:
+            wait(record.duration * self.scale)
+        if record.flags & ERROR:
+            code = struct.unpack('<i', record.payload)[0]
+            raise usb_error("Replayed error", code)
+        return record
+
+    def mismatch(self, message):
+        self.mismatches += 1
+        if self.strict:
+            raise ReplayError(message)
+
+class ReplayDevice(SimulatedDevice):
+    """Device answering like a recorded one. Bulk-IN transfers, interrupt
+    notifications and class control requests return the recorded data in
+    order, re-tagged with the btag of the current request; the device
+    waits the recorded transfer durations times scale (0 for no waiting).
+    Bulk-OUT transfers are compared with the recording (ignoring btags):
+    differences are counted in mismatches, or raise ReplayError if
+    strict."""
+    def __init__(self, path, scale = 1.0, strict = False):
+        SimulatedDevice.__init__(self)
+        self.replay = Replay(path, scale, strict)
+        header = self.replay.header
+        self.idVendor = header['idVendor']
+        self.idProduct = header['idProduct']
+        self.capabilities = header['capabilities']
+        self.status_tag = None
+        if not self.replay.queues[INTERRUPT_IN]:
+            self.interrupt_in_ep = None
+            self.cfg.interface.endpoints = [self.bulk_out_ep, self.bulk_in_ep]
+
+    @property
+    def mismatches(self):
+        return self.replay.mismatches
+
+    def bulk_out(self, ep, data):
+        data = bytes(bytearray(data))
+        record = self.replay.next(BULK_OUT)
+        if record.flags & HASHED:
+            retagged = (data[:1] + struct.pack('BB', record.btag, ~record.btag & 0xFF) +
+                        data[3:])
+            same = record.payload[12:] == hashlib.sha1(retagged).digest()
+        else:
+            same = record.payload[:1] + record.payload[3:] == data[:1] + data[3:]
+        if not same:
+            self.replay.mismatch("Bulk-OUT transfer differs from the recording")
+        msgid, btag = struct.unpack_from('BB', data)
+        if msgid == USBTMC_MSGID_REQUEST_DEV_DEP_MSG_IN:
+            self.request = btag
+        return len(data)
+
+    def bulk_in(self, ep, size_or_buffer):
+        record = self.replay.next(BULK_IN)
+        btag = self.request if self.request is not None else record.btag
+        self.request = None
+        data = record.payload
+        return data[:1] + struct.pack('BB', btag, ~btag & 0xFF) + data[3:]
+
+    def interrupt_in(self, timeout = None):
+        data = self.replay.next(INTERRUPT_IN).payload
+        if data[:1] != b'\x81' and self.status_tag is not None:
+            # READ_STATUS_BYTE response, carries the btag of the request
+            data = struct.pack('B', 0x80 | self.status_tag) + data[1:]
+        return data
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        if bmRequestType & 0x60 == 0 or bRequest == USBTMC_REQUEST_INDICATOR_PULSE:
+            return SimulatedDevice.ctrl_transfer(self, bmRequestType, bRequest, wValue,
+                                                 wIndex, data_or_wLength, timeout)
+        if bRequest == USBTMC_REQUEST_GET_CAPABILITIES:
+            return array.array('B', self.capabilities)
+        while True:
+            record = self.replay.next(CONTROL_IN)
+            setup = CONTROL.unpack_from(record.payload)
+            if setup[1] == bRequest:
+                break
+            if setup[0] & 0x60 and setup[1] != USBTMC_REQUEST_GET_CAPABILITIES:
+                self.replay.mismatch("Control request %d, recorded %d" % (bRequest, setup[1]))
+        b = array.array('B', record.payload[CONTROL.size:])
+        if bRequest == USB488_READ_STATUS_BYTE:
+            self.status_tag = wValue
+            if len(b) >= 2:
+                b[1] = wValue
+        return b
+
+class ReplayDSO(object):
+    "LeCroy ActiveDSO control answering ReadString from a recorded trace"
+    def __init__(self, path, scale = 1.0, strict = False):
+        self.replay = Replay(path, scale, strict)
+
+    @property
+    def mismatches(self):
+        return self.replay.mismatches
+
+    def MakeConnection(self, address):
+        return True
+
+    def Disconnect(self):
+        return True
+
+    def SetTimeout(self, seconds):
+        return True
+
+    def WriteString(self, command, eoi):
+        record = self.replay.next(DSO_WRITE)
+        if record.payload != command.encode('latin-1'):
+            self.replay.mismatch("Command %r, recorded %r" % (command, record.payload))
+        return True
+
+    def ReadString(self, count):
+        return self.replay.next(DSO_READ).payload.decode('latin-1')
+
+def summarize(path):
+    "Per-kind transfer counts, bytes and device time of a trace, as text"
+    header, records = read_trace(path)
+    lines = ["%s: %04x:%04x, %d records, %.3f s" % (
+        path, header['idVendor'], header['idProduct'], len(records),
+        records[-1].time + records[-1].duration if records else 0.0)]
+    lines.append("%-14s %8s %12s %12s %8s" % ('kind', 'count', 'bytes', 'device s', 'errors'))
+    for kind in sorted(KIND_NAMES):
+        rs = [r for r in records if r.kind == kind]
+        if rs:
+            lines.append("%-14s %8d %12d %12.6f %8d" % (
+                KIND_NAMES[kind], len(rs), sum(r.size for r in rs),
+                sum(r.duration for r in rs), sum(1 for r in rs if r.flags & ERROR)))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(summarize(path))
+
@@ -26,10 +26,22 @@ THE SOFTWARE.
 
 import usb.core
 import usb.util
+import array
 import struct
 import time
 import os
 import re
+import contextlib
+import threading
+import json
+import tempfile
+import errno
+import functools
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
 
 # constants
 USBTMC_bInterfaceClass    = 0xFE
@@ -67,15 +79,35 @@ USB488_REN_CONTROL      = 160
 USB488_GOTO_LOCAL       = 161
 USB488_LOCAL_LOCKOUT    = 162
 
+# USB488 TRIGGER transfers indexed by btag, packed once so that trigger()
+# only has to pick one
+USB488_TRIGGER_PACKETS = [None] + [struct.pack('BBBx8x', USB488_MSGID_TRIGGER, btag, ~btag & 0xFF)
+                                   for btag in range(1, 256)]
+
+# seconds a device found by find_device(), or a serial number read by
+# get_serial(), is reused; bus addresses are reused after replugging
+DEVICE_CACHE_TTL = 60.0
+
+# (idVendor, idProduct, iSerial) -> (monotonic() time found, device)
+device_cache = {}
+
+# (bus, address) -> (monotonic() time read, serial number string)
+serial_cache = {}
+
+# capabilities of devices opened with fast_connect, keyed by vid:pid:serial
+CAPABILITY_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'usbtmc', 'capabilities.json')
+
+# valid resource strings:
+# USB::1234::5678::INSTR
+# USB::1234::5678::SERIAL::INSTR
+# USB0::0x1234::0x5678::INSTR
+# USB0::0x1234::0x5678::SERIAL::INSTR
+VISA_RESOURCE_RE = re.compile(r'^(?P<prefix>(?P<type>USB)\d*)(::(?P<arg1>[^\s:]+))'
+    r'(::(?P<arg2>[^\s:]+(\[.+\])?))(::(?P<arg3>[^\s:]+))?'
+    r'(::(?P<suffix>INSTR))$', re.I)
+
 def parse_visa_resource_string(resource_string):
-    # valid resource strings:
-    # USB::1234::5678::INSTR
-    # USB::1234::5678::SERIAL::INSTR
-    # USB0::0x1234::0x5678::INSTR
-    # USB0::0x1234::0x5678::SERIAL::INSTR
-    m = re.match('^(?P<prefix>(?P<type>USB)\d*)(::(?P<arg1>[^\s:]+))'
-        '(::(?P<arg2>[^\s:]+(\[.+\])?))(::(?P<arg3>[^\s:]+))?'
-        '(::(?P<suffix>INSTR))$', resource_string, re.I)
+    m = VISA_RESOURCE_RE.match(resource_string)
 
     if m is not None:
         return dict(
@@ -87,6 +119,154 @@ def parse_visa_resource_string(resource_string):
             suffix = m.group('suffix')
         )
 
+def pack_block_header(length):
+    "Build IEEE 488.2 definite length block header (#<n><len>)"
+    s = str(length)
+    return ('#%d%s' % (len(s), s)).encode('ascii')
+
+def unpack_block(data):
+    "Return the payload of an IEEE 488.2 definite or indefinite length block"
+    digits = int(data[1:2])
+    if digits == 0:
+        return data[2:].rstrip(b'\r\n')
+    length = int(data[2:2+digits])
+    return data[2+digits:2+digits+length]
+
+def split_response(data):
+    """Split a ';' separated response to several queries into fields.
+    Quoted strings and definite length blocks (which may contain ';') are
+    kept intact, block fields keep their #<n><len> header."""
+    fields = []
+    start = 0
+    i = 0
+    n = len(data)
+    while i < n:
+        c = data[i:i+1]
+        if c in (b'"', b"'"):
+            # skip quoted string, a doubled quote is an escaped quote
+            i = data.find(c, i+1)
+            while i >= 0 and data[i+1:i+2] == c:
+                i = data.find(c, i+2)
+            i = n if i < 0 else i+1
+        elif c == b'#' and data[i+1:i+2].isdigit():
+            digits = int(data[i+1:i+2])
+            if digits == 0:
+                i = n
+            else:
+                i += 2 + digits + int(data[i+2:i+2+digits])
+        elif c == b';':
+            fields.append(data[start:i])
+            start = i = i+1
+        else:
+            i += 1
+    fields.append(data[start:])
+    return [f if f[:1] == b'#' else f.strip() for f in fields]
+
+def backoff(timeout, initial = 0.001, maximum = 0.1):
+    """Generator for polling loops: yields, then sleeps with exponentially
+    growing delays (initial to maximum seconds) until timeout seconds have
+    passed, when it stops"""
+    deadline = monotonic() + timeout
+    delay = initial
+    while True:
+        yield
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, maximum)
+
+def is_timeout(e):
+    "Check if a USBError is a timeout"
+    return isinstance(e, getattr(usb.core, 'USBTimeoutError', ())) or \
+        getattr(e, 'errno', None) == errno.ETIMEDOUT
+
+def remove_layer(top, link, layer_type):
+    """Remove the first proxy of layer_type from a chain of proxies, each
+    holding the object it wraps in attribute link (e.g. 'ep' or 'device').
+    Return the new top of the chain; raise ValueError if there is no such
+    proxy, rather than removing someone else's."""
+    if isinstance(top, layer_type):
+        return top.__dict__[link]
+    layer = top
+    while link in getattr(layer, '__dict__', {}):
+        inner = layer.__dict__[link]
+        if isinstance(inner, layer_type):
+            setattr(layer, link, inner.__dict__[link])
+            return top
+        layer = inner
+    raise ValueError("No %s in the proxy chain" % layer_type.__name__)
+
+def remove_wrapper(obj, name, owner):
+    """Remove the method wrapper installed by owner as instance attribute
+    name of obj. Wrappers keep the callable they wrap in .wrapped and call
+    it through that attribute, and record who installed them in
+    .installed_by, so one in the middle of a chain of wrappers (metrics
+    under a tracer, say) can be taken out without touching the others."""
+    top = obj.__dict__.get(name)
+    layer = None
+    inner = top
+    while inner is not None and getattr(inner, 'installed_by', None) is not owner:
+        layer = inner
+        inner = getattr(inner, 'wrapped', None)
+    if inner is None:
+        return
+    if layer is not None:
+        layer.wrapped = inner.wrapped
+    elif getattr(inner.wrapped, '__self__', None) is obj:
+        # back to the class method
+        del obj.__dict__[name]
+    else:
+        setattr(obj, name, inner.wrapped)
+
+def innermost(obj, link):
+    "The object at the bottom of a chain of proxies linked by attribute link"
+    while link in getattr(obj, '__dict__', {}):
+        obj = obj.__dict__[link]
+    return obj
+
+KEYWORD_RE = re.compile(r'^([A-Z]+)(\d*)$')
+
+def short_form(keyword):
+    """SCPI short form of an upper case keyword, keeping its numeric suffix:
+    the first four letters, or three if the fourth is a vowel"""
+    m = KEYWORD_RE.match(keyword)
+    if m is None:
+        return keyword
+    word, suffix = m.groups()
+    if len(word) > 4:
+        word = word[:3] if word[3] in 'AEIOU' else word[:4]
+    return word + suffix
+
+def join_commands(commands, max_size, root_reset = True):
+    """Join encoded SCPI commands into as few ';' separated messages as fit
+    in max_size bytes. Unless root_reset is False, each joined command
+    except common (*) commands is prefixed with ':' so that it is parsed
+    from the SCPI root."""
+    messages = []
+    message = b''
+    for cmd in commands:
+        if message:
+            sep = b';' if cmd[:1] in (b'*', b':') or not root_reset else b';:'
+            if len(message) + len(sep) + len(cmd) <= max_size:
+                message += sep + cmd
+                continue
+            messages.append(message)
+        message = cmd
+    if message:
+        messages.append(message)
+    return messages
+
+def transaction(func):
+    """Decorator for Instrument methods that talk to the device: the call
+    holds the instrument's io_lock, so a transaction (e.g. the write and
+    read of ask) is never interleaved with one from another thread"""
+    @functools.wraps(func)
+    def locked(self, *args, **kwargs):
+        with self.io_lock:
+            return func(self, *args, **kwargs)
+    return locked
+
 # Exceptions
 class UsbtmcException(Exception):
     em = {0:  "No error"}
@@ -124,34 +304,123 @@ def list_devices():
     
     return list(usb.core.find(find_all = True, custom_match = is_usbtmc_device))
 
-def find_device(idVendor = None, idProduct = None, iSerial = None):
-    "Find USBTMC instrument"
-    
-    devs = list_devices()
-    
-    if len(devs) == 0:
-        return None
-    
+def get_serial(dev):
+    "Read (and cache) the serial number string of a device, '' if unreadable"
+    key = (dev.bus, dev.address)
+    cached = serial_cache.get(key)
+    if cached is not None and monotonic() - cached[0] < DEVICE_CACHE_TTL:
+        return cached[1]
+    s = ''
+    # try reading serial number
+    try:
+        s = usb.util.get_string(dev, dev.iSerialNumber)
+    except:
+        pass
+    serial_cache[key] = (monotonic(), s)
+    return s
+
+def match_device(devs, idVendor = None, idProduct = None, iSerial = None):
+    "Pick a USBTMC instrument out of a list of devices"
     for dev in devs:
         if dev.idVendor != idVendor or dev.idProduct != idProduct:
             continue
         
-        if iSerial is None:
+        if iSerial is None or iSerial == get_serial(dev):
             return dev
-        else:
-            s = ''
-            
-            # try reading serial number
-            try:
-                s = usb.util.get_string(dev, dev.iSerialNumber)
-            except:
-                pass
-            
-            if iSerial == s:
-                return dev
         
     return None
 
+def is_present(dev):
+    "Check a cached device is still attached with a GET_STATUS request"
+    try:
+        dev.ctrl_transfer(0x80, 0x00, 0, 0, 2)
+        return True
+    except usb.core.USBError:
+        return False
+
+def invalidate_device_cache():
+    "Forget cached devices, call this from hotplug handlers"
+    device_cache.clear()
+    serial_cache.clear()
+
+def enable_hotplug_invalidation():
+    """Invalidate the device cache on hotplug events. Needs libusb1 (the
+    usb1 module) and a libusb with hotplug support; returns False if they
+    are not available, in which case entries expire after DEVICE_CACHE_TTL."""
+    try:
+        import usb1
+    except ImportError:
+        return False
+    
+    context = usb1.USBContext()
+    if hasattr(context, 'open'):
+        context.open()
+    if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+        return False
+    
+    def callback(context, device, event):
+        invalidate_device_cache()
+    
+    context.hotplugRegisterCallback(callback)
+    
+    def handle_events():
+        while True:
+            context.handleEvents()
+    
+    thread = threading.Thread(target=handle_events)
+    thread.daemon = True
+    thread.start()
+    return True
+
+def find_device(idVendor = None, idProduct = None, iSerial = None, use_cache = True):
+    """Find USBTMC instrument. Results are cached for DEVICE_CACHE_TTL
+    seconds; a cached device is checked to still be attached before it is
+    returned."""
+    
+    key = (idVendor, idProduct, iSerial)
+    if use_cache and key in device_cache:
+        found, dev = device_cache[key]
+        if monotonic() - found < DEVICE_CACHE_TTL and is_present(dev):
+            return dev
+        del device_cache[key]
+    
+    dev = match_device(list_devices(), idVendor, idProduct, iSerial)
+    
+    if dev is not None:
+        device_cache[key] = (monotonic(), dev)
+    
+    return dev
+
+def resource_ids(resource):
+    "Return (idVendor, idProduct, iSerial) of a VISA resource string"
+    res = parse_visa_resource_string(resource)
+    
+    if res is None:
+        raise UsbtmcException("Invalid resource string", 'init')
+    
+    if res['arg1'] is None and res['arg2'] is None:
+        raise UsbtmcException("Invalid resource string", 'init')
+    
+    return int(res['arg1'], 0), int(res['arg2'], 0), res['arg3']
+
+def open_instruments(resources, **kwargs):
+    """Open several instruments from one enumeration of the bus.
+    resources is a list of VISA resource strings, kwargs are passed on to
+    each Instrument."""
+    
+    devs = list_devices()
+    instruments = []
+    
+    for resource in resources:
+        key = resource_ids(resource)
+        dev = match_device(devs, *key)
+        if dev is None:
+            raise UsbtmcException("Device not found: %s" % resource, 'open_instruments')
+        device_cache[key] = (monotonic(), dev)
+        instruments.append(Instrument(device=dev, **kwargs))
+    
+    return instruments
+
 class Instrument(object):
     "USBTMC instrument interface client"
     def __init__(self, *args, **kwargs):
@@ -192,6 +461,24 @@ class Instrument(object):
         self.last_btag = 0
         self.last_rstb_btag = 0
 
+        self.coalesce = False
+        self.batch_depth = 0
+        self.batch_owner = None     # thread ident inside the outermost batch()
+        self.write_queue = []
+
+        self.read_buffers = {}
+        self.write_buffers = {}
+
+        self.fast_connect = False
+
+        self.clear_timeout = 10.0
+
+        # serializes transactions, re-entrant so they can be nested
+        self.io_lock = threading.RLock()
+
+        self.metrics = None
+        self.recorder = None
+
         resource = None
         
         # process arguments
@@ -220,21 +507,15 @@ class Instrument(object):
                 self.device = val
             elif op == 'term_char':
                 self.term_char = val
+            elif op == 'coalesce':
+                self.coalesce = val
+            elif op == 'fast_connect':
+                self.fast_connect = val
             elif op == 'resource':
                 resource = val
         
         if resource is not None:
-            res = parse_visa_resource_string(resource)
-
-            if res is None:
-                raise UsbtmcException("Invalid resource string", 'init')
-
-            if res['arg1'] is None and res['arg2'] is None:
-                raise UsbtmcException("Invalid resource string", 'init')
-
-            self.idVendor = int(res['arg1'], 0)
-            self.idProduct = int(res['arg2'], 0)
-            self.iSerial = res['arg3']
+            self.idVendor, self.idProduct, self.iSerial = resource_ids(resource)
         
         # find device
         if self.device is None:
@@ -294,11 +575,104 @@ class Instrument(object):
         if self.bulk_in_ep is None or self.bulk_out_ep is None:
             raise UsbtmcException("Invalid endpoint configuration", 'init')
         
+        if self.fast_connect and self.is_healthy():
+            # skip the reset, and the capability request if it is cached
+            b = self.load_capabilities()
+            if b is None:
+                self.save_capabilities(self.get_capabilities())
+            else:
+                self.parse_capabilities(b)
+            return
+        
         self.reset()
         
         time.sleep(0.01) # prevents a very repeatable pipe error
         
-        self.get_capabilities()
+        b = self.get_capabilities()
+        
+        if self.fast_connect:
+            self.save_capabilities(b)
+    
+    def set_metrics(self, metrics):
+        """Record transfer and command latencies, byte counts and errors in
+        a usbtmc.metrics.Metrics, or stop recording with None. Recording
+        proxies are only installed while metrics are set."""
+        from .metrics import attach, detach
+        with self.io_lock:
+            if metrics is None:
+                detach(self)
+            else:
+                attach(self, metrics)
+    
+    def start_recording(self, path, hash_threshold = 4096):
+        """Log every transfer to a binary trace file until stop_recording(),
+        see usbtmc.trace. Bulk-OUT payloads above hash_threshold bytes are
+        stored as a SHA-1 digest."""
+        from .trace import start_recording
+        with self.io_lock:
+            start_recording(self, path, hash_threshold)
+    
+    def stop_recording(self):
+        "Stop recording and close the trace file"
+        from .trace import stop_recording
+        with self.io_lock:
+            stop_recording(self)
+    
+    def is_healthy(self):
+        "Check the device answers and neither bulk endpoint is halted"
+        try:
+            for ep in (self.bulk_out_ep, self.bulk_in_ep):
+                status = self.device.ctrl_transfer(0x82, 0x00, 0, ep.bEndpointAddress, 2)
+                if status[0] & 1:
+                    return False
+            return True
+        except usb.core.USBError:
+            return False
+    
+    def capability_key(self):
+        return "%04x:%04x:%s" % (self.device.idVendor, self.device.idProduct,
+                                 self.iSerial or get_serial(self.device))
+    
+    def load_capabilities(self):
+        """Return the cached GET_CAPABILITIES response of this device, or None
+        if there is none or the device no longer matches it"""
+        try:
+            with open(CAPABILITY_CACHE, 'r') as f:
+                entry = json.load(f).get(self.capability_key())
+        except (IOError, OSError, ValueError):
+            return None
+        if entry is None or \
+           entry['bcdDevice'] != self.device.bcdDevice or \
+           entry['bInterfaceProtocol'] != self.iface.bInterfaceProtocol:
+            return None
+        return entry['capabilities']
+    
+    def save_capabilities(self, b):
+        """Store a GET_CAPABILITIES response in CAPABILITY_CACHE. The file is
+        written under a temporary name and moved into place, so readers never
+        see it half written"""
+        try:
+            with open(CAPABILITY_CACHE, 'r') as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            cache = {}
+        cache[self.capability_key()] = dict(
+            capabilities = list(b),
+            bcdDevice = self.device.bcdDevice,
+            bInterfaceProtocol = self.iface.bInterfaceProtocol
+        )
+        tmp = None
+        try:
+            directory = os.path.dirname(CAPABILITY_CACHE)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp, CAPABILITY_CACHE)
+        except (IOError, OSError):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
     
     def reset(self):
         if os.name == 'posix':
@@ -315,6 +689,11 @@ class Instrument(object):
             self.iface.index,
             0x0018,
             timeout=self.timeout)
+        self.parse_capabilities(b)
+        return b
+    
+    def parse_capabilities(self, b):
+        "Set the support_* flags from a GET_CAPABILITIES response"
         if (b[0] == USBTMC_STATUS_SUCCESS):
             self.bcdUSBTMC = (b[3] << 8) + b[2]
             self.support_pulse = b[4] & 4 != 0
@@ -324,13 +703,13 @@ class Instrument(object):
 
             if self.is_usb488():
                 self.bcdUSB488 = (b[13] << 8) + b[12]
-                self.support_USB4882 = b[4] & 4 != 0
-                self.support_remote_local = b[4] & 2 != 0
-                self.support_trigger = b[4] & 1 != 0
-                self.support_scpi = b[4] & 8 != 0
-                self.support_SR = b[4] & 4 != 0
-                self.support_RL = b[4] & 2 != 0
-                self.support_DT = b[4] & 1 != 0
+                self.support_USB4882 = b[14] & 4 != 0
+                self.support_remote_local = b[14] & 2 != 0
+                self.support_trigger = b[14] & 1 != 0
+                self.support_scpi = b[15] & 8 != 0
+                self.support_SR = b[15] & 4 != 0
+                self.support_RL = b[15] & 2 != 0
+                self.support_DT = b[15] & 1 != 0
         else:
             raise UsbtmcException("Get capabilities failed", 'get_capabilities')
 
@@ -378,8 +757,9 @@ class Instrument(object):
         return hdr+struct.pack("<Lxxxx", transfer_size)
 
     def pack_usb488_trigger(self):
-        hdr = self.pack_bulk_out_header(USB488_MSGID_TRIGGER)
-        return hdr+b'\x00'*8
+        "Next btag's USB488 TRIGGER transfer, prebuilt in USB488_TRIGGER_PACKETS"
+        self.last_btag = btag = (self.last_btag % 255) + 1
+        return USB488_TRIGGER_PACKETS[btag]
 
     def unpack_bulk_in_header(self, data):
         msgid, btag, btaginverse = struct.unpack_from('BBBx', data)
@@ -391,12 +771,37 @@ class Instrument(object):
         data = data[12:transfer_size+12]
         return (msgid, btag, btaginverse, transfer_size, transfer_attributes, data)
     
+    def get_transfer_buffer(self, buffers, size):
+        """Return a reusable transfer buffer of exactly size bytes from
+        buffers (pyusb transfers the whole array it is given, and copies
+        anything that is not an array('B')). The buffer for full transfers is
+        kept next to the one of the last shorter transfer, so alternating
+        sizes reallocate neither."""
+        buf = buffers.get(size)
+        if buf is None:
+            full = 12 + ((self.max_recv_size + 3) & ~3)
+            for key in list(buffers):
+                if key != full:
+                    del buffers[key]
+            buf = buffers[size] = array.array('B', b'\0'*size)
+        return buf
+    
+    @transaction
     def write_raw(self, data):
-        "Write binary data to instrument"
+        """Write binary data to instrument. data can be any contiguous
+        buffer (bytes, bytearray, array, NumPy array...); each chunk is
+        copied once, into a reused transfer buffer behind its header."""
+        
+        if self.write_queue:
+            self.flush()
+        
+        view = memoryview(data)
+        if view.format != 'B':
+            view = view.cast('B')
         
         eom = False
         
-        num = len(data)
+        num = len(view)
         
         offset = 0
         
@@ -404,18 +809,29 @@ class Instrument(object):
             if num <= self.max_recv_size:
                 eom = True
             
-            block = data[offset:offset+self.max_recv_size]
-            size = len(block)
+            size = min(num, self.max_recv_size)
+            total = 12 + ((size + 3) & ~3)
+            
+            # the short final chunk is packed into its own exact-size buffer
+            buf = self.get_transfer_buffer(self.write_buffers, total)
+            buf_view = memoryview(buf)
             
-            data = self.pack_dev_dep_msg_out_header(size, eom) + block + b'\0'*((4 - (size % 4)) % 4)
+            buf_view[0:12] = self.pack_dev_dep_msg_out_header(size, eom)
+            buf_view[12:12+size] = view[offset:offset+size]
+            buf_view[12+size:total] = b'\0'*(total - 12 - size)
             
-            self.bulk_out_ep.write(data)
+            self.bulk_out_ep.write(buf)
             
             offset += size
             num -= size
 
-    def read_raw(self, num=-1):
-        "Read binary data from instrument"
+    def read_chunks(self, num=-1):
+        """Generator of the payload of each bulk-IN transfer, as memoryviews
+        into a reused buffer that are only valid until the next one. Hold
+        io_lock while iterating when other threads share the instrument."""
+        
+        if self.write_queue:
+            self.flush()
         
         read_len = self.max_recv_size
         if num > 0 and num < self.max_recv_size:
@@ -428,19 +844,18 @@ class Instrument(object):
         if self.term_char is not None:
             term_char = self.term_char
         
-        read_data = b''
-        
         while not eom:
             req = self.pack_dev_dep_msg_in_header(read_len, term_char)
             self.bulk_out_ep.write(req)
             
-            resp = self.bulk_in_ep.read(read_len+12, timeout = self.timeout)
-            
-            msgid, btag, btaginverse, transfer_size, transfer_attributes, data = self.unpack_dev_dep_resp_header(resp.tostring())
+            # room for the header and alignment padding
+            buf = self.get_transfer_buffer(self.read_buffers,
+                                           12 + ((read_len + 3) & ~3))
+            count = self.bulk_in_ep.read(buf, timeout = self.timeout)
             
-            eom = transfer_attributes & 1
+            data, eom = self.unpack_read_buffer(buf, count, self.last_btag)
             
-            read_data += data
+            yield data
 
             # Advantest devices never signal EOI and may only send one read packet
             if self.advantest_quirk:
@@ -452,9 +867,58 @@ class Instrument(object):
                     break
                 if num < read_len:
                     read_len = num
+    
+    def unpack_read_buffer(self, buf, count, btag):
+        "Check the DEV_DEP_MSG_IN header in buf, return (payload view, eom)"
+        msgid, resp_btag, btaginverse, transfer_size, transfer_attributes = \
+            struct.unpack_from('<BBBxLBxxx', buf)
+        if resp_btag != btag:
+            raise UsbtmcException("Read btag mismatch", 'read_raw')
+        data = memoryview(buf)[12:min(12+transfer_size, count)]
+        return data, transfer_attributes & 1
+    
+    @transaction
+    def read_raw(self, num=-1):
+        """Read binary data from instrument, returned as a bytearray that
+        each transfer is copied into once"""
+        
+        if num > 0:
+            read_data = bytearray(num)
+            del read_data[self.read_into(read_data, num):]
+            return read_data
+        
+        read_data = bytearray()
+        
+        for data in self.read_chunks(num):
+            read_data += data
             
         return read_data
     
+    @transaction
+    def read_into(self, buffer, num=-1):
+        """Read binary data from instrument straight into a writable buffer
+        (bytearray, array, NumPy array...), at most len(buffer) bytes or num
+        if given. Returns the number of bytes read. Anything the instrument
+        sends beyond that is left for the next read."""
+        
+        view = memoryview(buffer)
+        if view.format != 'B':
+            view = view.cast('B')
+        if num < 0 or num > len(view):
+            num = len(view)
+        
+        offset = 0
+        
+        for data in self.read_chunks(num):
+            size = len(data)
+            if offset + size > len(view):
+                raise UsbtmcException("Buffer too small", 'read_into')
+            view[offset:offset+size] = data
+            offset += size
+        
+        return offset
+    
+    @transaction
     def ask_raw(self, data, num=-1):
         "Write then read binary data"
         # Advantest/ADCMT hardware won't respond to a command unless it's in Local Lockout mode
@@ -468,20 +932,67 @@ class Instrument(object):
             if self.advantest_quirk and not was_locked:
                 self.unlock()
     
+    @transaction
     def write(self, message, encoding = 'utf-8'):
         "Write string to instrument"
         if type(message) is tuple or type(message) is list:
-            # recursive call for a list of commands
-            for message_i in message:
-                self.write(message_i, encoding)
+            if self.batch_depth > 0:
+                for message_i in message:
+                    self.write_queue.append(str(message_i).encode(encoding))
+            elif self.coalesce:
+                for data in join_commands([str(m).encode(encoding) for m in message],
+                                          self.max_recv_size):
+                    self.write_raw(data)
+            else:
+                # recursive call for a list of commands
+                for message_i in message:
+                    self.write(message_i, encoding)
+            return
+        
+        if self.batch_depth > 0:
+            self.write_queue.append(str(message).encode(encoding))
             return
         
         self.write_raw(str(message).encode(encoding))
+    
+    @transaction
+    def flush(self):
+        "Send commands queued by batch() as few coalesced messages"
+        queue = self.write_queue
+        self.write_queue = []
+        for data in join_commands(queue, self.max_recv_size):
+            self.write_raw(data)
+    
+    @contextlib.contextmanager
+    def batch(self):
+        """Queue writes until the outermost batch() block exits, then send
+        them coalesced with flush(). Reads flush the queue first, so a query
+        written in the block goes out in the same message as the queued
+        commands. The block holds io_lock, so other threads wait until the
+        batch has been sent.
+        
+        Do not wait inside the block for calls that run on another thread
+        (Session futures, usbtmc.aio coroutines): they need io_lock and
+        cannot start before the block exits. usbtmc.aio raises
+        UsbtmcException instead of deadlocking; see batch_owner."""
+        with self.io_lock:
+            self.batch_depth += 1
+            if self.batch_depth == 1:
+                self.batch_owner = threading.current_thread().ident
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.batch_owner = None
+                    self.flush()
 
+    @transaction
     def read(self, num=-1, encoding = 'utf-8'):
         "Read string from instrument"
         return self.read_raw(num).decode(encoding).rstrip('\r\n')
 
+    @transaction
     def ask(self, message, num=-1, encoding = 'utf-8'):
         "Write then read string"
         if type(message) is tuple or type(message) is list:
@@ -502,8 +1013,36 @@ class Instrument(object):
             if self.advantest_quirk and not was_locked:
                 self.unlock()
     
+    @transaction
+    def ask_batch(self, messages, types = None, encoding = 'utf-8'):
+        """Send several queries as one ';' joined message and split the
+        single response into one result per query. Definite length block
+        responses are returned as their payload bytes. types is an optional
+        list of converters (e.g. int, float, or None to keep the string)."""
+        results = []
+        for data in join_commands([str(m).encode(encoding) for m in messages],
+                                  self.max_recv_size):
+            results.extend(split_response(self.ask_raw(data)))
+        
+        if len(results) != len(messages):
+            raise UsbtmcException("Expected %d responses, got %d" %
+                                  (len(messages), len(results)), 'ask_batch')
+        
+        for i, field in enumerate(results):
+            if field[:1] == b'#':
+                value = unpack_block(field)
+            else:
+                value = field.decode(encoding)
+            if types is not None and types[i] is not None:
+                value = types[i](value)
+            results[i] = value
+        return results
+    
+    @transaction
     def read_stb(self):
         "Read status byte"
+        if self.write_queue:
+            self.flush()
         if self.is_usb488():
             rstb_btag = (self.last_rstb_btag % 128) + 1
             if rstb_btag < 2:
@@ -535,15 +1074,64 @@ class Instrument(object):
                 raise UsbtmcException("Read status failed", 'read_stb')
         return int(self.ask("*STB?"))
 
+    @transaction
+    def wait_opc(self, timeout = 10.0):
+        """Wait until the instrument has finished all pending operations.
+        
+        Enables the operation complete event (*ESE 1) as a service request
+        (*SRE 32) and sends *OPC. The service request is then waited for on
+        the interrupt endpoint, or, without one, the status byte is polled
+        with exponential backoff. Returns as soon as the instrument is done
+        and raises UsbtmcException after timeout seconds. The event status
+        register is read, and so cleared, before *OPC is sent and again on
+        return, also on a timeout, so an OPC bit left over from an earlier
+        wait neither ends this one early nor masks its service request. The
+        event enable registers are left set."""
+        self.ask('*ESR?;*ESE 1;*SRE 32;*OPC')
+        
+        esr = None
+        try:
+            if self.interrupt_in_ep is not None and self.is_usb488():
+                deadline = monotonic() + timeout
+                while True:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise UsbtmcException("Operation did not complete", 'wait_opc')
+                    try:
+                        resp = self.interrupt_in_ep.read(2, timeout = max(1, int(remaining*1000)))
+                    except usb.core.USBError as e:
+                        if is_timeout(e):
+                            continue
+                        raise
+                    # SRQ notification: bNotify1 0x81, bNotify2 is the status
+                    # byte. One queued by an earlier wait that timed out is
+                    # stale, so check that the operation is complete.
+                    if resp[0] == 0x81 and resp[1] & 0x20:
+                        esr = int(self.ask('*ESR?'))
+                        if esr & 0x01:
+                            break
+            else:
+                for _ in backoff(timeout):
+                    if self.read_stb() & 0x20:
+                        break
+                else:
+                    raise UsbtmcException("Operation did not complete", 'wait_opc')
+        finally:
+            if esr is None or not esr & 0x01:
+                self.ask('*ESR?')
+    
+    @transaction
     def trigger(self):
-        "Send trigger command"
+        """Send trigger command: a single 12 byte USB488 TRIGGER transfer if
+        the device supports it, *TRG otherwise"""
+        if self.write_queue:
+            self.flush()
         if self.support_trigger:
-            data = self.pack_usb488_trigger()
-            print(repr(data))
-            self.bulk_out_ep.write(data)
+            self.bulk_out_ep.write(self.pack_usb488_trigger())
         else:
             self.write("*TRG")
     
+    @transaction
     def clear(self):
         "Send clear command"
         # Send INITIATE_CLEAR
@@ -556,7 +1144,7 @@ class Instrument(object):
             timeout=self.timeout)
         if (b[0] == USBTMC_STATUS_SUCCESS):
             # Initiate clear succeeded, wait for completion
-            while True:
+            for _ in backoff(self.clear_timeout):
                 # Check status
                 b = self.device.ctrl_transfer(
                     usb.util.build_request_type(usb.util.CTRL_IN, usb.util.CTRL_TYPE_CLASS, usb.util.CTRL_RECIPIENT_INTERFACE),
@@ -565,10 +1153,10 @@ class Instrument(object):
                     self.iface.index,
                     0x0002,
                     timeout=self.timeout)
-                if (b[0] == USBTMC_STATUS_PENDING):
-                    time.sleep(0.1)
-                else:
+                if (b[0] != USBTMC_STATUS_PENDING):
                     break
+            else:
+                raise UsbtmcException("Clear timed out", 'clear')
             # Clear halt condition
             self.device.clear_halt(self.bulk_out_ep)
     
@@ -580,6 +1168,7 @@ class Instrument(object):
         "Send local command"
         raise NotImplementedError()
     
+    @transaction
     def lock(self):
         "Send lock command"
         if self.advantest_quirk:
@@ -590,6 +1179,7 @@ class Instrument(object):
         else:
             raise NotImplementedError()
     
+    @transaction
     def unlock(self):
         "Send unlock command"
         if self.advantest_quirk: